@@ -0,0 +1,69 @@
+"""
+Measure offline IP lookups per second.
+
+A synthetic index of contiguous /20 ranges is built in a temporary
+directory, then random addresses are resolved against it.
+
+Usage: python benchmarks/bench_ipdb.py [--ranges 200000] [--lookups 500000]
+"""
+
+import argparse
+import os
+import random
+import socket
+import struct
+import tempfile
+import time
+
+from async_weather_sdk.ipdb import IPIndex, build_index
+
+
+def int_to_ip(value):
+    return socket.inet_ntoa(struct.pack("!I", value))
+
+
+def synthetic_rows(count):
+    for i in range(count):
+        start = (1 << 24) + i * 4096
+        yield dict(
+            start_ip=int_to_ip(start),
+            end_ip=int_to_ip(start + 4095),
+            adcode=str(110000 + i % 3000),
+            province=f"省{i % 34}",
+            city=f"市{i % 3000}",
+            district="",
+        )
+
+
+def main(ranges, lookups, use_mmap):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ip.idx")
+        started = time.perf_counter()
+        build_index(synthetic_rows(ranges), path)
+        print(f"build:   {time.perf_counter() - started:10.2f} s")
+        print(f"size:    {os.path.getsize(path) / 1024 / 1024:10.2f} MiB")
+
+        started = time.perf_counter()
+        index = IPIndex.open(path, use_mmap=use_mmap)
+        print(f"open:    {(time.perf_counter() - started) * 1000:10.2f} ms")
+
+        upper = (1 << 24) + ranges * 4096
+        ips = [
+            int_to_ip(random.randrange(1 << 24, upper)) for _ in range(lookups)
+        ]
+        started = time.perf_counter()
+        for ip in ips:
+            index.lookup(ip)
+        elapsed = time.perf_counter() - started
+        index.close()
+
+    print(f"lookups: {lookups / elapsed:10.0f} /s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--ranges", type=int, default=200000)
+    parser.add_argument("--lookups", type=int, default=500000)
+    parser.add_argument("--no-mmap", action="store_true")
+    args = parser.parse_args()
+    main(args.ranges, args.lookups, not args.no_mmap)
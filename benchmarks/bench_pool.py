@@ -0,0 +1,88 @@
+"""
+Compare request throughput with and without connection pooling.
+
+A local aiohttp server stands in for the upstream API. The "unpooled" run
+mimics the old behaviour of ``BaseClient.request`` by opening a new session
+(and therefore a new TCP connection) for every call. Request coalescing is
+turned off in both runs so that identical concurrent GETs all reach the
+server and only the connection handling differs.
+
+Usage: python benchmarks/bench_pool.py [--requests 2000] [--concurrency 50]
+"""
+
+import argparse
+import time
+
+import aiohttp
+import asyncio
+from aiohttp import web
+
+from async_weather_sdk.base import BaseClient
+
+
+async def handler(request):
+    return web.json_response({"status": 200, "message": "OK", "data": {}})
+
+
+async def start_server():
+    app = web.Application()
+    app.router.add_get("/weather/common", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}/"
+
+
+async def run(requests, concurrency, fetch):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one():
+        async with semaphore:
+            await fetch()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_one() for _ in range(requests)))
+    return requests / (time.perf_counter() - started)
+
+
+async def main(requests, concurrency):
+    runner, endpoint = await start_server()
+    try:
+
+        async def unpooled():
+            async with aiohttp.ClientSession() as session:
+                client = BaseClient(
+                    endpoint, session=session, coalesce_requests=False
+                )
+                await client.request("/weather/common")
+
+        async with BaseClient(
+            endpoint,
+            limit_per_host=concurrency,
+            warmup_connections=10,
+            coalesce_requests=False,
+        ) as client:
+
+            async def pooled():
+                await client.request("/weather/common")
+
+            without_pool = await run(requests, concurrency, unpooled)
+            with_pool = await run(requests, concurrency, pooled)
+    finally:
+        await runner.cleanup()
+
+    print(f"without pooling: {without_pool:10.1f} req/s")
+    print(f"with pooling:    {with_pool:10.1f} req/s")
+    print(f"speedup:         {with_pool / without_pool:10.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(
+        main(args.requests, args.concurrency)
+    )
@@ -1,11 +1,57 @@
+import functools
 import logging
-from typing import Optional
-from urllib.parse import urljoin
+import time
+from typing import Any, Hashable, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
 
 import aiohttp
 import asyncio
 from aiohttp import web
 
+from .breaker import CircuitBreaker
+from .concurrency import AdaptiveLimiter
+from .deadline import Deadline, DeadlineExceeded
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
+from .scheduler import NORMAL, PriorityScheduler, Ticket
+from .shedding import LoadShedder
+
+COALESCED_METHODS = frozenset(("GET", "HEAD"))
+RETRIED_METHODS = frozenset(("GET", "HEAD"))
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    hash(value)
+    return value
+
+
+class _InflightRequest(object):
+    def __init__(
+        self,
+        task: asyncio.Future,
+        ticket: Optional[Ticket],
+        deadline: Optional[Deadline],
+    ):
+        self.task = task
+        self.ticket = ticket
+        self.deadline = deadline
+        self.waiters = 0
+
+    def covers(self, deadline: Optional[Deadline]) -> bool:
+        """
+        Tell whether the shared call may run as long as a caller with that
+        deadline is willing to wait.
+        """
+        if self.deadline is None or self.deadline is deadline:
+            return True
+        if deadline is None:
+            return False
+        return self.deadline.remaining() >= deadline.remaining()
+
 
 class BaseClient(object):
     endpoint = None
@@ -15,29 +61,353 @@ class BaseClient(object):
         endpoint: str,
         session: Optional[aiohttp.ClientSession] = None,
         logger: Optional[logging.Logger] = None,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 30,
+        ttl_dns_cache: Optional[int] = 300,
+        warmup_connections: int = 0,
+        coalesce_requests: bool = True,
+        rate_limiter: Optional[RateLimiter] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        concurrency_limiter: Optional[AdaptiveLimiter] = None,
+        scheduler: Optional[PriorityScheduler] = None,
+        priority: str = NORMAL,
+        load_shedder: Optional[LoadShedder] = None,
     ):
         """
         Implement client that performs weather API requests.
 
+        When no session is given, the client lazily creates one on the first
+        request and keeps it (with its connection pool) until ``aclose()`` is
+        called or the ``async with`` block exits.
+
         :param endpoint: The base endpoint URL
         :param session: Optionally specify the aiohttp session
         :param logger: An optional logger
+        :param limit: Total number of simultaneous pooled connections
+        :param limit_per_host: Number of simultaneous connections to the same
+                               host, 0 means no limit
+        :param keepalive_timeout: Seconds an idle connection is kept alive
+        :param ttl_dns_cache: Seconds resolved DNS entries are cached,
+                              None means forever
+        :param warmup_connections: Number of connections opened to the
+                                   endpoint when entering the client context
+        :param coalesce_requests: Share one in-flight upstream call between
+                                  concurrent identical GET/HEAD requests
+        :param rate_limiter: Optional limiter every upstream call waits for,
+                             it can be shared between clients
+        :param retry_policy: Optional retry and hedging policy of GET/HEAD
+                             requests
+        :param circuit_breaker: Optional per-host circuit breaker failing
+                                fast while a host is unhealthy
+        :param concurrency_limiter: Optional per-host limit of in-flight
+                                    upstream calls adapting to latency,
+                                    it can be shared between clients
+        :param scheduler: Optional priority scheduler of upstream calls,
+                          share it between clients competing for the same
+                          connections
+        :param priority: Priority of requests that do not set one
+        :param load_shedder: Optional load shedder refusing new low-priority
+                             upstream calls while overloaded, it can be
+                             shared between clients
         """
         self.endpoint = endpoint or self.endpoint
         self.logger = logger or logging.getLogger(__name__)
         self.session = session
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.warmup_connections = warmup_connections
+        self.coalesce_requests = coalesce_requests
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.concurrency_limiter = concurrency_limiter
+        self.scheduler = scheduler
+        self.priority = priority
+        self.load_shedder = load_shedder
+        self._session = None
+        self._inflight = {}
+
+    async def __aenter__(self):
+        if self.warmup_connections:
+            await self.warmup(self.warmup_connections)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
 
     def _get_url(self, url):
         if self.endpoint and not url.startswith(("http://", "https://")):
             return urljoin(self.endpoint, url)
         return url
 
+    def _create_connector(self) -> aiohttp.TCPConnector:
+        return aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.ttl_dns_cache,
+        )
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """
+        Return the session used for requests.
+
+        The session passed to the constructor always wins, otherwise the
+        client-owned pooled session is created on first use.
+        """
+        if self.session is not None:
+            return self.session
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=self._create_connector(), raise_for_status=True
+            )
+        return self._session
+
+    async def warmup(self, connections: int = 1):
+        """
+        Pre-open connections to the endpoint so that the first requests do
+        not pay for the TCP and TLS handshakes.
+
+        :param connections: Number of connections to open concurrently
+        """
+        if not self.endpoint:
+            return
+        session = self.get_session()
+
+        async def _open():
+            try:
+                async with session.head(self.endpoint, raise_for_status=False):
+                    pass
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.logger.warning(
+                    "Failed to warm up %s, %s", self.endpoint, e
+                )
+
+        await asyncio.gather(*(_open() for _ in range(connections)))
+
+    async def aclose(self):
+        """
+        Close the client-owned session. A session passed to the constructor
+        is left for its owner to close.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _coalesce_key(self, method: str, url: str, aio_kwargs: dict):
+        if (
+            not self.coalesce_requests
+            or method.upper() not in COALESCED_METHODS
+        ):
+            return None
+        try:
+            return method.upper(), url, _freeze(aio_kwargs)
+        except TypeError:
+            return None
+
+    def _forget_inflight(self, key, inflight: _InflightRequest, _task):
+        if self._inflight.get(key) is inflight:
+            del self._inflight[key]
+
     async def request(
-        self, url: str, method: Optional[str] = "GET", **aio_kwargs
+        self,
+        url: str,
+        method: Optional[str] = "GET",
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        **aio_kwargs
     ):
-        self.logger.debug("Fetch data from %s, %s", url, aio_kwargs)
+        """
+        Perform a request against the endpoint and return the decoded body.
+
+        Concurrent identical GET/HEAD requests share a single upstream call:
+        every waiter receives its result or exception. A cancelled waiter
+        does not affect the others, and the upstream call is cancelled once
+        no waiter is left. A more urgent waiter raises the priority of the
+        shared call. A waiter only joins a call whose deadline leaves it at
+        least as much time, and stops waiting when its own deadline is
+        over, so callers never fail on the budget of another one.
+
+        While the load shedder reports an overload, a request of a shed
+        priority that would start a new upstream call raises
+        ``LoadShedError`` at once.
+
+        :param url: Absolute URL or a path relative to the endpoint
+        :param method: HTTP method
+        :param priority: ``interactive``, ``normal`` or ``background``,
+                         defaults to the client priority
+        :param deadline: Optional time budget, every upstream call of the
+                         request gets the remaining budget as timeout
+        :param aio_kwargs: Extra arguments passed to aiohttp
+        """
         req_url = self._get_url(url)
-        session = self.session or aiohttp.ClientSession(raise_for_status=True)
+        priority = priority or self.priority
+        key = self._coalesce_key(method, req_url, aio_kwargs)
+        inflight = None if key is None else self._inflight.get(key)
+        if inflight is not None and not inflight.covers(deadline):
+            # Start a call of its own, later callers join the looser one
+            inflight = None
+        if inflight is not None:
+            self.logger.debug("Join in-flight request %s, %s", url, aio_kwargs)
+            if inflight.ticket is not None:
+                self.scheduler.promote(inflight.ticket, priority)
+        else:
+            ticket = None
+            if self.scheduler is not None:
+                ticket = self.scheduler.ticket(priority)
+            # Only new upstream calls are shed, joining one costs nothing
+            shedder = self.load_shedder
+            if shedder is not None:
+                shedder.admit(priority)
+            call = self._scheduled(
+                ticket, url, req_url, method, deadline=deadline, **aio_kwargs
+            )
+            if key is None:
+                try:
+                    return await call
+                finally:
+                    if shedder is not None:
+                        shedder.done()
+
+            task = asyncio.ensure_future(call)
+            inflight = self._inflight[key] = _InflightRequest(
+                task, ticket, deadline
+            )
+            task.add_done_callback(
+                functools.partial(self._forget_inflight, key, inflight)
+            )
+            if shedder is not None:
+                task.add_done_callback(shedder.done)
+
+        inflight.waiters += 1
+        try:
+            if deadline is None or inflight.deadline is deadline:
+                return await asyncio.shield(inflight.task)
+            try:
+                return await asyncio.wait_for(
+                    asyncio.shield(inflight.task), deadline.remaining()
+                )
+            except asyncio.TimeoutError as e:
+                if inflight.task.done():
+                    raise
+                raise DeadlineExceeded(url, deadline) from e
+        finally:
+            inflight.waiters -= 1
+            if not inflight.waiters and not inflight.task.done():
+                inflight.task.cancel()
+
+    async def _scheduled(
+        self,
+        ticket: Optional[Ticket],
+        url: str,
+        req_url: str,
+        method: str,
+        **aio_kwargs
+    ):
+        if ticket is None:
+            return await self._request(url, req_url, method, **aio_kwargs)
+        await self.scheduler.acquire(ticket)
+        try:
+            return await self._request(url, req_url, method, **aio_kwargs)
+        finally:
+            self.scheduler.release(ticket)
+
+    def _rate_limit_key(
+        self, req_url: str, aio_kwargs: dict
+    ) -> Tuple[str, Hashable]:
+        """
+        Return the (host, key) budget of a request in the rate limiter.
+        """
+        return urlsplit(req_url).hostname, None
+
+    async def _request(
+        self,
+        url: str,
+        req_url: str,
+        method: str,
+        deadline: Optional[Deadline] = None,
+        **aio_kwargs
+    ):
+        def send():
+            return self._send(url, req_url, method, deadline, **aio_kwargs)
+
+        try:
+            if (
+                self.retry_policy is not None
+                and method.upper() in RETRIED_METHODS
+            ):
+                return await self.retry_policy.call(send)
+            return await send()
+        except DeadlineExceeded:
+            raise
+        except asyncio.TimeoutError as e:
+            if deadline is not None:
+                raise DeadlineExceeded(url, deadline) from e
+            raise web.HTTPBadRequest(reason="HTTP Request Timeout")
+
+    def _is_throttled(self, res: Any) -> bool:
+        """
+        Tell whether a successful response body reports that the upstream
+        throttled the request.
+        """
+        return False
+
+    async def _send(
+        self,
+        url: str,
+        req_url: str,
+        method: str,
+        deadline: Optional[Deadline] = None,
+        **aio_kwargs
+    ):
+        if deadline is not None:
+            # Every attempt only gets what is left of the budget
+            deadline.check(url)
+            aio_kwargs["timeout"] = deadline.client_timeout(url)
+        host = urlsplit(req_url).hostname
+        breaker = self.circuit_breaker
+        limiter = self.concurrency_limiter
+        if breaker is not None:
+            breaker.before(host)
+        acquired = False
+        started = None
+        res = error = None
+        try:
+            if limiter is not None:
+                await limiter.acquire(host)
+                acquired = True
+            if self.rate_limiter is not None:
+                waited = await self.rate_limiter.acquire(
+                    *self._rate_limit_key(req_url, aio_kwargs)
+                )
+                if waited:
+                    self.logger.debug("Rate limited %s for %.3fs", url, waited)
+            started = time.monotonic()
+            res = await self._fetch(url, req_url, method, **aio_kwargs)
+            return res
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # Waiting for a slot or a token is not upstream latency
+            latency = 0 if started is None else time.monotonic() - started
+            if acquired:
+                limiter.release(
+                    host,
+                    latency,
+                    error,
+                    throttled=error is None and self._is_throttled(res),
+                )
+            if breaker is not None:
+                breaker.after(host, latency, error)
+
+    async def _fetch(self, url: str, req_url: str, method: str, **aio_kwargs):
+        self.logger.debug("Fetch data from %s, %s", url, aio_kwargs)
+        session = self.get_session()
         try:
             async with session.request(method, req_url, **aio_kwargs) as resp:
                 if "json" in resp.headers.get("CONTENT-TYPE"):
@@ -46,14 +416,9 @@ class BaseClient(object):
                     res = await resp.text()
                 self.logger.debug("Data fetched %r", res)
                 return res
-        except asyncio.TimeoutError:
-            raise web.HTTPBadRequest(reason="HTTP Request Timeout")
         except (
             aiohttp.ClientResponseError,
             aiohttp.ClientConnectionError,
         ) as e:
             self.logger.warning("Error when getting %s, %s", url, e)
             raise e
-        finally:
-            if not self.session and not session.closed:
-                await session.close()
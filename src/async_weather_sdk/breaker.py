@@ -0,0 +1,206 @@
+"""
+Per-host circuit breaker.
+
+A circuit is closed while its host is healthy. It opens when, over a
+sliding window, too many requests fail or are too slow, and then fails
+fast with ``CircuitOpenError`` instead of waiting for timeouts. After a
+cool-off it turns half-open and lets a few probe requests through: their
+success closes it again, a failure opens it for another cool-off.
+
+``CircuitOpenError`` is a connection error, so the caches answer with stale
+entries within their stale-if-error window while a circuit is open.
+"""
+
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import aiohttp
+import asyncio
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(aiohttp.ClientConnectionError):
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(
+            f"Circuit to {host} is open, retry in {retry_after:.1f}s"
+        )
+        self.host = host
+        self.retry_after = retry_after
+
+
+def is_failure(error: BaseException) -> bool:
+    """
+    Tell whether an error counts against the health of a host: connection
+    errors, timeouts and 5xx responses.
+    """
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(
+        error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+    )
+
+
+class Circuit(object):
+    def __init__(self, host: str):
+        self.host = host
+        self.state = CLOSED
+        self.outcomes = deque()
+        self.failures = 0
+        self.slow = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.probe_successes = 0
+        self.trips = 0
+        self.rejected = 0
+
+    def add(self, now: float, failed: bool, slow: bool, window: float):
+        self.outcomes.append((now, failed, slow))
+        self.failures += failed
+        self.slow += slow
+        while self.outcomes and self.outcomes[0][0] <= now - window:
+            _, failed, slow = self.outcomes.popleft()
+            self.failures -= failed
+            self.slow -= slow
+
+    def reset(self):
+        self.outcomes.clear()
+        self.failures = self.slow = 0
+
+    def stats(self) -> dict:
+        return dict(
+            state=self.state,
+            requests=len(self.outcomes),
+            failures=self.failures,
+            slow=self.slow,
+            trips=self.trips,
+            rejected=self.rejected,
+        )
+
+
+class CircuitBreaker(object):
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        slow_rate: float = 0.5,
+        slow_threshold: Optional[float] = None,
+        min_requests: int = 10,
+        window: float = 30,
+        open_seconds: float = 30,
+        half_open_probes: int = 1,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Implement circuit breakers keyed by host.
+
+        :param failure_rate: Share of failed requests in the window that
+                             opens the circuit
+        :param slow_rate: Share of slow requests in the window that opens
+                          the circuit
+        :param slow_threshold: Seconds after which a request counts as
+                               slow, None ignores latency
+        :param min_requests: Requests needed in the window before the rates
+                             are considered
+        :param window: Seconds of history the rates are computed on
+        :param open_seconds: Seconds an open circuit fails fast before
+                             letting probes through
+        :param half_open_probes: Concurrent probes allowed while half-open,
+                                 and successes needed to close the circuit
+        :param timer: Monotonic clock returning seconds
+        """
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.slow_threshold = slow_threshold
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.timer = timer
+        self.circuits = {}
+
+    def circuit(self, host: str) -> Circuit:
+        circuit = self.circuits.get(host)
+        if circuit is None:
+            circuit = self.circuits[host] = Circuit(host)
+        return circuit
+
+    def state(self, host: str) -> str:
+        circuit = self.circuit(host)
+        if (
+            circuit.state == OPEN
+            and self.timer() >= circuit.opened_at + self.open_seconds
+        ):
+            circuit.state = HALF_OPEN
+            circuit.probes = circuit.probe_successes = 0
+        return circuit.state
+
+    def before(self, host: str):
+        """
+        Let a request to a host through, or raise ``CircuitOpenError``.
+        """
+        circuit = self.circuit(host)
+        state = self.state(host)
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN and circuit.probes < self.half_open_probes:
+            circuit.probes += 1
+            return
+        circuit.rejected += 1
+        retry_after = circuit.opened_at + self.open_seconds - self.timer()
+        raise CircuitOpenError(host, max(retry_after, 0))
+
+    def after(
+        self, host: str, latency: float, error: Optional[BaseException] = None
+    ):
+        """
+        Record the outcome of a request let through by ``before``.
+
+        :param host: Host of the request
+        :param latency: Seconds the request took
+        :param error: Exception raised by the request, if any
+        """
+        circuit = self.circuit(host)
+        if isinstance(error, asyncio.CancelledError):
+            # No verdict on the host, just free the probe slot
+            if circuit.state == HALF_OPEN:
+                circuit.probes -= 1
+            return
+
+        now = self.timer()
+        failed = error is not None and is_failure(error)
+        slow = (
+            self.slow_threshold is not None and latency > self.slow_threshold
+        )
+        if circuit.state == HALF_OPEN:
+            if failed or slow:
+                self._open(circuit, now)
+                return
+            circuit.probe_successes += 1
+            if circuit.probe_successes >= self.half_open_probes:
+                circuit.state = CLOSED
+                circuit.reset()
+            return
+        if circuit.state == OPEN:
+            return
+
+        circuit.add(now, failed, slow, self.window)
+        requests = len(circuit.outcomes)
+        if requests < self.min_requests:
+            return
+        if (
+            circuit.failures >= self.failure_rate * requests
+            or circuit.slow >= self.slow_rate * requests
+        ):
+            self._open(circuit, now)
+
+    def _open(self, circuit: Circuit, now: float):
+        circuit.state = OPEN
+        circuit.opened_at = now
+        circuit.trips += 1
+        circuit.reset()
+
+    def stats(self) -> dict:
+        for host in self.circuits:
+            self.state(host)
+        return {host: c.stats() for host, c in self.circuits.items()}
@@ -0,0 +1,248 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional, Union
+
+import aiohttp
+import asyncio
+
+from .scheduler import BACKGROUND
+from .shedding import LoadShedError
+
+# Errors that let a cache answer with a stale entry instead of failing
+STALE_IF_ERROR_EXCEPTIONS = (
+    aiohttp.ClientResponseError,
+    aiohttp.ClientConnectionError,
+)
+
+
+class TTLCache(object):
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 300,
+        timer: Callable[[], float] = time.monotonic,
+        stale_while_revalidate: float = 0,
+        stale_if_error: float = 0,
+        stale_if_overload: float = 0,
+    ):
+        """
+        Implement an in-process cache with bounded size, LRU eviction and
+        per-entry time-to-live.
+
+        ``get_or_load`` additionally supports the stale-while-revalidate and
+        stale-if-error behaviours of RFC 5861: an expired entry is kept for
+        the longest of these windows after its TTL.
+
+        :param maxsize: Maximum number of entries kept in the cache
+        :param ttl: Default lifetime of an entry in seconds
+        :param timer: Monotonic clock returning seconds
+        :param stale_while_revalidate: Seconds after expiry during which the
+                                       stale entry is returned immediately
+                                       and refreshed in the background
+        :param stale_if_error: Seconds after expiry during which the stale
+                               entry is returned if loading a new one fails
+        :param stale_if_overload: Seconds after expiry during which the stale
+                                  entry is returned if loading a new one is
+                                  refused by load shedding
+        """
+        if maxsize <= 0:
+            raise ValueError("Cache maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.stale_if_overload = stale_if_overload
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.stale_hits = 0
+        self.stale_errors = 0
+        self.stale_overloads = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self._data = OrderedDict()
+        self._refreshing = {}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: Hashable):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > self.timer()
+
+    def lookup(self, key: Hashable):
+        """
+        Return the value of a key and its seconds past expiry (negative
+        while fresh) without updating the counters, or ``(None, None)``.
+        Entries too old to be served stale are dropped.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None, None
+        age = self.timer() - entry[0]
+        if age >= self.max_stale:
+            del self._data[key]
+            self.expirations += 1
+            return None, None
+        return entry[1], age
+
+    @property
+    def max_stale(self) -> float:
+        """
+        Seconds an expired entry is kept for one of the stale windows.
+        """
+        return max(
+            self.stale_while_revalidate,
+            self.stale_if_error,
+            self.stale_if_overload,
+            0,
+        )
+
+    def stale_window(self, error: BaseException) -> float:
+        """
+        Return the seconds after expiry during which an entry may be served
+        instead of raising an error from its loader.
+        """
+        if isinstance(error, LoadShedError):
+            return max(self.stale_if_error, self.stale_if_overload)
+        return self.stale_if_error
+
+    def count_stale(self, error: BaseException):
+        if isinstance(error, LoadShedError):
+            self.stale_overloads += 1
+        else:
+            self.stale_errors += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return the cached value and mark it as recently used.
+
+        :param key: Cache key
+        :param default: Returned when the key is missing or expired
+        """
+        value, age = self.lookup(key)
+        if age is None or age >= 0:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return a fresh cached value without touching the LRU order or the
+        hit/miss counters.
+        """
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= self.timer():
+            return default
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Store a value, evicting the least recently used entries when full.
+
+        :param key: Cache key
+        :param value: Value to store
+        :param ttl: Lifetime in seconds, defaults to the cache TTL
+        """
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (self.timer() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def _store(self, key: Hashable, value: Any, ttl):
+        if callable(ttl):
+            ttl = ttl(value)
+        ttl = self.ttl if ttl is None else ttl
+        if ttl > 0:
+            self.set(key, value, ttl)
+
+    async def get_or_load(
+        self,
+        key: Hashable,
+        loader: Callable[..., Awaitable],
+        ttl: Union[None, float, Callable[[Any], Optional[float]]] = None,
+        **load_kwargs
+    ) -> Any:
+        """
+        Return the cached value of a key, loading and storing it on a miss.
+
+        :param key: Cache key
+        :param loader: Coroutine function returning the value to cache. It
+                       is called with ``load_kwargs``, background refreshes
+                       only pass ``priority="background"``.
+        :param ttl: Lifetime in seconds, or a function computing it from the
+                    loaded value. None means the cache TTL, and a value of
+                    0 or less means the loaded value is not stored.
+        :param load_kwargs: Keyword arguments of the loader, for example the
+                            priority and deadline of the caller
+        """
+        value, age = self.lookup(key)
+        if age is not None and age < 0:
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+        if age is not None and age < self.stale_while_revalidate:
+            self.stale_hits += 1
+            self._revalidate(key, loader, ttl)
+            return value
+
+        self.misses += 1
+        stale_value = value
+        try:
+            value = await loader(**load_kwargs)
+        except STALE_IF_ERROR_EXCEPTIONS as e:
+            if age is None or age >= self.stale_window(e):
+                raise
+            self.count_stale(e)
+            return stale_value
+        self._store(key, value, ttl)
+        return value
+
+    def _revalidate(self, key: Hashable, loader, ttl):
+        if key in self._refreshing:
+            return
+        task = asyncio.ensure_future(self._refresh(key, loader, ttl))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _refresh(self, key: Hashable, loader, ttl):
+        self.refreshes += 1
+        try:
+            # Not on behalf of the caller, so neither its priority nor what
+            # is left of its deadline apply
+            value = await loader(priority=BACKGROUND)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Keep serving the stale entry, the next request retries
+            self.refresh_errors += 1
+        else:
+            self._store(key, value, ttl)
+
+    def delete(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return dict(
+            size=len(self._data),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            expirations=self.expirations,
+            stale_hits=self.stale_hits,
+            stale_errors=self.stale_errors,
+            stale_overloads=self.stale_overloads,
+            refreshes=self.refreshes,
+            refresh_errors=self.refresh_errors,
+        )
@@ -0,0 +1,189 @@
+"""
+Adaptive concurrency limiting.
+
+Every host gets an in-flight limit adjusted with AIMD (additive increase,
+multiplicative decrease), as TCP congestion control does: while latency
+stays close to the lowest recently observed, the limit grows by about one
+per round trip, and it is cut by a factor when requests fail, are
+throttled or get much slower than that baseline. Requests over the limit
+wait in line.
+"""
+
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import aiohttp
+import asyncio
+
+from .breaker import is_failure
+
+TOO_MANY_REQUESTS = 429
+
+
+def is_throttled(error: BaseException) -> bool:
+    """
+    Tell whether an error is the upstream asking to slow down.
+    """
+    return (
+        isinstance(error, aiohttp.ClientResponseError)
+        and error.status == TOO_MANY_REQUESTS
+    )
+
+
+class HostLimit(object):
+    def __init__(self, host: str, limit: float, window: int):
+        self.host = host
+        self.limit = limit
+        self.in_flight = 0
+        self.waiters = deque()
+        self.latencies = deque(maxlen=window)
+        self.last_decrease = float("-inf")
+        self.increases = 0
+        self.decreases = 0
+        self.throttled = 0
+        self.max_in_flight = 0
+
+    @property
+    def baseline(self) -> Optional[float]:
+        return min(self.latencies) if self.latencies else None
+
+    def stats(self) -> dict:
+        return dict(
+            limit=self.limit,
+            in_flight=self.in_flight,
+            max_in_flight=self.max_in_flight,
+            queued=len(self.waiters),
+            baseline=self.baseline,
+            increases=self.increases,
+            decreases=self.decreases,
+            throttled=self.throttled,
+        )
+
+
+class AdaptiveLimiter(object):
+    def __init__(
+        self,
+        initial: float = 10,
+        min_limit: float = 1,
+        max_limit: float = 200,
+        backoff: float = 0.5,
+        tolerance: float = 2,
+        window: int = 100,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Implement AIMD concurrency limits keyed by host.
+
+        :param initial: In-flight limit of a new host
+        :param min_limit: Lowest limit
+        :param max_limit: Highest limit
+        :param backoff: Factor applied to the limit on congestion
+        :param tolerance: A request slower than this many times the lowest
+                          recent latency signals congestion
+        :param window: Number of recent latencies the baseline is taken from
+        :param timer: Monotonic clock returning seconds
+        """
+        if not 0 < backoff < 1:
+            raise ValueError("Backoff must be between 0 and 1")
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.window = window
+        self.timer = timer
+        self.hosts = {}
+
+    def host(self, host: str) -> HostLimit:
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostLimit(
+                host, self.initial, self.window
+            )
+        return state
+
+    async def acquire(self, host: str):
+        """
+        Wait for an in-flight slot of a host.
+        """
+        state = self.host(host)
+        if not state.waiters and state.in_flight < int(state.limit):
+            self._take(state)
+            return
+        waiter = asyncio.get_event_loop().create_future()
+        state.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just before the cancellation
+                self._give_back(state)
+            elif waiter in state.waiters:
+                # A release may have popped the cancelled waiter already
+                state.waiters.remove(waiter)
+            raise
+
+    def _take(self, state: HostLimit):
+        state.in_flight += 1
+        state.max_in_flight = max(state.max_in_flight, state.in_flight)
+
+    def _give_back(self, state: HostLimit):
+        state.in_flight -= 1
+        while state.waiters and state.in_flight < int(state.limit):
+            waiter = state.waiters.popleft()
+            if not waiter.done():
+                self._take(state)
+                waiter.set_result(None)
+
+    def release(
+        self,
+        host: str,
+        latency: float,
+        error: Optional[BaseException] = None,
+        throttled: bool = False,
+    ):
+        """
+        Free the slot of a finished request and adjust the limit.
+
+        :param host: Host of the request
+        :param latency: Seconds the request took
+        :param error: Exception raised by the request, if any
+        :param throttled: Whether the upstream reported throttling in an
+                          otherwise successful response
+        """
+        state = self.host(host)
+        if throttled or error is not None and is_throttled(error):
+            state.throttled += 1
+            self.backoff_host(host)
+        elif error is None:
+            baseline = state.baseline
+            state.latencies.append(latency)
+            if baseline is not None and latency > baseline * self.tolerance:
+                self.backoff_host(host)
+            elif state.in_flight >= int(state.limit) - 1:
+                # Only grow a limit that is actually used, by one per
+                # limit's worth of successes
+                state.limit = min(
+                    state.limit + 1 / state.limit, self.max_limit
+                )
+                state.increases += 1
+        elif is_failure(error):
+            self.backoff_host(host)
+        self._give_back(state)
+
+    def backoff_host(self, host: str):
+        """
+        Cut the limit of a host, at most once per baseline latency so that
+        one burst of congestion is not punished many times.
+        """
+        state = self.host(host)
+        now = self.timer()
+        if now - state.last_decrease < (state.baseline or 0):
+            return
+        state.last_decrease = now
+        state.limit = max(state.limit * self.backoff, self.min_limit)
+        state.decreases += 1
+
+    def stats(self) -> dict:
+        return {host: state.stats() for host, state in self.hosts.items()}
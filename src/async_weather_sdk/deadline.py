@@ -0,0 +1,128 @@
+"""
+End-to-end deadlines.
+
+A ``Deadline`` is one time budget shared by every hop of a query, from the
+location lookup to the weather fetch. Each upstream call gets an aiohttp
+timeout computed from what is left of the budget, so sequential calls can
+no longer each use a full timeout. Running out of time raises
+``DeadlineExceeded``, which names the phase the time ran out in and tells
+how long each phase took.
+"""
+
+import inspect
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+import asyncio
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    def __init__(
+        self, phase: str, deadline: "Deadline", hop: Optional[str] = None
+    ):
+        message = f"Deadline of {deadline.timeout}s exceeded in {phase}"
+        if hop:
+            message += f" ({hop})"
+        if deadline.spent:
+            message += ", spent " + ", ".join(
+                f"{name} {seconds:.3f}s"
+                for name, seconds in deadline.spent.items()
+            )
+        super().__init__(message)
+        self.phase = phase
+        self.hop = hop
+        self.timeout = deadline.timeout
+        self.elapsed = deadline.elapsed()
+        self.spent = OrderedDict(deadline.spent)
+
+
+class Deadline(object):
+    def __init__(
+        self,
+        timeout: float,
+        connect_timeout: Optional[float] = None,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Implement a time budget shared by the hops of a query.
+
+        :param timeout: Seconds the whole query may take
+        :param connect_timeout: Upper bound of the seconds each hop may
+                                spend connecting, None for the remaining
+                                budget
+        :param timer: Monotonic clock returning seconds
+        """
+        if timeout <= 0:
+            raise ValueError("Timeout must be positive")
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.timer = timer
+        self.started = timer()
+        self.spent = OrderedDict()
+        self.hop = None
+
+    def elapsed(self) -> float:
+        return self.timer() - self.started
+
+    def remaining(self) -> float:
+        return max(self.timeout - self.elapsed(), 0)
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self, phase: str):
+        """
+        Raise ``DeadlineExceeded`` if no time is left for a phase.
+        """
+        if self.expired:
+            raise DeadlineExceeded(phase, self)
+
+    def client_timeout(
+        self, hop: Optional[str] = None
+    ) -> aiohttp.ClientTimeout:
+        """
+        Return the aiohttp timeout of a hop starting now.
+
+        :param hop: Name of the hop, reported if the phase times out
+        """
+        self.hop = hop
+        remaining = self.remaining()
+        connect = remaining
+        if self.connect_timeout is not None:
+            connect = min(self.connect_timeout, remaining)
+        return aiohttp.ClientTimeout(
+            total=remaining, sock_connect=connect, sock_read=remaining
+        )
+
+    async def run(self, phase: str, awaitable: Awaitable):
+        """
+        Await a phase of the query within the remaining budget, cancelling
+        it when time runs out.
+
+        :param phase: Name of the phase, reported on timeouts
+        :param awaitable: Coroutine or future running the phase
+        """
+        started = self.timer()
+        self.hop = None
+        try:
+            if self.expired:
+                raise asyncio.TimeoutError()
+            return await asyncio.wait_for(awaitable, self.remaining())
+        except asyncio.TimeoutError as e:
+            error = e
+        finally:
+            if (
+                inspect.iscoroutine(awaitable)
+                and inspect.getcoroutinestate(awaitable)
+                == inspect.CORO_CREATED
+            ):
+                # Never started, the budget was already spent
+                awaitable.close()
+            self.spent[phase] = (
+                self.spent.get(phase, 0.0) + self.timer() - started
+            )
+        hop = error.phase if isinstance(error, DeadlineExceeded) else self.hop
+        raise DeadlineExceeded(phase, self, hop) from error
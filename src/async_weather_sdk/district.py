@@ -0,0 +1,245 @@
+"""
+Local snapshot of the province/city/district hierarchy.
+
+The snapshot is built once from the district list API
+(``/ws/district/v1/list``), saved as JSON and indexed by adcode::
+
+    python -m async_weather_sdk.district API_KEY districts.json
+"""
+
+import argparse
+import json
+from typing import Iterable, List, Optional
+
+import asyncio
+
+from .geocoder import ReverseGeocoder
+from .names import NameIndex
+
+# Direct-controlled municipalities list their districts right below the
+# province, and the weather API expects the province name as city name.
+MUNICIPALITIES = frozenset(("11", "12", "31", "50"))
+
+AD_INFO_FIELDS = ("nation", "province", "city", "district", "adcode")
+
+
+def _district(item: dict, level: int, parent: int, **names) -> dict:
+    location = item.get("location") or {}
+    return dict(
+        nation="中国",
+        adcode=int(item["id"]),
+        parent=parent,
+        name=item.get("name") or item.get("fullname", ""),
+        fullname=item.get("fullname", ""),
+        pinyin=item.get("pinyin") or [],
+        level=level,
+        lat=location.get("lat"),
+        lng=location.get("lng"),
+        **names,
+    )
+
+
+def _children(item: dict, items: List[dict]) -> List[dict]:
+    cidx = item.get("cidx")
+    if not cidx:
+        return []
+    return items[cidx[0] : cidx[1] + 1]
+
+
+def _capital(province: dict, cities: List[dict]) -> str:
+    # The province location is its seat of government, which lies in the
+    # capital city, so the nearest city centroid names the capital
+    location = province.get("location")
+    cities = [c for c in cities if c.get("location")]
+    if not location or not cities:
+        return ""
+    capital = min(
+        cities,
+        key=lambda c: (c["location"]["lat"] - location["lat"]) ** 2
+        + (c["location"]["lng"] - location["lng"]) ** 2,
+    )
+    return capital["fullname"]
+
+
+class DistrictSnapshot(object):
+    def __init__(self, districts: Iterable[dict], data_version: str = ""):
+        """
+        Implement an adcode index over a district hierarchy snapshot.
+
+        :param districts: Dicts with ``adcode``, ``parent``, ``province``,
+                          ``city``, ``district``, ``name``, ``fullname``,
+                          ``pinyin``, ``level``, ``lat`` and ``lng`` keys
+        :param data_version: Version of the upstream district data
+        """
+        self.data_version = data_version
+        self._set_districts(districts)
+
+    def _set_districts(self, districts: Iterable[dict]):
+        self.districts = list(districts)
+        self.by_adcode = {d["adcode"]: d for d in self.districts}
+        # Districts without a city cannot be passed to the weather API
+        self.ad_infos = {
+            adcode: {f: d[f] for f in AD_INFO_FIELDS}
+            for adcode, d in self.by_adcode.items()
+            if d["city"]
+        }
+
+    def __len__(self):
+        return len(self.districts)
+
+    @classmethod
+    def from_api_result(
+        cls, result: List[List[dict]], data_version: str = ""
+    ) -> "DistrictSnapshot":
+        """
+        Build a snapshot from the ``result`` of the district list API, a
+        list of levels where parents point at their children with ``cidx``.
+
+        Provinces are given the city the weather API is queried with: the
+        province itself for municipalities, the capital city otherwise.
+        """
+        levels = list(result) + [[], []]
+        districts = []
+        for province in levels[0]:
+            province_name = province["fullname"]
+            province_code = int(province["id"])
+            children = _children(province, levels[1])
+            municipality = province["id"][:2] in MUNICIPALITIES
+            districts.append(
+                _district(
+                    province,
+                    1,
+                    None,
+                    province=province_name,
+                    city=province_name
+                    if municipality
+                    else _capital(province, children),
+                    district="",
+                )
+            )
+            for child in children:
+                if municipality:
+                    names = dict(
+                        city=province_name, district=child["fullname"]
+                    )
+                else:
+                    names = dict(city=child["fullname"], district="")
+                districts.append(
+                    _district(
+                        child,
+                        2,
+                        province_code,
+                        province=province_name,
+                        **names,
+                    )
+                )
+                for grandchild in _children(child, levels[2]):
+                    districts.append(
+                        _district(
+                            grandchild,
+                            3,
+                            int(child["id"]),
+                            province=province_name,
+                            city=names["city"],
+                            district=grandchild["fullname"],
+                        )
+                    )
+        return cls(districts, data_version)
+
+    @classmethod
+    async def fetch(cls, qq_map) -> "DistrictSnapshot":
+        """
+        Download the district hierarchy with a ``QQMap`` client.
+        """
+        res = await qq_map.request("/ws/district/v1/list")
+        if res.get("status") != 0:
+            raise ValueError(f"Failed to fetch district list: {res!r}")
+        return cls.from_api_result(
+            res.get("result", []), res.get("data_version", "")
+        )
+
+    async def refresh(self, qq_map):
+        """
+        Replace the snapshot content with the current upstream data.
+        """
+        snapshot = await self.fetch(qq_map)
+        self.data_version = snapshot.data_version
+        self._set_districts(snapshot.districts)
+
+    @classmethod
+    def load(cls, path: str) -> "DistrictSnapshot":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["districts"], data.get("data_version", ""))
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                dict(data_version=self.data_version, districts=self.districts),
+                f,
+                ensure_ascii=False,
+            )
+
+    def lookup(self, adcode) -> Optional[dict]:
+        """
+        Return the ``ad_info`` of an adcode, or None if it is unknown or
+        has no city to query the weather of.
+        """
+        try:
+            return self.ad_infos.get(int(adcode))
+        except (TypeError, ValueError):
+            return None
+
+    def to_geocoder(self, **kwargs) -> ReverseGeocoder:
+        """
+        Build an offline reverse geocoder from the district centroids,
+        using the most detailed level available at each location.
+        """
+        parents = {d["parent"] for d in self.districts}
+        return ReverseGeocoder(
+            (
+                d
+                for d in self.districts
+                if d["lat"] is not None and d["adcode"] not in parents
+            ),
+            **kwargs,
+        )
+
+    def to_name_index(self, **kwargs) -> NameIndex:
+        """
+        Build a local name index resolving keywords to districts.
+        """
+        return NameIndex(self, **kwargs)
+
+
+async def _build(api_key: str, output: str):
+    from .qq import QQMap
+
+    async with QQMap(api_key) as qq_map:
+        snapshot = await DistrictSnapshot.fetch(qq_map)
+    snapshot.save(output)
+    return snapshot
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m async_weather_sdk.district",
+        description="Download the district hierarchy snapshot.",
+    )
+    parser.add_argument("api_key", help="Tencent Map WebService API key")
+    parser.add_argument("output", help="JSON file to write")
+    args = parser.parse_args(argv)
+
+    loop = asyncio.new_event_loop()
+    try:
+        snapshot = loop.run_until_complete(_build(args.api_key, args.output))
+    finally:
+        loop.close()
+    print(
+        f"Wrote {len(snapshot)} districts "
+        f"(version {snapshot.data_version}) to {args.output}"
+    )
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
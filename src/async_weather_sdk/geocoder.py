@@ -0,0 +1,150 @@
+"""
+Offline reverse geocoder.
+
+District centroids are bucketed into a regular latitude/longitude grid, and
+a point resolves to the district of its nearest centroid. Centroids only
+approximate district boundaries, so a point whose two nearest districts are
+about as close is reported as ambiguous and left to the geocoding API.
+
+The data file is a JSON list of districts::
+
+    [{"adcode": 110105, "province": "北京市", "city": "北京市",
+      "district": "朝阳区", "lat": 39.92148, "lng": 116.44311}, ...]
+"""
+
+import json
+import math
+from typing import Iterable, List, Optional, Tuple
+
+KM_PER_DEGREE = 111.195
+
+
+def parse_coordinates(coordinates: str) -> Optional[Tuple[float, float]]:
+    """
+    Parse a "lat,lng" string, or return None if it is not one.
+    """
+    try:
+        lat, lng = (float(c) for c in coordinates.split(","))
+    except (AttributeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+class ReverseGeocoder(object):
+    def __init__(
+        self,
+        districts: Iterable[dict],
+        cell_size: float = 0.5,
+        max_distance: float = 50,
+        ambiguity_ratio: float = 1.15,
+    ):
+        """
+        Implement a grid-bucketed nearest-centroid reverse geocoder.
+
+        :param districts: Dicts with the ``adcode``, ``province``, ``city``,
+                          ``district``, ``lat`` and ``lng`` keys
+        :param cell_size: Size of a grid cell in degrees
+        :param max_distance: Points farther than this many kilometers from
+                             every centroid are not resolved
+        :param ambiguity_ratio: A point is ambiguous when the nearest
+                                centroid of another district is less than
+                                this many times farther than the nearest
+        """
+        self.cell_size = cell_size
+        self.max_distance = max_distance
+        self.ambiguity_ratio = ambiguity_ratio
+        self.districts = []
+        self.grid = {}
+        self.hits = 0
+        self.misses = 0
+        self.ambiguous = 0
+        for district in districts:
+            lat, lng = float(district["lat"]), float(district["lng"])
+            self.grid.setdefault(self._cell(lat, lng), []).append(
+                len(self.districts)
+            )
+            self.districts.append(
+                (
+                    lat,
+                    lng,
+                    dict(
+                        nation="中国",
+                        province=district.get("province") or "",
+                        city=district.get("city") or "",
+                        district=district.get("district") or "",
+                        adcode=district["adcode"],
+                    ),
+                )
+            )
+
+    def __len__(self):
+        return len(self.districts)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "ReverseGeocoder":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), **kwargs)
+
+    def save(self, path: str):
+        districts = [
+            dict(ad_info, lat=lat, lng=lng)
+            for lat, lng, ad_info in self.districts
+        ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(districts, f, ensure_ascii=False)
+
+    def _cell(self, lat: float, lng: float):
+        return (
+            int(math.floor(lat / self.cell_size)),
+            int(math.floor(lng / self.cell_size)),
+        )
+
+    def nearest(self, lat: float, lng: float, count: int = 2) -> List[tuple]:
+        """
+        Return up to ``count`` (distance in km, ad_info) pairs of the
+        nearest districts within ``max_distance``, nearest first.
+        """
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+        lat_cells = math.ceil(
+            self.max_distance / KM_PER_DEGREE / self.cell_size
+        )
+        lng_cells = math.ceil(
+            self.max_distance / (KM_PER_DEGREE * cos_lat) / self.cell_size
+        )
+        row, col = self._cell(lat, lng)
+
+        found = []
+        for i in range(row - lat_cells, row + lat_cells + 1):
+            for j in range(col - lng_cells, col + lng_cells + 1):
+                for index in self.grid.get((i, j), ()):
+                    d_lat, d_lng, ad_info = self.districts[index]
+                    # Equirectangular approximation, fine at this scale
+                    distance = KM_PER_DEGREE * math.hypot(
+                        d_lat - lat, (d_lng - lng) * cos_lat
+                    )
+                    if distance <= self.max_distance:
+                        found.append((distance, index))
+        found.sort()
+        return [(d, self.districts[i][2]) for d, i in found[:count]]
+
+    def lookup(self, lat: float, lng: float) -> Optional[dict]:
+        """
+        Return the ``ad_info`` of a point, or None when it is too far from
+        any known district or too close to a border to tell.
+        """
+        nearest = self.nearest(lat, lng)
+        if not nearest:
+            self.misses += 1
+            return None
+        if len(nearest) > 1:
+            (first, ad_info), (second, other) = nearest
+            if (
+                other["adcode"] != ad_info["adcode"]
+                and second < first * self.ambiguity_ratio
+            ):
+                self.ambiguous += 1
+                return None
+        self.hits += 1
+        return nearest[0][1]
@@ -0,0 +1,232 @@
+"""
+Offline IP-to-region resolver.
+
+The index file is little-endian and laid out so that the range tables can
+be memory-mapped and binary-searched without being copied::
+
+    header   magic "AWIP", version, range count, record count (4 x uint32)
+    starts   first address of every range, sorted (count x uint32)
+    ends     last address of every range (count x uint32)
+    records  record number of every range (count x uint32)
+    offsets  start of every record in the blob, plus its end (uint32)
+    blob     records as UTF-8 "adcode\\tprovince\\tcity\\tdistrict"
+
+Build an index from a CSV file with the columns ``start_ip``, ``end_ip``,
+``adcode``, ``province``, ``city`` and ``district``::
+
+    python -m async_weather_sdk.ipdb ip_ranges.csv ip_ranges.idx
+"""
+
+import argparse
+import csv
+import mmap
+import socket
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from typing import Iterable, List, Optional, Sequence
+
+MAGIC = b"AWIP"
+VERSION = 1
+HEADER = struct.Struct("<4sIII")
+FIELDS = ("adcode", "province", "city", "district")
+
+
+def ip_to_int(ip: str) -> int:
+    return struct.unpack("!I", socket.inet_aton(ip.strip()))[0]
+
+
+def _uint32_array(values=()) -> array:
+    for typecode in ("I", "L"):
+        if array(typecode).itemsize == 4:
+            return array(typecode, values)
+    raise RuntimeError("No 32-bit unsigned array type")  # pragma: no cover
+
+
+class IPIndex(object):
+    def __init__(
+        self,
+        starts: Sequence[int],
+        ends: Sequence[int],
+        records: Sequence[int],
+        ad_infos: List[dict],
+        closer=None,
+    ):
+        """
+        Implement a sorted, array-backed interval index of IPv4 ranges.
+
+        Use ``IPIndex.open`` to load an index file.
+
+        :param starts: First address of every range, sorted
+        :param ends: Last address of every range
+        :param records: Index into ``ad_infos`` of every range
+        :param ad_infos: Distinct ``ad_info`` dicts
+        :param closer: Optional callback releasing the backing storage
+        """
+        self.starts = starts
+        self.ends = ends
+        self.records = records
+        self.ad_infos = ad_infos
+        self.hits = 0
+        self.misses = 0
+        self._closer = closer
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def open(cls, path: str, use_mmap: bool = True) -> "IPIndex":
+        """
+        Load an index file.
+
+        :param path: Path of a file written by ``build_index``
+        :param use_mmap: Map the range tables instead of reading them
+        """
+        with open(path, "rb") as f:
+            if use_mmap:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = f.read()
+
+        magic, version, count, record_count = HEADER.unpack_from(buf)
+        if magic != MAGIC or version != VERSION:
+            if use_mmap:
+                buf.close()
+            raise ValueError(f"Not an IP index file: {path}")
+
+        offset = HEADER.size
+        tables = []
+        for length in (count, count, count, record_count + 1):
+            end = offset + length * 4
+            tables.append(memoryview(buf)[offset:end])
+            offset = end
+        if sys.byteorder != "little":  # pragma: no cover
+            tables = [cls._swapped(table) for table in tables]
+        else:
+            tables = [table.cast("I") for table in tables]
+        starts, ends, records, offsets = tables
+
+        blob = bytes(buf[offset:])
+        base = offsets[0]
+        ad_infos = [
+            _parse_record(blob[offsets[i] - base : offsets[i + 1] - base])
+            for i in range(record_count)
+        ]
+
+        closer = None
+        if use_mmap:
+
+            def closer():
+                for table in tables:
+                    table.release()
+                buf.close()
+
+        return cls(starts, ends, records, ad_infos, closer)
+
+    @staticmethod
+    def _swapped(table: memoryview):  # pragma: no cover
+        values = _uint32_array()
+        values.frombytes(table.tobytes())
+        values.byteswap()
+        return values
+
+    def close(self):
+        if self._closer is not None:
+            self._closer()
+            self._closer = None
+
+    def lookup(self, ip: str) -> Optional[dict]:
+        """
+        Return the ``ad_info`` of the range containing an IPv4 address, or
+        None when no range contains it.
+        """
+        try:
+            value = ip_to_int(ip)
+        except (OSError, AttributeError):
+            self.misses += 1
+            return None
+        i = bisect_right(self.starts, value) - 1
+        if i < 0 or value > self.ends[i]:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self.ad_infos[self.records[i]]
+
+
+def _parse_record(raw: bytes) -> dict:
+    adcode, province, city, district = raw.decode("utf-8").split("\t")
+    return dict(
+        nation="中国",
+        province=province,
+        city=city,
+        district=district,
+        adcode=int(adcode) if adcode.isdigit() else adcode,
+    )
+
+
+def build_index(rows: Iterable[dict], path: str) -> int:
+    """
+    Write an index file from IP ranges.
+
+    :param rows: Dicts with the ``start_ip``, ``end_ip``, ``adcode``,
+                 ``province``, ``city`` and ``district`` keys
+    :param path: Destination file
+    :return: The number of ranges written.
+    """
+    ranges, record_ids, blobs = [], {}, []
+    for row in rows:
+        start, end = ip_to_int(row["start_ip"]), ip_to_int(row["end_ip"])
+        if start > end:
+            raise ValueError(
+                f"Invalid range {row['start_ip']}-{row['end_ip']}"
+            )
+        fields = "\t".join(str(row.get(f) or "").strip() for f in FIELDS)
+        if fields not in record_ids:
+            record_ids[fields] = len(blobs)
+            blobs.append(fields.encode("utf-8"))
+        ranges.append((start, end, record_ids[fields]))
+
+    ranges.sort()
+    for previous, current in zip(ranges, ranges[1:]):
+        if current[0] <= previous[1]:
+            raise ValueError(f"Overlapping ranges at {current[0]}")
+
+    offsets = _uint32_array()
+    position = 0
+    for blob in blobs:
+        offsets.append(position)
+        position += len(blob)
+    offsets.append(position)
+
+    tables = [_uint32_array(column) for column in zip(*ranges)] or [
+        _uint32_array() for _ in range(3)
+    ]
+    if sys.byteorder != "little":  # pragma: no cover
+        for table in tables + [offsets]:
+            table.byteswap()
+
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(ranges), len(blobs)))
+        for table in tables + [offsets]:
+            table.tofile(f)
+        f.write(b"".join(blobs))
+    return len(ranges)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m async_weather_sdk.ipdb",
+        description="Build an offline IP-to-region index from a CSV file.",
+    )
+    parser.add_argument("source", help="CSV file of IP ranges")
+    parser.add_argument("output", help="Index file to write")
+    args = parser.parse_args(argv)
+
+    with open(args.source, newline="", encoding="utf-8") as f:
+        count = build_index(csv.DictReader(f), args.output)
+    print(f"Wrote {count} ranges to {args.output}")
+
+
+if __name__ == "__main__":  # pragma: no cover
+    main()
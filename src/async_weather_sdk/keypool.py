@@ -0,0 +1,170 @@
+"""
+Pool of Tencent Map WebService API keys.
+
+Requests are spread over the keys round-robin or to the least loaded one.
+A key answering with a quota status is taken out of rotation for a
+cooldown: a second for the per-second quota (120), and until the next day
+for the daily quota (121), unless a shorter ``daily_cooldown`` is given.
+"""
+
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, List, Optional
+
+from .sections import CST
+
+ROUND_ROBIN = "round_robin"
+LEAST_LOADED = "least_loaded"
+
+QPS_EXCEEDED = 120
+DAILY_QUOTA_EXCEEDED = 121
+
+
+def mask_api_key(api_key: str) -> str:
+    """
+    Return an API key shortened to its last characters for logs and
+    metrics.
+    """
+    return f"...{api_key[-4:]}"
+
+
+class KeyState(object):
+    def __init__(self, key: str, daily_quota: Optional[int] = None):
+        """
+        Implement the usage record of one API key.
+
+        :param key: API key
+        :param daily_quota: Requests allowed per day, None if unknown
+        """
+        self.key = key
+        self.daily_quota = daily_quota
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.quota_errors = 0
+        self.used_today = 0
+        self.day = None
+        self.cooldown_until = 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0.0
+
+    def stats(self) -> dict:
+        return dict(
+            in_flight=self.in_flight,
+            requests=self.requests,
+            errors=self.errors,
+            quota_errors=self.quota_errors,
+            error_rate=self.error_rate,
+            used_today=self.used_today,
+            daily_quota=self.daily_quota,
+            cooldown_until=self.cooldown_until,
+        )
+
+
+class APIKeyPool(object):
+    def __init__(
+        self,
+        keys: Iterable[str],
+        strategy: str = ROUND_ROBIN,
+        daily_quota: Optional[int] = None,
+        cooldown: float = 1,
+        daily_cooldown: Optional[float] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Implement a rotation of API keys with per-key usage tracking.
+
+        :param keys: API keys, each given once
+        :param strategy: ``round_robin`` or ``least_loaded``, the key with
+                         the fewest requests in flight
+        :param daily_quota: Requests allowed per key and day, keys are
+                            skipped once they used it up
+        :param cooldown: Seconds a key rests after exceeding its QPS quota
+        :param daily_cooldown: Seconds a key rests after exceeding its daily
+                               quota, None means until midnight UTC+8
+        :param clock: Clock returning the UNIX time
+        """
+        self.keys = [KeyState(key, daily_quota) for key in keys]
+        if not self.keys:
+            raise ValueError("At least one API key is required")
+        self._by_key = {state.key: state for state in self.keys}
+        if len(self._by_key) != len(self.keys):
+            raise ValueError("Duplicate API keys")
+        if strategy not in (ROUND_ROBIN, LEAST_LOADED):
+            raise ValueError(f"Unknown key selection strategy {strategy!r}")
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self.daily_cooldown = daily_cooldown
+        self.clock = clock
+        self._next = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _today(self, now: float):
+        return datetime.fromtimestamp(now, CST).date()
+
+    def _available(self, state: KeyState, now: float) -> bool:
+        if state.cooldown_until > now:
+            return False
+        if state.day != self._today(now):
+            state.day, state.used_today = self._today(now), 0
+        return (
+            state.daily_quota is None or state.used_today < state.daily_quota
+        )
+
+    def acquire(self) -> str:
+        """
+        Pick a key for a request. When every key is resting, the one that
+        becomes available first is used.
+        """
+        now = self.clock()
+        count = len(self.keys)
+        rotation = [self.keys[(self._next + i) % count] for i in range(count)]
+        candidates = [s for s in rotation if self._available(s, now)]
+        if not candidates:
+            state = min(self.keys, key=lambda s: s.cooldown_until)
+        elif self.strategy == LEAST_LOADED:
+            state = min(candidates, key=lambda s: s.in_flight)
+        else:
+            state = candidates[0]
+        self._next = (self.keys.index(state) + 1) % count
+
+        state.in_flight += 1
+        state.requests += 1
+        state.used_today += 1
+        return state.key
+
+    def release(self, key: str, status: Optional[int] = 0):
+        """
+        Record the outcome of a request made with a key.
+
+        :param key: Key returned by ``acquire``
+        :param status: API status of the response, None if it failed
+        """
+        state = self._by_key[key]
+        state.in_flight -= 1
+        if status == 0:
+            return
+        state.errors += 1
+        if status == QPS_EXCEEDED:
+            state.quota_errors += 1
+            state.cooldown_until = self.clock() + self.cooldown
+        elif status == DAILY_QUOTA_EXCEEDED:
+            state.quota_errors += 1
+            now = self.clock()
+            if self.daily_cooldown is not None:
+                state.cooldown_until = now + self.daily_cooldown
+            else:
+                tomorrow = self._today(now) + timedelta(days=1)
+                state.cooldown_until = datetime(
+                    tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=CST
+                ).timestamp()
+
+    def stats(self) -> List[dict]:
+        """
+        Return the usage of every key, with masked key names.
+        """
+        return [dict(key=mask_api_key(s.key), **s.stats()) for s in self.keys]
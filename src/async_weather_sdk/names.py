@@ -0,0 +1,153 @@
+"""
+Local name index mapping location keywords to districts.
+
+Every district of a ``DistrictSnapshot`` is indexed in a character trie
+under its full name (北京市), short name (北京), name without its
+administrative suffix, pinyin (beijing) and combinations with its parent
+(北京朝阳, 北京市朝阳区). Ambiguous names are ranked by how the keyword
+matched, then by administrative level, so 吉林 resolves to 吉林省 before
+吉林市. Provinces carry the city the weather API is queried with, 北京 gives
+(北京市, 北京市) and 河北 the capital (河北省, 石家庄市).
+"""
+
+import unicodedata
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .district import DistrictSnapshot
+
+# Longest first, so 自治区 is stripped before 区
+SUFFIXES = (
+    "特别行政区",
+    "维吾尔自治区",
+    "壮族自治区",
+    "回族自治区",
+    "自治区",
+    "自治州",
+    "自治县",
+    "地区",
+    "新区",
+    "省",
+    "市",
+    "区",
+    "县",
+    "盟",
+    "旗",
+)
+
+# How a keyword matched a district, lower ranks first
+FULL_NAME, SHORT_NAME, PINYIN, PREFIX = range(4)
+
+_END = None
+
+
+def normalize_name(name: str) -> str:
+    name = unicodedata.normalize("NFKC", name or "").casefold()
+    return "".join(c for c in name if c.isalnum())
+
+
+def strip_suffix(name: str) -> str:
+    for suffix in SUFFIXES:
+        if name.endswith(suffix) and len(name) > len(suffix) + 1:
+            return name[: -len(suffix)]
+    return name
+
+
+class NameIndex(object):
+    def __init__(self, snapshot: "DistrictSnapshot", min_prefix: int = 2):
+        """
+        Implement a trie over the names, short forms and pinyin of the
+        districts of a snapshot.
+
+        :param snapshot: District hierarchy snapshot
+        :param min_prefix: Minimum keyword length for prefix matches
+        """
+        self.snapshot = snapshot
+        self.min_prefix = min_prefix
+        self.root = {}
+        self.hits = 0
+        self.misses = 0
+        for district in snapshot.districts:
+            for name, kind in self._names(district):
+                self._insert(normalize_name(name), kind, district)
+
+    def _names(self, district: dict):
+        fullname = district["fullname"]
+        names = {district["name"], strip_suffix(fullname)}
+        yield fullname, FULL_NAME
+        for name in names:
+            yield name, SHORT_NAME
+        if district["pinyin"]:
+            yield "".join(district["pinyin"]), PINYIN
+
+        parent = self.snapshot.by_adcode.get(district["parent"])
+        if parent is not None:
+            yield parent["fullname"] + fullname, FULL_NAME
+            parent_names = {parent["name"], strip_suffix(parent["fullname"])}
+            for parent_name in parent_names:
+                for name in names:
+                    yield parent_name + name, SHORT_NAME
+
+    def _insert(self, key: str, kind: int, district: dict):
+        if not key:
+            return
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+        ranks = node.setdefault(_END, {})
+        rank = (kind, district["level"], district["adcode"])
+        ranks[district["adcode"]] = min(
+            ranks.get(district["adcode"], rank), rank
+        )
+
+    def _walk(self, key: str) -> Optional[dict]:
+        node = self.root
+        for char in key:
+            node = node.get(char)
+            if node is None:
+                return None
+        return node
+
+    def search(self, keyword: str, limit: int = 5) -> List[dict]:
+        """
+        Return the ``ad_info`` of the districts matching a keyword, best
+        match first. Prefix matches are only returned without exact ones.
+        """
+        key = normalize_name(keyword)
+        node = self._walk(key) if key else None
+        if node is None:
+            return []
+
+        ranks = dict(node.get(_END, {}))
+        if not ranks and len(key) >= self.min_prefix:
+            stack = [node]
+            while stack:
+                current = stack.pop()
+                for char, child in current.items():
+                    if char is _END:
+                        for adcode, rank in child.items():
+                            rank = (PREFIX,) + rank[1:]
+                            ranks[adcode] = min(ranks.get(adcode, rank), rank)
+                    else:
+                        stack.append(child)
+
+        # Districts without a city are left to the district search API
+        matches = []
+        for rank in sorted(ranks.values()):
+            ad_info = self.snapshot.lookup(rank[2])
+            if ad_info is not None:
+                matches.append(ad_info)
+                if len(matches) == limit:
+                    break
+        return matches
+
+    def lookup(self, keyword: str) -> Optional[dict]:
+        """
+        Return the ``ad_info`` of the best district for a keyword, or None.
+        """
+        matches = self.search(keyword, limit=1)
+        if not matches:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return matches[0]
@@ -0,0 +1,93 @@
+"""
+Classification of location queries.
+
+A query is labelled once as an IP address, coordinates, an adcode or a
+name, and only the lookup strategies matching that label are planned, so a
+failed IP lookup is not retried as a keyword search and then geocoded.
+Queries that mix an IP address with other text are ambiguous and plan
+several strategies, which ``QQMap`` runs in order or speculatively.
+"""
+
+import re
+from typing import List, Optional, Tuple
+
+from .geocoder import parse_coordinates
+
+IP, COORDINATES, ADCODE, NAME = "ip", "coordinates", "adcode", "name"
+
+# Every strategy is a ``QQMap.location_lookup_by_<name>`` method
+STRATEGIES = ("ip", "coordinates", "adcode", "keyword")
+
+IP_RE = re.compile(
+    r"\b(?:(?:25[0-5]|2[0-4]\d|1?\d?\d)\.){3}(?:25[0-5]|2[0-4]\d|1?\d?\d)\b"
+)
+COORDINATES_RE = re.compile(r"^\s*(-?\d+\.?\d*)\s*,\s*(-?\d+\.?\d*)\s*$")
+ADCODE_RE = re.compile(r"^\s*(\d{6})\s*$")
+
+
+def classify_query(query: str) -> Tuple[str, List[Tuple[str, str]]]:
+    """
+    Label a query and list the ``(strategy, argument)`` pairs to try, most
+    likely first.
+    """
+    match = ADCODE_RE.match(query)
+    if match:
+        return ADCODE, [("adcode", match.group(1))]
+
+    match = COORDINATES_RE.match(query)
+    if match and parse_coordinates(",".join(match.groups())):
+        return COORDINATES, [("coordinates", ",".join(match.groups()))]
+
+    match = IP_RE.search(query)
+    if match:
+        strategies = [("ip", match.group(0))]
+        if IP_RE.sub("", query).strip():
+            strategies.append(("keyword", query))
+        return IP, strategies
+
+    return NAME, [("keyword", query)]
+
+
+class LookupPlan(object):
+    def __init__(self, query: str, speculative: bool = False):
+        """
+        Implement the plan of a location lookup and its outcome.
+
+        :param query: Location query
+        :param speculative: Run the strategies of an ambiguous query
+                            concurrently and keep the first success
+        """
+        self.query = query
+        self.kind, self.strategies = classify_query(query)
+        self.speculative = speculative and len(self.strategies) > 1
+        self.attempted = []
+        self.cancelled = []
+        self.winner = None  # type: Optional[str]
+        self.upstream_calls = 0
+
+    @property
+    def legacy_calls(self) -> int:
+        """
+        Number of upstream calls of the lookup without query planning: an
+        IP or coordinates lookup when the query looks like one, then unless
+        it succeeded a district search, geocoded when it found something.
+        """
+        calls = 1 if self.kind in (IP, COORDINATES) else 0
+        if self.winner in ("ip", "coordinates"):
+            return calls
+        return calls + (2 if self.winner else 1)
+
+    @property
+    def avoided(self) -> int:
+        """
+        Number of upstream calls saved compared with the lookup without
+        query planning, by skipping strategies and answering offline or
+        from cache. Negative when the plan made more calls.
+        """
+        return self.legacy_calls - self.upstream_calls
+
+    def __repr__(self):
+        return (
+            f"<LookupPlan {self.query!r} kind={self.kind} "
+            f"attempted={self.attempted} avoided={self.avoided}>"
+        )
@@ -1,34 +1,158 @@
-import re
+import copy
+import functools
 import logging
-from typing import Optional
+import unicodedata
+from datetime import datetime
+from typing import Iterable, Optional, Union
 
 import aiohttp
+import asyncio
 
 from .base import BaseClient
+from .cache import TTLCache
+from .deadline import Deadline, DeadlineExceeded
+from .district import DistrictSnapshot
+from .geocoder import ReverseGeocoder, parse_coordinates
+from .ipdb import IPIndex
+from .keypool import DAILY_QUOTA_EXCEEDED, QPS_EXCEEDED, APIKeyPool
+from .names import NameIndex
+from .planner import LookupPlan
+from .scheduler import most_urgent
+from .sections import SectionCache
 
 WEATHER_ENDPOINT = "https://wis.qq.com"
 MAP_ENDPOINT = "https://apis.map.qq.com"
 
 qq_logger = logging.getLogger(__name__)
 
+CURRENT_WEATHER_TYPES = "observe|index|alarm|limit|tips|rise|air"
+
+QUOTA_STATUSES = frozenset((QPS_EXCEEDED, DAILY_QUOTA_EXCEEDED))
+
+
+class _QuotaFailure(dict):
+    """
+    Empty ``ad_info`` of a lookup refused for quota. Another key, or the
+    same one a second later, may succeed, so it is never cached.
+    """
+
+
+def forecast_weather_type(forecast_days: int) -> str:
+    """
+    Return the weather types needed for a forecast of that many days.
+    """
+    if min((max(1, forecast_days), 7)) == 1:
+        return "forecast_1h|rise"
+    return "forecast_24h|rise"
+
+
+def format_current_weather(data: dict) -> dict:
+    """
+    Shape weather API data fetched with ``CURRENT_WEATHER_TYPES`` as
+    real-time weather data.
+    """
+    res = dict(data)
+    res.update(rise=res.get("rise", {}).get("0", {}),)
+    return res
+
+
+def format_weather_forecast(data: dict, forecast_days: int = 7) -> dict:
+    """
+    Shape weather API data fetched with ``forecast_weather_type`` as
+    forecast weather data.
+    """
+    forecast_days = min((max(1, forecast_days), 7))
+    if forecast_days == 1:
+        weather_data = sorted(
+            data.get("forecast_1h", {}).values(),
+            key=lambda item: item["update_time"],
+        )
+    else:
+        weather_data = sorted(
+            data.get("forecast_24h", {}).values(),
+            key=lambda item: item["time"],
+        )
+    if forecast_days > 1:
+        weather_data = weather_data[: forecast_days + 1]
+    else:
+        weather_data = weather_data[:25]
+
+    rise_data = sorted(
+        data.get("rise", {}).values(), key=lambda item: item["time"]
+    )
+    return dict(forecast=weather_data, rise=rise_data[:forecast_days],)
+
+
+def _latest_deadline(
+    deadlines: Iterable[Optional[Deadline]],
+) -> Optional[Deadline]:
+    # A call shared by several callers must not be cut short for any of them
+    deadlines = list(deadlines)
+    if None in deadlines:
+        return None
+    return max(deadlines, key=lambda deadline: deadline.remaining())
+
+
+class _WeatherBatch(object):
+    def __init__(self):
+        self.weather_types = set()
+        self.priorities = set()
+        self.deadlines = []
+        self.future = asyncio.get_event_loop().create_future()
+        # Avoid "exception was never retrieved" if every caller went away
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
 
 class QQWeather(BaseClient):
     def __init__(
         self,
         session: Optional[aiohttp.ClientSession] = None,
         logger: Optional[logging.Logger] = None,
+        cache: Optional[TTLCache] = None,
+        batch_window: Optional[float] = None,
+        section_cache: Optional[SectionCache] = None,
+        **kwargs,
     ):
         """
         Implement QQ Weather client that performs QQ weather API requests.
 
         :param session: Optionally specify the aiohttp session
         :param logger: An optional logger
+        :param cache: Optional response cache keyed on the normalized
+                      (province, city, weather_type)
+        :param batch_window: Seconds to collect concurrent requests for the
+                             same (province, city) into one upstream call
+                             with the union of their weather types,
+                             None disables batching
+        :param section_cache: Optional cache of individual weather sections,
+                              only expired sections are fetched upstream
+        :param kwargs: Connection pool options passed to ``BaseClient``
         """
+        self.cache = cache
+        self.batch_window = batch_window
+        self.section_cache = section_cache
+        self._batches = {}
         super().__init__(
-            endpoint=WEATHER_ENDPOINT, session=session, logger=logger
+            endpoint=WEATHER_ENDPOINT, session=session, logger=logger, **kwargs
         )
 
-    async def fetch_weather(self, province: str, city: str, weather_type: str):
+    @staticmethod
+    def _cache_key(province: str, city: str, weather_type: str):
+        weather_types = (t.strip() for t in (weather_type or "").split("|"))
+        return (
+            (province or "").strip(),
+            (city or "").strip(),
+            "|".join(sorted(set(filter(None, weather_types)))),
+        )
+
+    async def fetch_weather(
+        self,
+        province: str,
+        city: str,
+        weather_type: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ):
         """
         Fetch weather data from Tencent (QQ) Weather API.
 
@@ -48,35 +172,180 @@ class QQWeather(BaseClient):
             tips - Return today's weather tips data.
             rise - Return sunrise and sunset data.
             air - Return real-time air quality data.
+        :param priority: ``interactive``, ``normal`` or ``background``,
+                         defaults to the client priority
+        :param deadline: Optional time budget shared by the upstream calls
         :return: Weather API response data.
         """
+        if self.cache is None:
+            return await self._fetch_sections(
+                province, city, weather_type, priority, deadline
+            )
+
+        key = self._cache_key(province, city, weather_type)
+        data = await self.cache.get_or_load(
+            key,
+            functools.partial(self._fetch_sections, *key),
+            # Failed responses are not cached
+            ttl=lambda data: None if data else 0,
+            priority=priority,
+            deadline=deadline,
+        )
+        return dict(data)
+
+    async def _fetch_sections(
+        self,
+        province: str,
+        city: str,
+        weather_type: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ):
+        if self.section_cache is None or not weather_type:
+            return await self._fetch_weather(
+                province, city, weather_type, priority, deadline
+            )
+
+        province, city, weather_type = self._cache_key(
+            province, city, weather_type
+        )
+        return await self.section_cache.get_or_load(
+            province,
+            city,
+            weather_type.split("|"),
+            lambda sections, **kwargs: self._fetch_weather(
+                province, city, "|".join(sections), **kwargs
+            ),
+            priority=priority,
+            deadline=deadline,
+        )
+
+    async def _fetch_weather(
+        self,
+        province: str,
+        city: str,
+        weather_type: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ):
+        if self.batch_window is None or not weather_type:
+            return await self._request_weather(
+                province, city, weather_type, priority, deadline
+            )
+
+        key = ((province or "").strip(), (city or "").strip())
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = self._batches[key] = _WeatherBatch()
+            asyncio.ensure_future(self._flush_batch(key, batch))
+        weather_types = set(filter(None, weather_type.split("|")))
+        batch.weather_types.update(weather_types)
+        batch.priorities.add(priority or self.priority)
+        batch.deadlines.append(deadline)
+
+        if deadline is None:
+            data = await asyncio.shield(batch.future)
+        else:
+            # The batch runs on the loosest deadline, each caller still
+            # stops waiting when its own is over
+            try:
+                data = await asyncio.wait_for(
+                    asyncio.shield(batch.future), deadline.remaining()
+                )
+            except asyncio.TimeoutError as e:
+                if batch.future.done():
+                    raise
+                raise DeadlineExceeded("/weather/common", deadline) from e
+        return {t: data[t] for t in weather_types if t in data}
+
+    async def _flush_batch(self, key, batch: _WeatherBatch):
+        await asyncio.sleep(self.batch_window)
+        del self._batches[key]
+        weather_type = "|".join(sorted(batch.weather_types))
+        try:
+            data = await self._request_weather(
+                *key,
+                weather_type,
+                most_urgent(batch.priorities),
+                _latest_deadline(batch.deadlines),
+            )
+        except asyncio.CancelledError:
+            batch.future.cancel()
+            raise
+        except Exception as e:
+            batch.future.set_exception(e)
+        else:
+            batch.future.set_result(data)
+
+    async def _request_weather(
+        self,
+        province: str,
+        city: str,
+        weather_type: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ):
         params = dict(
             source="pc",
             weather_type=weather_type or "",
             province=province or "",
             city=city or "",
         )
-        res = await self.request("/weather/common", params=params)
+        res = await self.request(
+            "/weather/common",
+            priority=priority,
+            deadline=deadline,
+            params=params,
+        )
         if res.get("status") == 200 and res.get("message") == "OK":
             return res["data"]
         return {}
 
-    async def fetch_current_weather(self, province: str, city: str) -> dict:
+    def next_update_time(
+        self, province: str, city: str, section: str
+    ) -> Optional[datetime]:
+        """
+        Return the predicted time the upstream publishes a new version of a
+        cached weather section, if the section cache can tell.
+
+        :param province: Province Name in Chinese, for example: 北京市
+        :param city: City Name in Chinese, for example: 北京市
+        :param section: Weather type, for example: observe
+        """
+        if self.section_cache is None:
+            return None
+        province, city, _ = self._cache_key(province, city, "")
+        return self.section_cache.next_update(province, city, section)
+
+    async def fetch_current_weather(
+        self,
+        province: str,
+        city: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> dict:
         """
         Return current weather data.
 
         :param province: Province Name in Chinese, for example: 北京市
         :param city: City Name in Chinese, for example: 北京市
+        :param priority: ``interactive``, ``normal`` or ``background``,
+                         defaults to the client priority
+        :param deadline: Optional time budget shared by the upstream calls
         :return: real-time weather data.
         """
         res = await self.fetch_weather(
-            province, city, "observe|index|alarm|limit|tips|rise|air"
+            province, city, CURRENT_WEATHER_TYPES, priority, deadline
         )
-        res.update(rise=res.get("rise", {}).get("0", {}),)
-        return res
+        return format_current_weather(res)
 
     async def fetch_weather_forecast(
-        self, province: str, city: str, forecast_days: int = 7
+        self,
+        province: str,
+        city: str,
+        forecast_days: int = 7,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
     ) -> dict:
         """
         Return weather forecast data for up to 7 days into the future.
@@ -87,32 +356,19 @@ class QQWeather(BaseClient):
                               forecast data (Default: 7 days).
                               If pass forecast_days is 1, it will return
                               weather data split hourly.
+        :param priority: ``interactive``, ``normal`` or ``background``,
+                         defaults to the client priority
+        :param deadline: Optional time budget shared by the upstream calls
         :return: forecast weather data.
         """
-        forecast_days = min((max(1, forecast_days), 7))
-        weather_type = "forecast_24h|rise"
-        if forecast_days == 1:
-            weather_type = "forecast_1h|rise"
-        res = await self.fetch_weather(province, city, weather_type)
-        if forecast_days == 1:
-            weather_data = sorted(
-                res.get("forecast_1h", {}).values(),
-                key=lambda item: item["update_time"],
-            )
-        else:
-            weather_data = sorted(
-                res.get("forecast_24h", {}).values(),
-                key=lambda item: item["time"],
-            )
-        if forecast_days > 1:
-            weather_data = weather_data[: forecast_days + 1]
-        else:
-            weather_data = weather_data[:25]
-
-        rise_data = sorted(
-            res.get("rise", {}).values(), key=lambda item: item["time"]
+        res = await self.fetch_weather(
+            province,
+            city,
+            forecast_weather_type(forecast_days),
+            priority,
+            deadline,
         )
-        return dict(forecast=weather_data, rise=rise_data[:forecast_days],)
+        return format_weather_forecast(res, forecast_days)
 
 
 class QQMap(BaseClient):
@@ -120,76 +376,391 @@ class QQMap(BaseClient):
 
     def __init__(
         self,
-        api_key: str,
+        api_key: Union[str, Iterable[str], APIKeyPool],
         session: Optional[aiohttp.ClientSession] = None,
         logger: Optional[logging.Logger] = None,
+        geocode_cache: Optional[TTLCache] = None,
+        negative_ttl: float = 5 * 60,
+        ip_prefix_octets: int = 3,
+        coordinates_precision: int = 2,
+        ip_resolver: Optional[IPIndex] = None,
+        reverse_geocoder: Optional[ReverseGeocoder] = None,
+        districts: Optional[DistrictSnapshot] = None,
+        name_index: Optional[NameIndex] = None,
+        speculative_lookups: bool = False,
+        **kwargs,
     ):
         """
         Implement QQ Map client that performs QQ Map API requests.
 
-        :param api_key: QQ Map WebService API key
+        :param api_key: QQ Map WebService API key, or several keys or an
+                        ``APIKeyPool`` to spread the requests over
         :param session: Optionally specify the aiohttp session
         :param logger: An optional logger
+        :param geocode_cache: Optional cache of lookup results, locations
+                              rarely change so a TTL of days is fine
+        :param negative_ttl: Seconds a failed lookup is cached
+        :param ip_prefix_octets: IP addresses sharing that many leading
+                                 octets share a cache entry
+        :param coordinates_precision: Coordinates rounded to that many
+                                      decimals share a cache entry
+        :param ip_resolver: Optional offline IP index consulted before the
+                            IP location API
+        :param reverse_geocoder: Optional offline reverse geocoder consulted
+                                 before the geocoder API
+        :param districts: Optional district hierarchy snapshot resolving
+                          adcode queries without network calls
+        :param name_index: Optional local name index consulted before the
+                           district search API
+        :param speculative_lookups: Run the strategies of ambiguous queries
+                                    concurrently, keeping the first success
+        :param kwargs: Connection pool options passed to ``BaseClient``
         """
-        self.api_key = api_key
-        super().__init__(endpoint=MAP_ENDPOINT, session=session, logger=logger)
+        if isinstance(api_key, str):
+            api_key = [api_key]
+        if not isinstance(api_key, APIKeyPool):
+            api_key = APIKeyPool(api_key)
+        self.key_pool = api_key
+        self.api_key = api_key.keys[0].key
+        self.geocode_cache = geocode_cache
+        self.negative_ttl = negative_ttl
+        self.ip_prefix_octets = ip_prefix_octets
+        self.coordinates_precision = coordinates_precision
+        self.ip_resolver = ip_resolver
+        self.reverse_geocoder = reverse_geocoder
+        self.districts = districts
+        self.name_index = name_index
+        self.speculative_lookups = speculative_lookups
+        self.planned_lookups = 0
+        self.avoided_lookups = 0
+        self.cancelled_lookups = 0
+        super().__init__(
+            endpoint=MAP_ENDPOINT, session=session, logger=logger, **kwargs
+        )
+
+    def _rate_limit_key(self, req_url: str, aio_kwargs: dict):
+        host, _ = super()._rate_limit_key(req_url, aio_kwargs)
+        api_key = (aio_kwargs.get("params") or {}).get("key")
+        return host, api_key or None
+
+    def _is_throttled(self, res):
+        return isinstance(res, dict) and res.get("status") == QPS_EXCEEDED
+
+    async def _request(
+        self, url: str, req_url: str, method: str, **aio_kwargs
+    ):
+        # The key is picked per upstream call, after request coalescing
+        params = dict(aio_kwargs.get("params") or {})
+        if "key" in params:
+            return await super()._request(url, req_url, method, **aio_kwargs)
+        params["key"] = key = self.key_pool.acquire()
+        aio_kwargs["params"] = params
+        status = None
+        try:
+            res = await super()._request(url, req_url, method, **aio_kwargs)
+            if isinstance(res, dict):
+                status = res.get("status")
+            return res
+        finally:
+            self.key_pool.release(key, status)
+
+    def _ip_key(self, ip: str):
+        return ("ip", ".".join(ip.strip().split(".")[: self.ip_prefix_octets]))
+
+    def _coordinates_key(self, coordinates: str):
+        point = parse_coordinates(coordinates)
+        if point is None:
+            return "coordinates", coordinates.strip()
+        precision = self.coordinates_precision
+        return ("coordinates",) + tuple(round(c, precision) for c in point)
+
+    @staticmethod
+    def _keyword_key(keyword: str):
+        keyword = unicodedata.normalize("NFKC", keyword).casefold()
+        return "keyword", "".join(keyword.split())
+
+    def _geocode_ttl(self, ad_info: dict):
+        if isinstance(ad_info, _QuotaFailure):
+            return 0
+        return None if ad_info else self.negative_ttl
+
+    @staticmethod
+    def _failed_lookup(res: dict) -> dict:
+        if res.get("status") in QUOTA_STATUSES:
+            return _QuotaFailure()
+        return {}
+
+    async def _cached_lookup(self, key, loader, **load_kwargs):
+        if self.geocode_cache is None:
+            return await loader(**load_kwargs)
+        ad_info = await self.geocode_cache.get_or_load(
+            key, loader, ttl=self._geocode_ttl, **load_kwargs
+        )
+        # Copied for the caller, keeping quota failures recognizable
+        return copy.copy(ad_info)
+
+    async def _lookup_request(
+        self,
+        url: str,
+        params: dict,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        plan: Optional[LookupPlan] = None,
+    ):
+        if plan is not None:
+            plan.upstream_calls += 1
+        return await self.request(
+            url, priority=priority, deadline=deadline, params=params
+        )
+
+    async def location_lookup_by_ip(
+        self,
+        ip: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        plan: Optional[LookupPlan] = None,
+    ):
+        if self.ip_resolver is not None:
+            ad_info = self.ip_resolver.lookup(ip)
+            if ad_info is not None:
+                return dict(ad_info)
+        return await self._cached_lookup(
+            self._ip_key(ip),
+            functools.partial(self._location_lookup_by_ip, ip),
+            priority=priority,
+            deadline=deadline,
+            plan=plan,
+        )
 
-    async def location_lookup_by_ip(self, ip: str):
-        params = dict(ip=ip, key=self.api_key)
-        res = await self.request("/ws/location/v1/ip", params=params)
+    async def _location_lookup_by_ip(
+        self,
+        ip: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        plan: Optional[LookupPlan] = None,
+    ):
+        params = dict(ip=ip)
+        res = await self._lookup_request(
+            "/ws/location/v1/ip", params, priority, deadline, plan
+        )
         if res.get("status") != 0:
             self.logger.warning("Failed to query location by IP %r", res)
+            return self._failed_lookup(res)
         result = res.get("result", {})
         return result.get("ad_info", {})
 
-    async def location_lookup_by_coordinates(self, coordinates: str):
-        params = dict(location=coordinates, key=self.api_key)
-        res = await self.request("/ws/geocoder/v1", params=params)
+    async def location_lookup_by_coordinates(
+        self,
+        coordinates: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        plan: Optional[LookupPlan] = None,
+    ):
+        if self.reverse_geocoder is not None:
+            point = parse_coordinates(coordinates)
+            ad_info = point and self.reverse_geocoder.lookup(*point)
+            if ad_info:
+                return dict(ad_info)
+        return await self._cached_lookup(
+            self._coordinates_key(coordinates),
+            functools.partial(
+                self._location_lookup_by_coordinates, coordinates
+            ),
+            priority=priority,
+            deadline=deadline,
+            plan=plan,
+        )
+
+    async def _location_lookup_by_coordinates(
+        self,
+        coordinates: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        plan: Optional[LookupPlan] = None,
+    ):
+        params = dict(location=coordinates)
+        res = await self._lookup_request(
+            "/ws/geocoder/v1", params, priority, deadline, plan
+        )
         if res.get("status") != 0:
             self.logger.warning(
                 "Failed to query location by coordinates %r", res
             )
+            return self._failed_lookup(res)
         result = res.get("result", {})
         return result.get("ad_info", {})
 
-    async def location_lookup_by_keyword(self, keyword: str):
-        params = dict(keyword=keyword, key=self.api_key)
-        res = await self.request("/ws/district/v1/search", params=params)
+    async def location_lookup_by_keyword(
+        self,
+        keyword: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        plan: Optional[LookupPlan] = None,
+    ):
+        if self.name_index is not None:
+            ad_info = self.name_index.lookup(keyword)
+            if ad_info is not None:
+                return dict(ad_info)
+        return await self._cached_lookup(
+            self._keyword_key(keyword),
+            functools.partial(self._location_lookup_by_keyword, keyword),
+            priority=priority,
+            deadline=deadline,
+            plan=plan,
+        )
+
+    async def _location_lookup_by_keyword(
+        self,
+        keyword: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        plan: Optional[LookupPlan] = None,
+    ):
+        params = dict(keyword=keyword)
+        res = await self._lookup_request(
+            "/ws/district/v1/search", params, priority, deadline, plan
+        )
         if res.get("status") != 0:
             self.logger.warning("Failed to query location by keyword %r", res)
+            return self._failed_lookup(res)
         results = res.get("result", [])
         if not results or not results[0]:
             return {}
         location = results[0][0]["location"]
         lat = location["lat"]
         lng = location["lng"]
-        return await self.location_lookup_by_coordinates(f"{lat},{lng}")
+        return await self.location_lookup_by_coordinates(
+            f"{lat},{lng}", priority, deadline, plan
+        )
+
+    async def refresh_districts(self) -> DistrictSnapshot:
+        """
+        Download the district hierarchy snapshot, or refresh the current one.
+        """
+        if self.districts is None:
+            self.districts = await DistrictSnapshot.fetch(self)
+        else:
+            await self.districts.refresh(self)
+        return self.districts
 
-    async def location_lookup(self, query: str):
-        ad_info = None
-        ip_candidates = re.findall(
-            r"\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b", query
+    async def location_lookup_by_adcode(
+        self,
+        adcode: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+        plan: Optional[LookupPlan] = None,
+    ):
+        if self.districts is not None:
+            ad_info = self.districts.lookup(adcode)
+            if ad_info is not None:
+                return dict(ad_info)
+        return await self.location_lookup_by_keyword(
+            adcode, priority, deadline, plan
         )
-        if ip_candidates:
-            ad_info = await self.location_lookup_by_ip(ip_candidates[0])
 
-        coordinates = re.findall(r"^(-?\d+\.\d+?),\s*(-?\d+\.\d+?)$", query)
-        if coordinates:
-            ad_info = await self.location_lookup_by_coordinates(
-                ",".join(coordinates[0])
-            )
+    def plan_lookup(
+        self, query: str, speculative: Optional[bool] = None
+    ) -> LookupPlan:
+        """
+        Classify a query and plan the lookup strategies matching it.
+
+        :param query: IP address, coordinates, adcode or location name
+        :param speculative: Overrides ``speculative_lookups``
+        """
+        if speculative is None:
+            speculative = self.speculative_lookups
+        return LookupPlan(query, speculative)
 
-        if not ad_info:
-            ad_info = await self.location_lookup_by_keyword(query)
+    async def run_plan(
+        self,
+        plan: LookupPlan,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ):
+        """
+        Run a lookup plan, recording the attempted strategies on it.
 
+        :param plan: Plan returned by ``plan_lookup``
+        :param priority: ``interactive``, ``normal`` or ``background``,
+                         defaults to the client priority
+        :param deadline: Optional time budget shared by the upstream calls
+        """
+        if plan.speculative:
+            ad_info = await self._run_speculative(plan, priority, deadline)
+        else:
+            ad_info = None
+            for name, argument in plan.strategies:
+                plan.attempted.append(name)
+                ad_info = await self._lookup_strategy(name)(
+                    argument, priority=priority, deadline=deadline, plan=plan
+                )
+                if ad_info:
+                    plan.winner = name
+                    break
+        self.planned_lookups += 1
+        self.avoided_lookups += plan.avoided
+        self.cancelled_lookups += len(plan.cancelled)
         return ad_info
 
+    def _lookup_strategy(self, name: str):
+        return getattr(self, f"location_lookup_by_{name}")
+
+    async def _run_speculative(
+        self,
+        plan: LookupPlan,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ):
+        tasks = {}
+        for name, argument in plan.strategies:
+            plan.attempted.append(name)
+            task = asyncio.ensure_future(
+                self._lookup_strategy(name)(
+                    argument, priority=priority, deadline=deadline, plan=plan
+                )
+            )
+            tasks[task] = name
+        order = list(tasks)
+        pending = set(order)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in order:
+                    if task in done and not task.exception() and task.result():
+                        plan.winner = tasks[task]
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+                plan.cancelled.append(tasks[task])
+
+        # Nothing succeeded, report the first error in plan order
+        for task in order:
+            if task.exception():
+                raise task.exception()
+        return order[-1].result()
+
+    async def location_lookup(
+        self,
+        query: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ):
+        return await self.run_plan(self.plan_lookup(query), priority, deadline)
+
 
-async def query_current_weather(api_key: str, query: str):
+async def query_current_weather(
+    api_key: str, query: str, timeout: Optional[float] = None
+):
     """
     To query the QQ (Tencent) Weather API for real-time weather data in a
     location of your choice.
 
+    Every call opens its own session, use a long-lived ``WeatherService``
+    to share connections and caches between queries.
+
     :param api_key: Tencent Map WebServiceAPI key.
     :param query: Pass a single location identifier to the API and
                   auto-detect the associated location. For Example:
@@ -197,32 +768,31 @@ async def query_current_weather(api_key: str, query: str):
         110105 - adcode (行政区划代码)
         39.90469,116.40717 - Coordinates (Lat/Lon)
         61.135.17.68 - IP Address.
+    :param timeout: Optional seconds the whole query may take. The location
+                    lookup and the weather fetch share this budget, and
+                    ``DeadlineExceeded`` names the phase that ran out of
+                    time.
     :return: real-time weather data.
     """
-    if not api_key:
-        raise ValueError("Please provide tencent map api key")
-
-    if not query:
-        raise ValueError("Empty query")
-
-    async with aiohttp.ClientSession() as session:
-        qq_map = QQMap(api_key, session=session, logger=qq_logger)
-        qq_weather = QQWeather(session=session, logger=qq_logger)
-        ad_info = await qq_map.location_lookup(query)
-        province, city = ad_info.get("province"), ad_info.get("city")
+    from .service import WeatherService
 
-        res = await qq_weather.fetch_current_weather(province, city)
-        res.update(location=ad_info)
-        return res
+    async with WeatherService(api_key, logger=qq_logger) as service:
+        return await service.query_current_weather(query, timeout=timeout)
 
 
 async def query_weather_forecast(
-    api_key: str, query: str, forecast_days: int = 7
+    api_key: str,
+    query: str,
+    forecast_days: int = 7,
+    timeout: Optional[float] = None,
 ):
     """
     The QQ (Tencent) Weather API is capable of returning weather forecast data
     for up to 7 days into the future.
 
+    Every call opens its own session, use a long-lived ``WeatherService``
+    to share connections and caches between queries.
+
     :param api_key: Tencent Map WebServiceAPI key.
     :param query: Pass a single location identifier to the API and
                   auto-detect the associated location. For Example:
@@ -234,25 +804,13 @@ async def query_weather_forecast(
                           data (Default: 7 days).
                           If pass forecast_days is 1, it will return weather
                           data split hourly.
+    :param timeout: Optional seconds the whole query may take, shared like
+                    in ``query_current_weather``.
     :return: forecast weather data.
     """
-    if not api_key:
-        raise ValueError("Please provide tencent map api key")
-
-    if not query:
-        raise ValueError("Empty query")
-
-    if forecast_days > 7 or forecast_days < 0:
-        raise ValueError("Invalid forecast days")
-
-    async with aiohttp.ClientSession() as session:
-        qq_map = QQMap(api_key, session=session, logger=qq_logger)
-        qq_weather = QQWeather(session=session, logger=qq_logger)
-        ad_info = await qq_map.location_lookup(query)
-        province, city = ad_info.get("province"), ad_info.get("city")
+    from .service import WeatherService
 
-        res = await qq_weather.fetch_weather_forecast(
-            province, city, forecast_days
+    async with WeatherService(api_key, logger=qq_logger) as service:
+        return await service.query_weather_forecast(
+            query, forecast_days, timeout=timeout
         )
-        res.update(location=ad_info)
-        return res
@@ -0,0 +1,161 @@
+"""
+Async token-bucket rate limiting.
+
+Every bucket refills at ``rate`` tokens per second up to ``capacity``.
+A request takes one token, and when none is left it reserves the next one
+and sleeps until it is due. Tokens are reserved in call order, so waiters
+are served first come, first served instead of being rejected.
+"""
+
+import time
+from typing import Callable, Dict, Hashable, Optional, Tuple, Union
+
+import asyncio
+
+from .keypool import mask_api_key
+
+# Rate in requests per second, or a (rate, capacity) pair
+RateSpec = Union[float, Tuple[float, float]]
+
+
+class TokenBucket(object):
+    def __init__(
+        self,
+        rate: float,
+        capacity: Optional[float] = None,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Implement a token bucket with a FIFO queue of waiters.
+
+        :param rate: Tokens added per second
+        :param capacity: Maximum number of tokens, that is the largest burst
+                         allowed after idling, defaults to one second worth
+        :param timer: Monotonic clock returning seconds
+        """
+        if rate <= 0:
+            raise ValueError("Rate must be positive")
+        self.rate = rate
+        self.capacity = max(capacity or rate, 1)
+        self.timer = timer
+        self.tokens = self.capacity
+        self.updated = timer()
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.acquired = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._reservations = 0
+
+    def _refill(self):
+        now = self.timer()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def reserve(self) -> float:
+        """
+        Take a token, possibly one not added yet, and return the seconds to
+        wait before using it.
+        """
+        self._refill()
+        self.tokens -= 1
+        self._reservations += 1
+        return max(-self.tokens / self.rate, 0.0)
+
+    async def acquire(self) -> float:
+        """
+        Wait for a token and return the seconds waited.
+        """
+        delay = self.reserve()
+        if delay > 0:
+            reservation = self._reservations
+            self.queue_depth += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                # Only the last waiter hands its token back, otherwise
+                # newcomers would overtake the waiters behind it
+                if reservation == self._reservations:
+                    self._reservations -= 1
+                    self.tokens += 1
+                raise
+            finally:
+                self.queue_depth -= 1
+            self.waited += 1
+            self.total_wait += delay
+            self.max_wait = max(self.max_wait, delay)
+        self.acquired += 1
+        return delay
+
+    def stats(self) -> dict:
+        return dict(
+            rate=self.rate,
+            capacity=self.capacity,
+            queue_depth=self.queue_depth,
+            max_queue_depth=self.max_queue_depth,
+            acquired=self.acquired,
+            waited=self.waited,
+            total_wait=self.total_wait,
+            max_wait=self.max_wait,
+            mean_wait=self.total_wait / self.acquired if self.acquired else 0,
+        )
+
+
+class RateLimiter(object):
+    def __init__(
+        self,
+        rates: Optional[Dict[str, RateSpec]] = None,
+        default: Optional[RateSpec] = None,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Implement a set of token buckets with separate budgets per host, and
+        per API key when the client passes one.
+
+        :param rates: Rate of every host, for example
+                      ``{"apis.map.qq.com": 5, "wis.qq.com": (20, 40)}``
+        :param default: Rate of the hosts missing from ``rates``, None
+                        leaves them unlimited
+        :param timer: Monotonic clock returning seconds
+        """
+        self.rates = dict(rates or {})
+        self.default = default
+        self.timer = timer
+        self.buckets = {}
+
+    def bucket(self, host: str, key: Hashable = None) -> Optional[TokenBucket]:
+        """
+        Return the bucket of a host and optional API key, or None when the
+        host is not limited.
+        """
+        bucket = self.buckets.get((host, key))
+        if bucket is None:
+            spec = self.rates.get(host, self.default)
+            if spec is None:
+                return None
+            rate, capacity = spec if isinstance(spec, tuple) else (spec, None)
+            bucket = TokenBucket(rate, capacity, self.timer)
+            self.buckets[(host, key)] = bucket
+        return bucket
+
+    async def acquire(self, host: str, key: Hashable = None) -> float:
+        """
+        Wait for the budget of a host and optional API key, and return the
+        seconds waited.
+        """
+        bucket = self.bucket(host, key)
+        if bucket is None:
+            return 0.0
+        return await bucket.acquire()
+
+    def stats(self) -> dict:
+        # Budgets are per API key, only the reported name is masked
+        stats = {}
+        for (host, key), bucket in self.buckets.items():
+            name = host if key is None else f"{host}/{mask_api_key(key)}"
+            stats[name] = bucket.stats()
+        return stats
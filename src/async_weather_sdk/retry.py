@@ -0,0 +1,227 @@
+"""
+Retries and hedged requests.
+
+A failed idempotent request is retried after an exponential backoff with
+jitter, as long as the retry budget allows it: every request deposits a
+fraction of a token, every retry or hedge spends one, so retries cannot
+multiply the load on an upstream that is already failing.
+
+Hedging sends a duplicate of a request that is slower than a percentile of
+the recent latencies, and keeps whichever response arrives first.
+"""
+
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+import aiohttp
+import asyncio
+
+from .breaker import CircuitOpenError
+from .deadline import DeadlineExceeded
+from .shedding import LoadShedError
+
+
+def is_retriable(error: BaseException) -> bool:
+    """
+    Tell whether a failed request may succeed when sent again: connection
+    errors, timeouts and 5xx responses, but not an open circuit, a spent
+    deadline or a shed request.
+    """
+    if isinstance(error, (CircuitOpenError, DeadlineExceeded, LoadShedError)):
+        return False
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500
+    return isinstance(
+        error, (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+    )
+
+
+class LatencyTracker(object):
+    def __init__(self, window: int = 200):
+        """
+        Implement a sliding window of request latencies.
+
+        :param window: Number of recent latencies kept
+        """
+        self.samples = deque(maxlen=window)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, latency: float):
+        self.samples.append(latency)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Return the ``p`` quantile (0 to 1) of the window, or None if empty.
+        """
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(p * len(ordered)), len(ordered) - 1)]
+
+
+class RetryPolicy(object):
+    def __init__(
+        self,
+        attempts: int = 3,
+        backoff: float = 0.05,
+        multiplier: float = 2,
+        max_backoff: float = 1,
+        jitter: float = 1,
+        budget_ratio: float = 0.2,
+        budget_reserve: float = 10,
+        hedge_percentile: Optional[float] = None,
+        hedge_after: Optional[float] = None,
+        hedge_min_samples: int = 20,
+        window: int = 200,
+        retriable: Callable[[BaseException], bool] = is_retriable,
+        random: Callable[[], float] = random.random,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Implement a retry and hedging policy for idempotent requests.
+
+        :param attempts: Maximum number of attempts, 1 disables retries
+        :param backoff: Seconds before the first retry
+        :param multiplier: Backoff growth between retries
+        :param max_backoff: Upper bound of the backoff in seconds
+        :param jitter: Share of the backoff that is randomized, 1 for "full
+                       jitter" between 0 and the backoff
+        :param budget_ratio: Tokens deposited per request, that is the
+                             long-term ratio of retries and hedges allowed
+        :param budget_reserve: Maximum number of tokens, and the initial
+                               number, available for bursts of retries
+        :param hedge_percentile: Send a duplicate request once a request is
+                                 slower than this quantile (0 to 1) of the
+                                 recent latencies, None disables hedging
+        :param hedge_after: Hedging delay in seconds used until
+                            ``hedge_min_samples`` latencies are known, or
+                            alone when ``hedge_percentile`` is not set
+        :param hedge_min_samples: Latencies needed to use the percentile
+        :param window: Number of recent latencies kept
+        :param retriable: Tell whether an error may be retried
+        :param random: Random number generator between 0 and 1
+        :param timer: Monotonic clock returning seconds
+        """
+        if attempts < 1:
+            raise ValueError("Attempts must be at least 1")
+        self.attempts = attempts
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.budget_ratio = budget_ratio
+        self.budget_reserve = budget_reserve
+        self.hedge_percentile = hedge_percentile
+        self.hedge_after = hedge_after
+        self.hedge_min_samples = hedge_min_samples
+        self.retriable = retriable
+        self.random = random
+        self.timer = timer
+        self.latencies = LatencyTracker(window)
+        self.tokens = budget_reserve
+        self.requests = 0
+        self.retries = 0
+        self.budget_exhausted = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def backoff_delay(self, retry: int) -> float:
+        """
+        Return the seconds to wait before the ``retry``-th retry.
+        """
+        delay = min(
+            self.backoff * self.multiplier ** (retry - 1), self.max_backoff
+        )
+        return delay * (1 - self.jitter + self.jitter * self.random())
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Return the seconds after which a request is hedged, or None.
+        """
+        if (
+            self.hedge_percentile is not None
+            and len(self.latencies) >= self.hedge_min_samples
+        ):
+            return self.latencies.percentile(self.hedge_percentile)
+        return self.hedge_after
+
+    def _spend(self) -> bool:
+        if self.tokens < 1:
+            self.budget_exhausted += 1
+            return False
+        self.tokens -= 1
+        return True
+
+    async def call(self, send: Callable[[], Awaitable]) -> Any:
+        """
+        Run a request with retries and hedging.
+
+        :param send: Coroutine function sending the request once
+        """
+        self.requests += 1
+        self.tokens = min(self.tokens + self.budget_ratio, self.budget_reserve)
+        retry = 0
+        while True:
+            try:
+                return await self._hedged(send)
+            except Exception as e:
+                retry += 1
+                if (
+                    retry >= self.attempts
+                    or not self.retriable(e)
+                    or not self._spend()
+                ):
+                    raise
+                self.retries += 1
+            await asyncio.sleep(self.backoff_delay(retry))
+
+    async def _timed(self, send: Callable[[], Awaitable]):
+        started = self.timer()
+        res = await send()
+        self.latencies.add(self.timer() - started)
+        return res
+
+    async def _hedged(self, send: Callable[[], Awaitable]):
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._timed(send)
+
+        first = asyncio.ensure_future(self._timed(send))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self._spend():
+                self.hedges += 1
+                tasks.append(asyncio.ensure_future(self._timed(send)))
+
+            pending, error = set(tasks), None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        return dict(
+            requests=self.requests,
+            retries=self.retries,
+            budget_exhausted=self.budget_exhausted,
+            tokens=self.tokens,
+            hedges=self.hedges,
+            hedge_wins=self.hedge_wins,
+            hedge_delay=self.hedge_delay(),
+        )
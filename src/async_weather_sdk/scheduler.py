@@ -0,0 +1,217 @@
+"""
+Priority scheduling of upstream calls.
+
+Requests are tagged ``interactive``, ``normal`` or ``background`` and share
+a fixed number of slots. Waiting requests are served with start-time fair
+queuing: every class gets slots in proportion to its weight, so a
+background sweep keeps progressing but only takes a small share while
+interactive requests wait. A few slots are reserved for interactive
+requests, so live queries find a free slot even while a sweep keeps every
+other slot busy.
+"""
+
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional
+
+import asyncio
+
+INTERACTIVE = "interactive"
+NORMAL = "normal"
+BACKGROUND = "background"
+
+# From the most to the least urgent
+PRIORITIES = (INTERACTIVE, NORMAL, BACKGROUND)
+
+DEFAULT_WEIGHTS = {INTERACTIVE: 16, NORMAL: 4, BACKGROUND: 1}
+
+
+def most_urgent(priorities: Iterable[str]) -> str:
+    """
+    Return the most urgent of several priorities.
+    """
+    return min(priorities, key=PRIORITIES.index)
+
+
+class Ticket(object):
+    def __init__(self, priority: str, enqueued_at: float):
+        self.priority = priority
+        self.enqueued_at = enqueued_at
+        self.start = 0.0
+        self.future = None
+        self.queued = False
+        self.running = False
+
+
+class ClassStats(object):
+    def __init__(self):
+        self.queued = 0
+        self.running = 0
+        self.dispatched = 0
+        self.promoted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def as_dict(self) -> dict:
+        return dict(
+            queued=self.queued,
+            running=self.running,
+            dispatched=self.dispatched,
+            promoted=self.promoted,
+            mean_wait=(
+                self.total_wait / self.dispatched if self.dispatched else 0.0
+            ),
+            max_wait=self.max_wait,
+        )
+
+
+class PriorityScheduler(object):
+    def __init__(
+        self,
+        concurrency: int = 20,
+        weights: Optional[Dict[str, float]] = None,
+        reserved: int = 2,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Implement a weighted fair scheduler of upstream calls.
+
+        :param concurrency: Number of calls running at a time
+        :param weights: Share of the slots of each priority while several
+                        wait, defaults to 16:4:1
+        :param reserved: Slots only interactive calls may take
+        :param timer: Monotonic clock returning seconds
+        """
+        if concurrency < 1:
+            raise ValueError("Concurrency must be positive")
+        if not 0 <= reserved < concurrency:
+            raise ValueError("Reserved slots must be less than concurrency")
+        self.concurrency = concurrency
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.reserved = reserved
+        self.timer = timer
+        self.running = 0
+        self.vtime = 0.0
+        self.queues = {priority: deque() for priority in PRIORITIES}
+        self.finish = {priority: 0.0 for priority in PRIORITIES}
+        self.classes = {priority: ClassStats() for priority in PRIORITIES}
+
+    def ticket(self, priority: str) -> Ticket:
+        """
+        Return the ticket of a call, to be passed to ``acquire``.
+        """
+        if priority not in self.queues:
+            raise ValueError(f"Unknown priority {priority!r}")
+        return Ticket(priority, self.timer())
+
+    def _tag(self, ticket: Ticket):
+        # Each call of a class advances its virtual finish time by the
+        # inverse of its weight, heavier classes are picked more often
+        ticket.start = max(self.vtime, self.finish[ticket.priority])
+        self.finish[ticket.priority] = (
+            ticket.start + 1 / self.weights[ticket.priority]
+        )
+
+    def _free(self, priority: str) -> bool:
+        limit = self.concurrency
+        if priority != INTERACTIVE:
+            limit -= self.reserved
+        return self.running < limit
+
+    def _start(self, ticket: Ticket):
+        stats = self.classes[ticket.priority]
+        wait = self.timer() - ticket.enqueued_at
+        stats.running += 1
+        stats.dispatched += 1
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        ticket.running = True
+        self.running += 1
+        self.vtime = max(self.vtime, ticket.start)
+
+    async def acquire(self, ticket: Ticket):
+        """
+        Wait until a call may run.
+        """
+        self._tag(ticket)
+        # Queue heads that could run were dispatched already, so waiting
+        # calls only block a call of their own class
+        if self._free(ticket.priority) and not self.queues[ticket.priority]:
+            self._start(ticket)
+            return
+        ticket.future = asyncio.get_event_loop().create_future()
+        self._enqueue(ticket)
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.running:
+                # The slot was handed over just before the cancellation
+                self.release(ticket)
+            elif ticket.queued:
+                self._dequeue(ticket)
+            raise
+
+    def _enqueue(self, ticket: Ticket):
+        ticket.queued = True
+        self.queues[ticket.priority].append(ticket)
+        self.classes[ticket.priority].queued += 1
+
+    def _dequeue(self, ticket: Ticket):
+        ticket.queued = False
+        self.queues[ticket.priority].remove(ticket)
+        self.classes[ticket.priority].queued -= 1
+
+    def promote(self, ticket: Ticket, priority: str):
+        """
+        Raise the priority of a call, for example when a more urgent caller
+        joins it. A queued call moves to the end of its new queue.
+        """
+        if most_urgent((ticket.priority, priority)) == ticket.priority:
+            return
+        self.classes[priority].promoted += 1
+        if ticket.running:
+            self.classes[ticket.priority].running -= 1
+            self.classes[priority].running += 1
+            ticket.priority = priority
+        elif ticket.queued:
+            self._dequeue(ticket)
+            ticket.priority = priority
+            self._tag(ticket)
+            self._enqueue(ticket)
+            self._dispatch()
+        else:
+            ticket.priority = priority
+
+    def release(self, ticket: Ticket):
+        """
+        Free the slot of a finished call and start the next ones.
+        """
+        ticket.running = False
+        self.running -= 1
+        self.classes[ticket.priority].running -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while True:
+            heads = [
+                queue[0]
+                for priority, queue in self.queues.items()
+                if queue and self._free(priority)
+            ]
+            if not heads:
+                return
+            ticket = min(
+                heads, key=lambda t: (t.start, PRIORITIES.index(t.priority))
+            )
+            self._dequeue(ticket)
+            if ticket.future.done():
+                # Cancelled, its waiter has not run yet
+                continue
+            self._start(ticket)
+            ticket.future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            priority: stats.as_dict()
+            for priority, stats in self.classes.items()
+        }
@@ -0,0 +1,329 @@
+import functools
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import asyncio
+
+from .cache import STALE_IF_ERROR_EXCEPTIONS, TTLCache
+from .scheduler import BACKGROUND
+
+# Lifetime in seconds of each /weather/common section
+DEFAULT_SECTION_TTLS = dict(
+    observe=5 * 60,
+    alarm=5 * 60,
+    air=30 * 60,
+    forecast_1h=60 * 60,
+    forecast_24h=3 * 60 * 60,
+    index=24 * 60 * 60,
+    limit=24 * 60 * 60,
+    tips=24 * 60 * 60,
+    rise=24 * 60 * 60,
+)
+
+# Sections published once a day, they also expire at midnight (UTC+8)
+DAILY_SECTIONS = frozenset(("index", "limit", "tips", "rise"))
+
+UTC_OFFSET = 8 * 60 * 60
+DAY = 24 * 60 * 60
+CST = timezone(timedelta(seconds=UTC_OFFSET))
+
+# Upstream publish cadence in seconds of sections carrying update_time.
+# Alarms carry their issue time, which says nothing about when the next
+# one comes, so they keep the fixed TTL.
+DEFAULT_PUBLISH_CADENCES = dict(
+    observe=10 * 60, air=60 * 60, forecast_1h=60 * 60
+)
+
+# strptime accepts single digit fields, pick the format by length instead
+UPDATE_TIME_FORMATS = {
+    len("20200601130000"): "%Y%m%d%H%M%S",
+    len("202006011323"): "%Y%m%d%H%M",
+    len("2020-06-01 06:40"): "%Y-%m-%d %H:%M",
+}
+
+
+def parse_update_time(value: str) -> Optional[datetime]:
+    """
+    Parse an ``update_time`` field of the weather API, which is in UTC+8.
+    """
+    fmt = UPDATE_TIME_FORMATS.get(len(value or ""))
+    if fmt is None:
+        return None
+    try:
+        return datetime.strptime(value, fmt).replace(tzinfo=CST)
+    except ValueError:
+        return None
+
+
+class FreshnessModel(object):
+    def __init__(
+        self,
+        cadences: Optional[Dict[str, float]] = None,
+        margins: Optional[Dict[str, float]] = None,
+        default_margin: float = 60,
+        min_ttl: float = 30,
+        max_ttl: float = 6 * 60 * 60,
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        Predict when the upstream publishes the next version of a section
+        from the ``update_time`` fields of its payload.
+
+        :param cadences: Publish cadence in seconds per section, merged over
+                         ``DEFAULT_PUBLISH_CADENCES``
+        :param margins: Seconds added to the predicted update per section,
+                        to give the upstream time to publish
+        :param default_margin: Margin of sections without a configured one
+        :param min_ttl: Lower bound of a computed TTL, used when the
+                        upstream is late to publish
+        :param max_ttl: Upper bound of a computed TTL
+        :param clock: Wall clock returning a UNIX timestamp
+        """
+        self.cadences = dict(DEFAULT_PUBLISH_CADENCES, **(cadences or {}))
+        self.margins = margins or {}
+        self.default_margin = default_margin
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.clock = clock
+
+    def published_at(self, section: str, value) -> Optional[datetime]:
+        if not isinstance(value, dict):
+            return None
+        if section == "forecast_1h":
+            times = [
+                parse_update_time(item.get("update_time"))
+                for item in value.values()
+                if isinstance(item, dict)
+            ]
+            times = [t for t in times if t]
+            # Hourly forecasts start at the current hour
+            return min(times) if times else None
+        return parse_update_time(value.get("update_time"))
+
+    def next_update(self, section: str, value) -> Optional[datetime]:
+        """
+        Return the predicted time of the next upstream update of a section,
+        or None when the section has no usable ``update_time``.
+
+        The prediction is the first publish slot after the payload whose
+        margin has not passed yet, so old payloads are not predicted to be
+        updated in the past.
+        """
+        cadence = self.cadences.get(section)
+        if cadence is None:
+            return None
+        published_at = self.published_at(section, value)
+        if published_at is None:
+            return None
+        margin = self.margins.get(section, self.default_margin)
+        age = self.clock() - margin - published_at.timestamp()
+        slots = max(math.floor(age / cadence) + 1, 1)
+        return published_at + timedelta(seconds=slots * cadence)
+
+    def ttl(self, section: str, value) -> Optional[float]:
+        """
+        Return the number of seconds a section stays fresh, or None when
+        no prediction can be made.
+        """
+        next_update = self.next_update(section, value)
+        if next_update is None:
+            return None
+        margin = self.margins.get(section, self.default_margin)
+        ttl = next_update.timestamp() + margin - self.clock()
+        return min(max(ttl, self.min_ttl), self.max_ttl)
+
+
+class SectionCache(object):
+    def __init__(
+        self,
+        maxsize: int = 4096,
+        ttls: Optional[Dict[str, float]] = None,
+        default_ttl: float = 5 * 60,
+        timer: Callable[[], float] = time.monotonic,
+        clock: Callable[[], float] = time.time,
+        freshness: Optional[FreshnessModel] = None,
+        stale_while_revalidate: float = 0,
+        stale_if_error: float = 0,
+        stale_if_overload: float = 0,
+    ):
+        """
+        Implement a cache of /weather/common sections, each section of a
+        city expires on its own schedule.
+
+        Sections are kept for a fixed TTL, unless a freshness model can
+        predict their next upstream update from their ``update_time``.
+        Expired sections can be served stale like in ``TTLCache``.
+
+        :param maxsize: Maximum number of (province, city, section) entries
+        :param ttls: Lifetime in seconds per section, merged over
+                     ``DEFAULT_SECTION_TTLS``
+        :param default_ttl: Lifetime of sections without a configured TTL
+        :param timer: Monotonic clock returning seconds
+        :param clock: Wall clock returning a UNIX timestamp
+        :param freshness: Optional model deriving TTLs from ``update_time``
+        :param stale_while_revalidate: Seconds after expiry during which a
+                                       stale section is returned and
+                                       refreshed in the background
+        :param stale_if_error: Seconds after expiry during which a stale
+                               section is returned if the refetch fails
+        :param stale_if_overload: Seconds after expiry during which a stale
+                                  section is returned if the refetch is
+                                  refused by load shedding
+        """
+        self.ttls = dict(DEFAULT_SECTION_TTLS, **(ttls or {}))
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self.freshness = freshness
+        self.cache = TTLCache(
+            maxsize=maxsize,
+            ttl=default_ttl,
+            timer=timer,
+            stale_while_revalidate=stale_while_revalidate,
+            stale_if_error=stale_if_error,
+            stale_if_overload=stale_if_overload,
+        )
+        self._refreshing = {}
+
+    def ttl(self, section: str, value=None) -> float:
+        if self.freshness is not None:
+            ttl = self.freshness.ttl(section, value)
+            if ttl is not None:
+                return ttl
+        ttl = self.ttls.get(section, self.default_ttl)
+        if section in DAILY_SECTIONS:
+            until_midnight = DAY - (self.clock() + UTC_OFFSET) % DAY
+            ttl = min(ttl, until_midnight)
+        return ttl
+
+    def get_sections(
+        self, province: str, city: str, sections: Iterable[str]
+    ) -> Tuple[dict, List[str]]:
+        """
+        Look up sections of a city.
+
+        :return: A tuple of the fresh cached sections and the names of
+                 the sections that have to be fetched.
+        """
+        data, missing = {}, []
+        for section in sections:
+            entry = self.cache.get((province, city, section))
+            if entry is None:
+                missing.append(section)
+            else:
+                data[section] = entry[0]
+        return data, missing
+
+    def set_sections(self, province: str, city: str, data: dict):
+        for section, value in data.items():
+            next_update = None
+            if self.freshness is not None:
+                next_update = self.freshness.next_update(section, value)
+            self.cache.set(
+                (province, city, section),
+                (value, next_update),
+                self.ttl(section, value),
+            )
+
+    async def get_or_load(
+        self,
+        province: str,
+        city: str,
+        sections: Iterable[str],
+        loader: Callable[..., Awaitable[dict]],
+        **load_kwargs
+    ) -> dict:
+        """
+        Return sections of a city, loading all expired ones at once.
+
+        :param province: Province name
+        :param city: City name
+        :param sections: Names of the requested sections
+        :param loader: Coroutine function fetching a list of sections and
+                       returning them as a dict, empty on failure. It is
+                       called with ``load_kwargs``, background refreshes
+                       only pass ``priority="background"``.
+        :param load_kwargs: Keyword arguments of the loader, for example the
+                            priority and deadline of the caller
+        :return: The requested sections, or an empty dict when loading
+                 failed.
+        """
+        cache = self.cache
+        data, stale, missing = {}, [], {}
+        for section in sections:
+            entry, age = cache.lookup((province, city, section))
+            if age is not None and age < 0:
+                cache.hits += 1
+                data[section] = entry[0]
+            elif age is not None and age < cache.stale_while_revalidate:
+                cache.stale_hits += 1
+                data[section] = entry[0]
+                stale.append(section)
+            else:
+                cache.misses += 1
+                missing[section] = (entry, age)
+
+        if stale:
+            self._revalidate(province, city, stale, loader)
+        if not missing:
+            return data
+
+        try:
+            fetched = await loader(list(missing), **load_kwargs)
+        except STALE_IF_ERROR_EXCEPTIONS as e:
+            window = cache.stale_window(e)
+            if any(
+                age is None or age >= window for _, age in missing.values()
+            ):
+                raise
+            cache.count_stale(e)
+            data.update((s, entry[0]) for s, (entry, _) in missing.items())
+            return data
+        if not fetched:
+            return {}
+        self.set_sections(province, city, fetched)
+        data.update(fetched)
+        return data
+
+    def _revalidate(self, province: str, city: str, sections, loader):
+        keys = [(province, city, s) for s in sections]
+        keys = [key for key in keys if key not in self._refreshing]
+        if not keys:
+            return
+        task = asyncio.ensure_future(
+            self._refresh(province, city, [key[2] for key in keys], loader)
+        )
+        for key in keys:
+            self._refreshing[key] = task
+        task.add_done_callback(functools.partial(self._refreshed, keys))
+
+    def _refreshed(self, keys, _task):
+        for key in keys:
+            self._refreshing.pop(key, None)
+
+    async def _refresh(self, province: str, city: str, sections, loader):
+        self.cache.refreshes += 1
+        try:
+            fetched = await loader(sections, priority=BACKGROUND)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            fetched = None
+        if fetched:
+            self.set_sections(province, city, fetched)
+        else:
+            self.cache.refresh_errors += 1
+
+    def next_update(
+        self, province: str, city: str, section: str
+    ) -> Optional[datetime]:
+        """
+        Return the predicted next upstream update of a cached section, or
+        None when it is not cached or cannot be predicted.
+        """
+        entry = self.cache.peek((province, city, section))
+        return entry and entry[1]
+
+    def stats(self) -> dict:
+        return self.cache.stats()
@@ -0,0 +1,669 @@
+"""
+Long-lived facade over the map and weather clients.
+
+A ``WeatherService`` keeps one pooled session, one geocode cache and one
+weather section cache for its whole lifetime, so repeated queries reuse
+connections and cached data instead of starting from scratch::
+
+    async with WeatherService('API_KEY') as service:
+        await service.query_current_weather('北京市')
+        await service.full_report('39.90469,116.40717')
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import aiohttp
+import asyncio
+
+from .breaker import CircuitBreaker
+from .cache import TTLCache
+from .concurrency import AdaptiveLimiter
+from .deadline import Deadline
+from .keypool import APIKeyPool
+from .qq import (
+    CURRENT_WEATHER_TYPES,
+    QQMap,
+    QQWeather,
+    forecast_weather_type,
+    format_current_weather,
+    format_weather_forecast,
+)
+from .ratelimit import RateLimiter
+from .retry import RetryPolicy
+from .scheduler import NORMAL, PriorityScheduler
+from .sections import SectionCache
+from .shedding import LoadShedder
+
+service_logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+DAY = 24 * 60 * 60
+
+
+class BatchStats(object):
+    def __init__(self, queries: int):
+        """
+        Implement the statistics of a batch query.
+
+        :param queries: Number of queries in the batch
+        """
+        self.queries = queries
+        self.located = 0
+        self.groups = 0
+        self.geocode_seconds = 0.0
+        self.fetch_seconds = 0.0
+
+    @property
+    def dedup_ratio(self) -> float:
+        """
+        Share of the located queries that did not need a weather fetch of
+        their own.
+        """
+        if not self.located:
+            return 0.0
+        return 1 - self.groups / self.located
+
+    def as_dict(self) -> dict:
+        return dict(
+            queries=self.queries,
+            located=self.located,
+            groups=self.groups,
+            dedup_ratio=self.dedup_ratio,
+            geocode_seconds=self.geocode_seconds,
+            fetch_seconds=self.fetch_seconds,
+        )
+
+
+class WeatherService(object):
+    def __init__(
+        self,
+        api_key: Union[str, Iterable[str], APIKeyPool],
+        session: Optional[aiohttp.ClientSession] = None,
+        logger: Optional[logging.Logger] = None,
+        geocode_cache: Optional[TTLCache] = None,
+        section_cache: Optional[SectionCache] = None,
+        weather_cache: Optional[TTLCache] = None,
+        map_options: Optional[dict] = None,
+        weather_options: Optional[dict] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        scheduler: Optional[PriorityScheduler] = None,
+        connect_timeout: Optional[float] = None,
+        load_shedder: Optional[LoadShedder] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        concurrency_limiter: Optional[AdaptiveLimiter] = None,
+        coalesce_requests: bool = True,
+        priority: str = NORMAL,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 30,
+        ttl_dns_cache: Optional[int] = 300,
+        warmup_connections: int = 0,
+    ):
+        """
+        Implement a weather service sharing one session and its caches
+        between queries.
+
+        :param api_key: Tencent Map WebServiceAPI key, several keys or an
+                        ``APIKeyPool``
+        :param session: Optionally specify the aiohttp session
+        :param logger: An optional logger
+        :param geocode_cache: Cache of location lookups, defaults to one day,
+                              served for a week longer to shed requests
+        :param section_cache: Cache of weather sections, defaults to the
+                              per-section TTLs of ``SectionCache``, served
+                              for 6 hours longer to shed requests
+        :param weather_cache: Optional response cache of ``QQWeather``
+        :param map_options: Extra ``QQMap`` options, for example
+                            ``districts`` or ``ip_resolver``
+        :param weather_options: Extra ``QQWeather`` options, for example
+                                ``batch_window``
+        :param rate_limiter: Optional rate limiter shared by both clients
+        :param scheduler: Optional priority scheduler shared by both clients
+        :param connect_timeout: Upper bound of the seconds each upstream call
+                                of a query with a timeout may spend
+                                connecting
+        :param load_shedder: Optional load shedder shared by both clients
+        :param retry_policy: Optional retry policy shared by both clients
+        :param circuit_breaker: Optional circuit breaker shared by both
+                                clients
+        :param concurrency_limiter: Optional adaptive concurrency limiter
+                                    shared by both clients
+        :param coalesce_requests: Share in-flight upstream calls between
+                                  identical concurrent requests
+        :param priority: Priority of queries that do not set one
+        :param limit: Total number of simultaneous pooled connections
+        :param limit_per_host: Number of simultaneous connections to the same
+                               host, 0 means no limit
+        :param keepalive_timeout: Seconds an idle connection is kept alive
+        :param ttl_dns_cache: Seconds resolved DNS entries are cached,
+                              None means forever
+        :param warmup_connections: Number of connections opened to each
+                                   upstream when entering the service
+                                   context
+        """
+        if not api_key:
+            raise ValueError("Please provide tencent map api key")
+        self.session = session
+        self.logger = logger or service_logger
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.warmup_connections = warmup_connections
+        self._session = None
+        if geocode_cache is None:
+            geocode_cache = TTLCache(
+                maxsize=4096, ttl=DAY, stale_if_overload=7 * DAY
+            )
+        if section_cache is None:
+            section_cache = SectionCache(stale_if_overload=6 * 60 * 60)
+        # The service makes no upstream call itself, the clients do
+        client_options = dict(
+            rate_limiter=rate_limiter,
+            scheduler=scheduler,
+            load_shedder=load_shedder,
+            retry_policy=retry_policy,
+            circuit_breaker=circuit_breaker,
+            concurrency_limiter=concurrency_limiter,
+            coalesce_requests=coalesce_requests,
+            priority=priority,
+        )
+        self.qq_map = QQMap(
+            api_key,
+            session=session,
+            logger=self.logger,
+            geocode_cache=geocode_cache,
+            **dict(client_options, **(map_options or {})),
+        )
+        self.qq_weather = QQWeather(
+            session=session,
+            logger=self.logger,
+            cache=weather_cache,
+            section_cache=section_cache,
+            **dict(client_options, **(weather_options or {})),
+        )
+        self.connect_timeout = connect_timeout
+        self.last_batch_stats = None
+
+    async def __aenter__(self):
+        if self.warmup_connections:
+            await self.warmup(self.warmup_connections)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """
+        Return the session shared by the map and weather clients.
+
+        The session passed to the constructor always wins, otherwise the
+        service-owned pooled session is created on first use.
+        """
+        session = self.session
+        if session is None:
+            if self._session is None or self._session.closed:
+                self._session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(
+                        limit=self.limit,
+                        limit_per_host=self.limit_per_host,
+                        keepalive_timeout=self.keepalive_timeout,
+                        ttl_dns_cache=self.ttl_dns_cache,
+                    ),
+                    raise_for_status=True,
+                )
+            session = self._session
+        self.qq_map.session = self.qq_weather.session = session
+        return session
+
+    async def warmup(self, connections: int = 1):
+        """
+        Pre-open connections to the map and weather endpoints.
+
+        :param connections: Number of connections to open to each endpoint
+        """
+        self.get_session()
+        await asyncio.gather(
+            self.qq_map.warmup(connections),
+            self.qq_weather.warmup(connections),
+        )
+
+    async def locate(
+        self,
+        query: str,
+        priority: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> dict:
+        """
+        Return the ``ad_info`` of a location query.
+
+        :param query: Location name, adcode, coordinates or IP address
+        :param priority: ``interactive``, ``normal`` or ``background``
+        :param deadline: Optional time budget of the lookup
+        """
+        if not query:
+            raise ValueError("Empty query")
+        self.get_session()
+        return await self.qq_map.location_lookup(
+            query, priority=priority, deadline=deadline
+        )
+
+    async def _fetch(
+        self,
+        query: str,
+        weather_type: str,
+        priority: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ):
+        # One budget for every hop, the phase running out of time is
+        # cancelled and named by DeadlineExceeded
+        deadline = None
+        if timeout is not None:
+            deadline = Deadline(timeout, connect_timeout=self.connect_timeout)
+        ad_info = await _within(
+            deadline,
+            "location_lookup",
+            self.locate(query, priority=priority, deadline=deadline),
+        )
+        res = await _within(
+            deadline,
+            "fetch_weather",
+            self.qq_weather.fetch_weather(
+                ad_info.get("province"),
+                ad_info.get("city"),
+                weather_type,
+                priority=priority,
+                deadline=deadline,
+            ),
+        )
+        return ad_info, res
+
+    async def query_current_weather(
+        self,
+        query: str,
+        priority: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> dict:
+        """
+        Return real-time weather data of a location query.
+
+        :param query: Location name, adcode, coordinates or IP address
+        :param priority: ``interactive``, ``normal`` or ``background``
+        :param timeout: Optional seconds the whole query may take, raising
+                        ``DeadlineExceeded`` when over
+        """
+        ad_info, res = await self._fetch(
+            query, CURRENT_WEATHER_TYPES, priority, timeout
+        )
+        res = format_current_weather(res)
+        res.update(location=ad_info)
+        return res
+
+    async def query_weather_forecast(
+        self,
+        query: str,
+        forecast_days: int = 7,
+        priority: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> dict:
+        """
+        Return forecast weather data of a location query.
+
+        :param query: Location name, adcode, coordinates or IP address
+        :param forecast_days: Number of forecast days, 1 returns hourly data
+        :param priority: ``interactive``, ``normal`` or ``background``
+        :param timeout: Optional seconds the whole query may take, raising
+                        ``DeadlineExceeded`` when over
+        """
+        _check_forecast_days(forecast_days)
+        ad_info, res = await self._fetch(
+            query, forecast_weather_type(forecast_days), priority, timeout
+        )
+        res = format_weather_forecast(res, forecast_days)
+        res.update(location=ad_info)
+        return res
+
+    async def full_report(
+        self,
+        query: str,
+        forecast_days: int = 7,
+        priority: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> dict:
+        """
+        Return both real-time and forecast weather data of a location query,
+        geocoding it once and fetching all weather types in one call.
+
+        :param query: Location name, adcode, coordinates or IP address
+        :param forecast_days: Number of forecast days, 1 returns hourly data
+        :param priority: ``interactive``, ``normal`` or ``background``
+        :param timeout: Optional seconds the whole query may take, raising
+                        ``DeadlineExceeded`` when over
+        :return: A dict with the ``current``, ``forecast`` and ``location``
+                 keys.
+        """
+        _check_forecast_days(forecast_days)
+        current_types = CURRENT_WEATHER_TYPES.split("|")
+        weather_types = set(current_types)
+        weather_types.update(forecast_weather_type(forecast_days).split("|"))
+        ad_info, res = await self._fetch(
+            query, "|".join(sorted(weather_types)), priority, timeout
+        )
+        current = {t: res[t] for t in current_types if t in res}
+        return dict(
+            current=format_current_weather(current),
+            forecast=format_weather_forecast(res, forecast_days),
+            location=ad_info,
+        )
+
+    async def _map_bounded(
+        self, items: List, fn: Callable[[Any], Awaitable], concurrency: int
+    ) -> List:
+        results = [None] * len(items)
+        pending = iter(enumerate(items))
+
+        async def worker():
+            for i, item in pending:
+                try:
+                    results[i] = await fn(item)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    results[i] = e
+
+        workers = min(concurrency, len(items))
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        return results
+
+    async def _run_many(
+        self,
+        queries: Iterable[str],
+        weather_type: str,
+        formatter: Callable[[dict], dict],
+        concurrency: int,
+        priority: Optional[str],
+    ) -> List:
+        _check_concurrency(concurrency)
+        queries = list(queries)
+        stats = BatchStats(len(queries))
+        self.get_session()
+        started = time.monotonic()
+
+        # Stage 1: geocode every distinct query
+        distinct = list(OrderedDict.fromkeys(queries))
+        ad_infos = dict(
+            zip(
+                distinct,
+                await self._map_bounded(
+                    distinct,
+                    lambda query: self.locate(query, priority=priority),
+                    concurrency,
+                ),
+            )
+        )
+        keys = list(
+            OrderedDict.fromkeys(
+                (ad_info.get("province"), ad_info.get("city"))
+                for ad_info in ad_infos.values()
+                if not isinstance(ad_info, Exception)
+            )
+        )
+        stats.geocode_seconds = time.monotonic() - started
+
+        # Stage 2: fetch the weather once per (province, city)
+        started = time.monotonic()
+        weather = dict(
+            zip(
+                keys,
+                await self._map_bounded(
+                    keys,
+                    lambda key: self.qq_weather.fetch_weather(
+                        *key, weather_type, priority=priority
+                    ),
+                    concurrency,
+                ),
+            )
+        )
+        stats.groups = len(keys)
+        stats.fetch_seconds = time.monotonic() - started
+
+        # Stage 3: fan the results out to every query of a group
+        results = []
+        for query in queries:
+            ad_info = ad_infos[query]
+            if isinstance(ad_info, Exception):
+                results.append(ad_info)
+                continue
+            stats.located += 1
+            res = weather[(ad_info.get("province"), ad_info.get("city"))]
+            if isinstance(res, Exception):
+                results.append(res)
+                continue
+            res = formatter(res)
+            res.update(location=dict(ad_info))
+            results.append(res)
+        self.last_batch_stats = stats
+        return results
+
+    async def query_current_weather_many(
+        self,
+        queries: Iterable[str],
+        concurrency: int = 10,
+        priority: Optional[str] = None,
+    ) -> List:
+        """
+        Return real-time weather data of many location queries.
+
+        Every distinct query is geocoded first, then the weather is fetched
+        once per resolved (province, city) and shared by all its queries.
+        Statistics of the run are kept in ``last_batch_stats``.
+
+        :param queries: Location names, adcodes, coordinates or IP addresses
+        :param concurrency: Maximum number of lookups or fetches in flight
+        :param priority: ``interactive``, ``normal`` or ``background``, use
+                         the latter for sweeps that must not slow down live
+                         queries
+        :return: Results in the order of ``queries``, with the exception
+                 raised by a failed query in its place.
+        """
+        return await self._run_many(
+            queries,
+            CURRENT_WEATHER_TYPES,
+            format_current_weather,
+            concurrency,
+            priority,
+        )
+
+    async def query_weather_forecast_many(
+        self,
+        queries: Iterable[str],
+        forecast_days: int = 7,
+        concurrency: int = 10,
+        priority: Optional[str] = None,
+    ) -> List:
+        """
+        Return forecast weather data of many location queries, fetched like
+        ``query_current_weather_many``.
+
+        :param queries: Location names, adcodes, coordinates or IP addresses
+        :param forecast_days: Number of forecast days, 1 returns hourly data
+        :param concurrency: Maximum number of lookups or fetches in flight
+        :param priority: ``interactive``, ``normal`` or ``background``
+        :return: Results in the order of ``queries``, with the exception
+                 raised by a failed query in its place.
+        """
+        _check_forecast_days(forecast_days)
+        return await self._run_many(
+            queries,
+            forecast_weather_type(forecast_days),
+            lambda res: format_weather_forecast(res, forecast_days),
+            concurrency,
+            priority,
+        )
+
+    async def _stream(
+        self,
+        queries: Union[Iterable[str], AsyncIterable[str]],
+        fetch: Callable[[str], Awaitable[dict]],
+        concurrency: int,
+        buffer: Optional[int],
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        self.get_session()
+        inbox = asyncio.Queue(maxsize=concurrency)
+        outbox = asyncio.Queue(maxsize=buffer or concurrency)
+        feed_errors = []
+
+        async def feed():
+            try:
+                if hasattr(queries, "__aiter__"):
+                    async for query in queries:
+                        await inbox.put(query)
+                else:
+                    for query in queries:
+                        await inbox.put(query)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                feed_errors.append(e)
+            for _ in range(concurrency):
+                await inbox.put(_DONE)
+
+        async def worker():
+            while True:
+                query = await inbox.get()
+                if query is _DONE:
+                    await outbox.put(_DONE)
+                    return
+                try:
+                    result = await fetch(query)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    result = e
+                # Blocks while the consumer lags behind, so no new query is
+                # started until there is room for its result
+                await outbox.put((query, result))
+
+        tasks = [asyncio.ensure_future(feed())]
+        tasks.extend(
+            asyncio.ensure_future(worker()) for _ in range(concurrency)
+        )
+        running = concurrency
+        try:
+            while running:
+                item = await outbox.get()
+                if item is _DONE:
+                    running -= 1
+                else:
+                    yield item
+            if feed_errors:
+                raise feed_errors[0]
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stream_current_weather(
+        self,
+        queries: Union[Iterable[str], AsyncIterable[str]],
+        concurrency: int = 10,
+        buffer: Optional[int] = None,
+        priority: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Yield ``(query, result)`` pairs of real-time weather data as soon as
+        each query completes, with the exception raised by a failed query as
+        its result.
+
+        At most ``concurrency`` queries run at a time, and no more query is
+        started while ``buffer`` results wait for the consumer. Leaving the
+        ``async for`` loop early cancels the queries still running.
+
+        :param queries: Iterable or async iterable of location queries
+        :param concurrency: Maximum number of queries in flight
+        :param buffer: Maximum number of results waiting for the consumer,
+                       defaults to ``concurrency``
+        :param priority: ``interactive``, ``normal`` or ``background``
+        """
+        _check_concurrency(concurrency)
+        return self._stream(
+            queries,
+            lambda query: self.query_current_weather(query, priority=priority),
+            concurrency,
+            buffer,
+        )
+
+    def stream_weather_forecast(
+        self,
+        queries: Union[Iterable[str], AsyncIterable[str]],
+        forecast_days: int = 7,
+        concurrency: int = 10,
+        buffer: Optional[int] = None,
+        priority: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Yield ``(query, result)`` pairs of forecast weather data, streamed
+        like ``stream_current_weather``.
+
+        :param queries: Iterable or async iterable of location queries
+        :param forecast_days: Number of forecast days, 1 returns hourly data
+        :param concurrency: Maximum number of queries in flight
+        :param buffer: Maximum number of results waiting for the consumer,
+                       defaults to ``concurrency``
+        :param priority: ``interactive``, ``normal`` or ``background``
+        """
+        _check_forecast_days(forecast_days)
+        _check_concurrency(concurrency)
+        return self._stream(
+            queries,
+            lambda query: self.query_weather_forecast(
+                query, forecast_days, priority=priority
+            ),
+            concurrency,
+            buffer,
+        )
+
+    async def aclose(self):
+        """
+        Close the service-owned session. A session passed to the
+        constructor is left for its owner to close.
+        """
+        await self.qq_map.aclose()
+        await self.qq_weather.aclose()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+async def _within(
+    deadline: Optional[Deadline], phase: str, awaitable: Awaitable
+):
+    if deadline is None:
+        return await awaitable
+    return await deadline.run(phase, awaitable)
+
+
+def _check_forecast_days(forecast_days: int):
+    if forecast_days > 7 or forecast_days < 0:
+        raise ValueError("Invalid forecast days")
+
+
+def _check_concurrency(concurrency: int):
+    if concurrency < 1:
+        raise ValueError("Concurrency must be positive")
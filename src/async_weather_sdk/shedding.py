@@ -0,0 +1,111 @@
+"""
+Load shedding.
+
+Under a traffic spike, requests queue up in front of the rate limiters,
+the schedulers and the event loop itself, and every queued request makes
+the next one slower. A ``LoadShedder`` tracks the upstream calls waiting or
+running and the event loop lag. Once either goes past its threshold, new
+low-priority calls are refused at once with ``LoadShedError`` instead of
+queuing more work.
+
+``LoadShedError`` is a connection error, so caches with a
+``stale_if_overload`` window answer shed requests with whatever they still
+hold, however old.
+"""
+
+import time
+from typing import Callable, Iterable
+
+import aiohttp
+import asyncio
+
+from .scheduler import BACKGROUND
+
+
+class LoadShedError(aiohttp.ClientConnectionError):
+    def __init__(self, priority: str, pending: int, lag: float):
+        super().__init__(
+            f"Shed {priority} request, overloaded with {pending} pending "
+            f"calls and {lag * 1000:.0f}ms event loop lag"
+        )
+        self.priority = priority
+        self.pending = pending
+        self.lag = lag
+
+
+class LoadShedder(object):
+    def __init__(
+        self,
+        max_pending: int = 100,
+        max_lag: float = 0.1,
+        shed: Iterable[str] = (BACKGROUND,),
+        smoothing: float = 0.3,
+        timer: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Implement load shedding driven by queue depth and event loop lag.
+
+        :param max_pending: Upstream calls waiting or running past which
+                            the SDK is overloaded
+        :param max_lag: Seconds of event loop lag past which the SDK is
+                        overloaded
+        :param shed: Priorities refused while overloaded
+        :param smoothing: Weight of the latest lag sample in the moving
+                          average
+        :param timer: Monotonic clock returning seconds
+        """
+        self.max_pending = max_pending
+        self.max_lag = max_lag
+        self.shed = frozenset(shed)
+        self.smoothing = smoothing
+        self.timer = timer
+        self.pending = 0
+        self.max_pending_seen = 0
+        self.lag = 0.0
+        self.admitted = 0
+        self.shed_counts = {}
+        self._probing = False
+
+    @property
+    def overloaded(self) -> bool:
+        return self.pending >= self.max_pending or self.lag >= self.max_lag
+
+    def _probe(self):
+        # The delay of a callback scheduled now is the time the loop needs
+        # to get through the work already ready to run
+        if self._probing:
+            return
+        self._probing = True
+        asyncio.get_event_loop().call_soon(self._measure, self.timer())
+
+    def _measure(self, scheduled_at: float):
+        self._probing = False
+        sample = self.timer() - scheduled_at
+        self.lag += self.smoothing * (sample - self.lag)
+
+    def admit(self, priority: str):
+        """
+        Count a new upstream call, or raise ``LoadShedError`` if its
+        priority is shed while overloaded. Admitted calls must be ended
+        with ``done``.
+        """
+        self._probe()
+        if priority in self.shed and self.overloaded:
+            self.shed_counts[priority] = self.shed_counts.get(priority, 0) + 1
+            raise LoadShedError(priority, self.pending, self.lag)
+        self.admitted += 1
+        self.pending += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+
+    def done(self, *_):
+        self.pending -= 1
+
+    def stats(self) -> dict:
+        return dict(
+            overloaded=self.overloaded,
+            pending=self.pending,
+            max_pending=self.max_pending_seen,
+            lag=self.lag,
+            admitted=self.admitted,
+            shed=dict(self.shed_counts),
+        )
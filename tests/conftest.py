@@ -1,4 +1,57 @@
+import asyncio
 import pytest
+from aiohttp import web
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def fake_timer():
+    return FakeTimer()
+
+
+@pytest.fixture()
+def json_handler():
+    """
+    Return a factory of aresponses handlers answering with a JSON payload,
+    optionally recording the requests and answering late.
+    """
+
+    def factory(data, calls=None, delay=0):
+        async def handler(request):
+            if calls is not None:
+                calls.append(request)
+            await asyncio.sleep(delay)
+            return web.json_response(data)
+
+        return handler
+
+    return factory
+
+
+@pytest.fixture()
+def qq_ip_location_resp():
+    return {
+        "status": 0,
+        "message": "query ok",
+        "result": {
+            "ip": "61.135.17.68",
+            "location": {"lat": 39.90469, "lng": 116.40717},
+            "ad_info": {
+                "nation": "中国",
+                "province": "北京市",
+                "city": "北京市",
+                "district": "",
+                "adcode": 110000,
+            },
+        },
+    }
 
 
 @pytest.fixture()
@@ -841,3 +894,84 @@ def qq_forecast_resp():
         "message": "OK",
         "status": 200,
     }
+
+
+@pytest.fixture()
+def qq_district_list_resp():
+    return {
+        "status": 0,
+        "message": "query ok",
+        "data_version": "20200527",
+        "result": [
+            [
+                {
+                    "id": "110000",
+                    "name": "北京",
+                    "fullname": "北京市",
+                    "pinyin": ["bei", "jing"],
+                    "location": {"lat": 39.90469, "lng": 116.40717},
+                    "cidx": [0, 1],
+                },
+                {
+                    "id": "130000",
+                    "name": "河北",
+                    "fullname": "河北省",
+                    "pinyin": ["he", "bei"],
+                    "location": {"lat": 38.03599, "lng": 114.46979},
+                    "cidx": [2, 2],
+                },
+                {
+                    "id": "220000",
+                    "name": "吉林",
+                    "fullname": "吉林省",
+                    "pinyin": ["ji", "lin"],
+                    "location": {"lat": 43.89616, "lng": 125.32568},
+                    "cidx": [3, 3],
+                },
+            ],
+            [
+                {
+                    "id": "110101",
+                    "name": "东城",
+                    "fullname": "东城区",
+                    "pinyin": ["dong", "cheng"],
+                    "location": {"lat": 39.93482, "lng": 116.41693},
+                },
+                {
+                    "id": "110105",
+                    "name": "朝阳",
+                    "fullname": "朝阳区",
+                    "pinyin": ["chao", "yang"],
+                    "location": {"lat": 39.92148, "lng": 116.44311},
+                },
+                {
+                    "id": "130100",
+                    "name": "石家庄",
+                    "fullname": "石家庄市",
+                    "pinyin": ["shi", "jia", "zhuang"],
+                    "location": {"lat": 38.04276, "lng": 114.5143},
+                    "cidx": [0, 0],
+                },
+                {
+                    "id": "220200",
+                    "name": "吉林",
+                    "fullname": "吉林市",
+                    "pinyin": ["ji", "lin"],
+                    "location": {"lat": 43.83784, "lng": 126.54944},
+                    "cidx": [1, 1],
+                },
+            ],
+            [
+                {
+                    "id": "130102",
+                    "fullname": "长安区",
+                    "location": {"lat": 38.03665, "lng": 114.53952},
+                },
+                {
+                    "id": "220202",
+                    "fullname": "昌邑区",
+                    "location": {"lat": 43.88181, "lng": 126.57428},
+                },
+            ],
+        ],
+    }
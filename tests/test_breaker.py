@@ -0,0 +1,125 @@
+import aiohttp
+import asyncio
+import pytest
+
+from async_weather_sdk.base import BaseClient
+from async_weather_sdk.breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+from async_weather_sdk.cache import TTLCache
+from async_weather_sdk.qq import QQWeather
+
+HOST = "wis.qq.com"
+
+
+def _server_error():
+    return aiohttp.ClientResponseError(None, (), status=500)
+
+
+def test_circuit_breaker_trips_on_errors(fake_timer):
+    breaker = CircuitBreaker(min_requests=4, open_seconds=10, timer=fake_timer)
+    for error in (None, _server_error(), None):
+        breaker.before(HOST)
+        breaker.after(HOST, 0.1, error)
+    # Client errors do not count against the host
+    breaker.before(HOST)
+    breaker.after(HOST, 0.1, aiohttp.ClientResponseError(None, (), status=404))
+    assert breaker.state(HOST) == CLOSED
+
+    for _ in range(2):
+        breaker.before(HOST)
+        breaker.after(HOST, 0.1, asyncio.TimeoutError())
+    assert breaker.state(HOST) == OPEN
+
+    fake_timer.now += 4
+    with pytest.raises(CircuitOpenError, match="retry in 6.0s") as exc_info:
+        breaker.before(HOST)
+    assert isinstance(exc_info.value, aiohttp.ClientConnectionError)
+    assert exc_info.value.retry_after == 6
+
+    # One probe at a time while half-open, a failed probe opens again
+    fake_timer.now += 6
+    breaker.before(HOST)
+    assert breaker.state(HOST) == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before(HOST)
+    breaker.after(HOST, 0.1, _server_error())
+    assert breaker.state(HOST) == OPEN
+
+    # A cancelled probe frees its slot, a successful one closes
+    fake_timer.now += 10
+    breaker.before(HOST)
+    breaker.after(HOST, 0.1, asyncio.CancelledError())
+    breaker.before(HOST)
+    breaker.after(HOST, 0.1)
+    assert breaker.state(HOST) == CLOSED
+
+    assert breaker.stats() == {
+        HOST: dict(
+            state=CLOSED, requests=0, failures=0, slow=0, trips=2, rejected=2
+        )
+    }
+
+
+def test_circuit_breaker_trips_on_latency(fake_timer):
+    breaker = CircuitBreaker(
+        min_requests=4, slow_threshold=1, window=10, timer=fake_timer
+    )
+    for latency in (2, 2, 0.1, 0.1):
+        fake_timer.now += 5
+        breaker.before(HOST)
+        breaker.after(HOST, latency)
+    # The first slow request left the window
+    assert breaker.state(HOST) == CLOSED
+    assert breaker.circuit(HOST).stats()["requests"] == 2
+
+    for latency in (2, 2):
+        breaker.before(HOST)
+        breaker.after(HOST, latency)
+    assert breaker.state(HOST) == OPEN
+    assert breaker.state("apis.map.qq.com") == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_client_circuit_breaker(
+    aresponses, qq_forecast_resp, fake_timer
+):
+    aresponses.add(HOST, "/weather/common", "GET", response=qq_forecast_resp)
+    aresponses.add(
+        HOST,
+        "/weather/common",
+        "GET",
+        response=aresponses.Response(status=503),
+        repeat=2,
+    )
+
+    breaker = CircuitBreaker(min_requests=2, timer=fake_timer)
+    cache = TTLCache(ttl=60, timer=fake_timer, stale_if_error=600)
+    async with QQWeather(cache=cache, circuit_breaker=breaker) as qq_weather:
+        await qq_weather.fetch_current_weather("北京市", "北京市")
+
+        fake_timer.now = 120
+        with pytest.raises(aiohttp.ClientResponseError):
+            await qq_weather.fetch_current_weather("北京市", "上海市")
+        await qq_weather.fetch_current_weather("北京市", "北京市")
+        assert breaker.state(HOST) == OPEN
+
+        # Fail fast while open, the cache answers with stale data
+        res = await qq_weather.fetch_current_weather("北京市", "北京市")
+        assert "observe" in res
+        assert cache.stale_errors == 2
+        with pytest.raises(CircuitOpenError):
+            await qq_weather.fetch_current_weather("北京市", "上海市")
+        assert breaker.stats()[HOST]["rejected"] == 2
+
+    aresponses.assert_all_requests_matched()
+
+    async with BaseClient(
+        "https://wis.qq.com", circuit_breaker=breaker
+    ) as client:
+        with pytest.raises(CircuitOpenError):
+            await client.request("/weather/common")
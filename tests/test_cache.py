@@ -0,0 +1,149 @@
+import aiohttp
+import asyncio
+import pytest
+
+from async_weather_sdk.cache import TTLCache
+from async_weather_sdk.deadline import Deadline
+from async_weather_sdk.scheduler import BACKGROUND, INTERACTIVE
+
+
+def test_cache_ttl_expiration(fake_timer):
+    cache = TTLCache(maxsize=2, ttl=10, timer=fake_timer)
+
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=30)
+    assert cache.get("a") == 1
+    assert "a" in cache
+
+    fake_timer.now = 10
+    assert cache.get("a") is None
+    assert "a" not in cache
+    assert cache.get("b") == 2
+
+    assert cache.stats() == dict(
+        size=1,
+        maxsize=2,
+        hits=2,
+        misses=1,
+        evictions=0,
+        expirations=1,
+        stale_hits=0,
+        stale_errors=0,
+        stale_overloads=0,
+        refreshes=0,
+        refresh_errors=0,
+    )
+
+
+def test_cache_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=10)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert len(cache) == 2
+    assert cache.get("b", "missing") == "missing"
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.evictions == 1
+
+    cache.delete("a")
+    assert "a" not in cache
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_cache_invalid_maxsize():
+    with pytest.raises(ValueError, match="Cache maxsize must be positive"):
+        TTLCache(maxsize=0)
+
+
+class FakeLoader(object):
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+        self.kwargs = []
+
+    async def __call__(self, **kwargs):
+        self.calls += 1
+        self.kwargs.append(kwargs)
+        await asyncio.sleep(0)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.mark.asyncio
+async def test_cache_get_or_load(fake_timer):
+    cache = TTLCache(ttl=10, timer=fake_timer)
+    loader = FakeLoader(1, {}, 2)
+
+    assert await cache.get_or_load("a", loader) == 1
+    assert await cache.get_or_load("a", loader) == 1
+    assert loader.calls == 1
+
+    fake_timer.now = 10
+    assert (
+        await cache.get_or_load("a", loader, ttl=lambda v: 5 if v else 0) == {}
+    )
+    assert "a" not in cache
+    assert (
+        await cache.get_or_load("a", loader, ttl=lambda v: 5 if v else 0) == 2
+    )
+    assert cache.stats()["misses"] == 3
+
+    fake_timer.now = 15
+    assert "a" not in cache
+
+
+@pytest.mark.asyncio
+async def test_cache_stale_while_revalidate(fake_timer):
+    cache = TTLCache(ttl=10, timer=fake_timer, stale_while_revalidate=5)
+    loader = FakeLoader(1, 2, aiohttp.ClientConnectionError())
+    deadline = Deadline(1)
+
+    await cache.get_or_load("a", loader)
+    fake_timer.now = 12
+    results = [
+        await cache.get_or_load(
+            "a", loader, priority=INTERACTIVE, deadline=deadline
+        )
+        for _ in range(3)
+    ]
+    assert results == [1, 1, 1]
+    await asyncio.sleep(0.01)
+    assert loader.calls == 2
+    # The refresh runs in the background, not for the triggering caller
+    assert loader.kwargs == [{}, dict(priority=BACKGROUND)]
+    assert await cache.get_or_load("a", loader) == 2
+
+    fake_timer.now = 24
+    assert await cache.get_or_load("a", loader) == 2
+    await asyncio.sleep(0.01)
+    assert cache.stats()["stale_hits"] == 4
+    assert cache.stats()["refreshes"] == 2
+    assert cache.stats()["refresh_errors"] == 1
+
+    fake_timer.now = 30
+    assert cache.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_cache_stale_if_error(fake_timer):
+    cache = TTLCache(ttl=10, timer=fake_timer, stale_if_error=60)
+    loader = FakeLoader(
+        1, aiohttp.ClientConnectionError(), aiohttp.ClientConnectionError()
+    )
+
+    await cache.get_or_load("a", loader)
+    fake_timer.now = 20
+    assert cache.get("a") is None
+    assert await cache.get_or_load("a", loader) == 1
+    assert cache.stale_errors == 1
+
+    fake_timer.now = 70
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await cache.get_or_load("a", loader)
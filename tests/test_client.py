@@ -83,7 +83,7 @@ async def test_request_with_timeout(aresponses):
             await client.request("/v1", timeout=0.05)
 
 
-async def test_session_closed_after_request(aresponses):
+async def test_session_reused_until_aclose(aresponses):
     aresponses.add(
         "BASE_ENDPOINT",
         "/v1",
@@ -93,8 +93,121 @@ async def test_session_closed_after_request(aresponses):
             text='{"status": 200}',
             headers={"CONTENT-TYPE": "application/json"},
         ),
+        repeat=2,
     )
 
     client = BaseClient("https://BASE_ENDPOINT/")
     assert client.session is None
     await client.request("/v1")
+    session = client.get_session()
+    assert not session.closed
+
+    await client.request("/v1")
+    assert client.get_session() is session
+
+    await client.aclose()
+    assert session.closed
+
+
+async def test_client_context_manager_with_warmup(aresponses):
+    aresponses.add(
+        "BASE_ENDPOINT",
+        "/",
+        "HEAD",
+        response=aresponses.Response(status=200),
+        repeat=2,
+    )
+
+    async with BaseClient(
+        "https://BASE_ENDPOINT/", limit_per_host=4, warmup_connections=2
+    ) as client:
+        session = client.get_session()
+        assert session.connector.limit_per_host == 4
+        assert not session.closed
+
+    assert session.closed
+    aresponses.assert_all_requests_matched()
+
+
+async def test_client_warmup_failure_is_ignored():
+    async with BaseClient("https://BASE_ENDPOINT/") as client:
+        await client.warmup()
+
+
+def _add_slow_endpoint(aresponses, calls, status=200, delay=0.05, repeat=3):
+    async def response_handler(request):
+        calls.append(request.path_qs)
+        await asyncio.sleep(delay)
+        return aresponses.Response(
+            status=status,
+            text='{"status": 200}',
+            headers={"CONTENT-TYPE": "application/json"},
+        )
+
+    aresponses.add(
+        "BASE_ENDPOINT", "/v1", "GET", response_handler, repeat=repeat,
+    )
+
+
+async def test_request_coalescing(aresponses):
+    calls = []
+    _add_slow_endpoint(aresponses, calls)
+
+    async with BaseClient("https://BASE_ENDPOINT/") as client:
+        results = await asyncio.gather(
+            *(client.request("/v1", params={"a": "1"}) for _ in range(5)),
+            client.request("/v1", params={"a": "2"}),
+        )
+        assert results == [{"status": 200}] * 6
+        assert sorted(calls) == ["/v1?a=1", "/v1?a=2"]
+        assert not client._inflight
+
+        await client.request("/v1", params={"a": "1"})
+        assert len(calls) == 3
+
+
+async def test_request_coalescing_disabled(aresponses):
+    calls = []
+    _add_slow_endpoint(aresponses, calls)
+
+    async with BaseClient(
+        "https://BASE_ENDPOINT/", coalesce_requests=False
+    ) as client:
+        await asyncio.gather(*(client.request("/v1") for _ in range(3)))
+        assert len(calls) == 3
+
+
+async def test_request_coalescing_propagates_errors(aresponses):
+    calls = []
+    _add_slow_endpoint(aresponses, calls, status=500)
+
+    async with BaseClient("https://BASE_ENDPOINT/") as client:
+        results = await asyncio.gather(
+            *(client.request("/v1") for _ in range(3)), return_exceptions=True
+        )
+        assert len(calls) == 1
+        assert all(isinstance(r, aiohttp.ClientResponseError) for r in results)
+
+
+async def test_request_coalescing_cancellation(aresponses):
+    calls = []
+    _add_slow_endpoint(aresponses, calls, delay=0.1)
+
+    async with BaseClient("https://BASE_ENDPOINT/") as client:
+        first = asyncio.ensure_future(client.request("/v1"))
+        second = asyncio.ensure_future(client.request("/v1"))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        assert await second == {"status": 200}
+        assert first.cancelled()
+        assert len(calls) == 1
+
+        waiters = [asyncio.ensure_future(client.request("/v1")) for _ in "ab"]
+        await asyncio.sleep(0.02)
+        (inflight,) = client._inflight.values()
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert inflight.task.cancelled()
+        assert not client._inflight
@@ -0,0 +1,159 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from async_weather_sdk.base import BaseClient
+from async_weather_sdk.concurrency import AdaptiveLimiter
+from async_weather_sdk.qq import QQMap
+
+pytestmark = pytest.mark.asyncio
+
+HOST = "wis.qq.com"
+
+
+def _response_error(status):
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+
+async def test_adaptive_limiter_aimd(fake_timer):
+    limiter = AdaptiveLimiter(initial=2, min_limit=1, timer=fake_timer)
+    await limiter.acquire(HOST)
+    await limiter.acquire(HOST)
+    waiter = asyncio.ensure_future(limiter.acquire(HOST))
+    await asyncio.sleep(0)
+    assert not waiter.done()
+    assert limiter.stats()[HOST]["queued"] == 1
+
+    # Successes at full use grow the limit, the freed slot goes to the queue
+    limiter.release(HOST, 0.1)
+    await waiter
+    limiter.release(HOST, 0.1)
+    state = limiter.host(HOST)
+    assert state.limit == pytest.approx(2.9)
+    assert state.in_flight == 1
+    assert state.baseline == 0.1
+
+    # Much slower than the baseline, the limit is halved once per baseline
+    limiter.release(HOST, 0.5)
+    await limiter.acquire(HOST)
+    limiter.release(HOST, 0.5)
+    assert state.limit == pytest.approx(1.45)
+
+    fake_timer.now += 1
+    await limiter.acquire(HOST)
+    limiter.release(HOST, 0.1, _response_error(503))
+    assert state.limit == 1
+
+    # Client errors say nothing about the host
+    fake_timer.now += 1
+    await limiter.acquire(HOST)
+    limiter.release(HOST, 0.1, _response_error(404))
+    await limiter.acquire(HOST)
+    limiter.release(HOST, 0.1, asyncio.CancelledError())
+    assert state.decreases == 2
+    assert state.in_flight == 0
+
+    fake_timer.now += 1
+    await limiter.acquire(HOST)
+    limiter.release(HOST, 0.1, _response_error(429))
+    await limiter.acquire(HOST)
+    limiter.release(HOST, 0.1, throttled=True)
+    assert limiter.stats()[HOST]["throttled"] == 2
+
+    with pytest.raises(ValueError, match="Backoff must be between 0 and 1"):
+        AdaptiveLimiter(backoff=1)
+
+
+async def test_adaptive_limiter_cancel_waiter():
+    limiter = AdaptiveLimiter(initial=1, max_limit=1)
+    await limiter.acquire(HOST)
+    waiter = asyncio.ensure_future(limiter.acquire(HOST))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.sleep(0)
+    limiter.release(HOST, 0.1)
+    assert limiter.stats()[HOST]["queued"] == 0
+    assert limiter.host(HOST).in_flight == 0
+
+    # A slot handed over to a waiter cancelled in the meantime is returned
+    await limiter.acquire(HOST)
+    waiter = asyncio.ensure_future(limiter.acquire(HOST))
+    await asyncio.sleep(0)
+    limiter.release(HOST, 0.1)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert limiter.host(HOST).in_flight == 0
+
+    # A release between the cancellation and the wake-up pops the waiter
+    await limiter.acquire(HOST)
+    waiter = asyncio.ensure_future(limiter.acquire(HOST))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    limiter.release(HOST, 0.1)
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert limiter.stats()[HOST]["queued"] == 0
+    assert limiter.host(HOST).in_flight == 0
+
+
+async def test_limiter_backs_off_overloaded_server():
+    active = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        try:
+            # The server keeps up with 4 concurrent requests, then slows down
+            await asyncio.sleep(0.005 * max(active - 3, 1))
+        finally:
+            active -= 1
+        return web.json_response({"status": 0})
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        limiter = AdaptiveLimiter(initial=20)
+        async with BaseClient(
+            f"http://127.0.0.1:{port}/", concurrency_limiter=limiter
+        ) as client:
+            await asyncio.gather(
+                *(client.request("/", params=dict(i=i)) for i in range(200))
+            )
+    finally:
+        await runner.cleanup()
+
+    stats = limiter.stats()["127.0.0.1"]
+    assert stats["decreases"] >= 1
+    assert stats["limit"] < 20
+    assert stats["in_flight"] == 0
+    assert peak <= 20
+
+
+async def test_qq_map_throttling_cuts_limit(aresponses):
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/location/v1/ip",
+        "GET",
+        aresponses.Response(
+            text='{"status": 120, "message": "QPS exceeded"}',
+            headers={"Content-Type": "application/json"},
+        ),
+    )
+
+    limiter = AdaptiveLimiter(initial=8)
+    async with QQMap("KEY_A", concurrency_limiter=limiter) as qq_map:
+        await qq_map.location_lookup("61.135.1.1")
+
+    stats = limiter.stats()["apis.map.qq.com"]
+    assert stats["throttled"] == 1
+    assert stats["limit"] == 4
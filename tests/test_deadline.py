@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+import pytest
+
+from async_weather_sdk.base import BaseClient
+from async_weather_sdk.deadline import Deadline, DeadlineExceeded
+from async_weather_sdk.qq import QQWeather, query_current_weather
+from async_weather_sdk.retry import is_retriable
+from async_weather_sdk.service import WeatherService
+
+
+def test_deadline_budget(fake_timer):
+    deadline = Deadline(2, connect_timeout=0.5, timer=fake_timer)
+    fake_timer.now += 0.5
+    assert deadline.remaining() == 1.5
+    timeout = deadline.client_timeout()
+    assert timeout.total == 1.5
+    assert timeout.sock_read == 1.5
+    assert timeout.sock_connect == 0.5
+
+    fake_timer.now += 1.3
+    assert deadline.client_timeout().sock_connect == pytest.approx(0.2)
+    deadline.check("geocode")
+
+    fake_timer.now += 1
+    assert deadline.expired
+    with pytest.raises(DeadlineExceeded, match="exceeded in geocode"):
+        deadline.check("geocode")
+    assert not is_retriable(DeadlineExceeded("geocode", deadline))
+
+    with pytest.raises(ValueError, match="Timeout must be positive"):
+        Deadline(0)
+
+
+@pytest.mark.asyncio
+async def test_deadline_run():
+    deadline = Deadline(0.05)
+    assert await deadline.run("fast", asyncio.sleep(0, "done")) == "done"
+    with pytest.raises(DeadlineExceeded) as exc_info:
+        await deadline.run("slow", asyncio.sleep(1))
+    assert isinstance(exc_info.value, asyncio.TimeoutError)
+    assert exc_info.value.phase == "slow"
+    assert list(exc_info.value.spent) == ["fast", "slow"]
+    assert "spent fast 0.0" in str(exc_info.value)
+
+    # Nothing is started once the budget is spent
+    with pytest.raises(DeadlineExceeded, match="exceeded in late"):
+        await deadline.run("late", asyncio.sleep(1))
+
+
+@pytest.mark.asyncio
+async def test_deadline_coalescing(aresponses, json_handler):
+    calls = []
+    handler = json_handler({"status": 0}, calls, delay=0.1)
+    aresponses.add("BASE_ENDPOINT", "/v1", "GET", handler, repeat=3)
+
+    async with BaseClient("https://BASE_ENDPOINT/") as client:
+        # A caller without a deadline does not share a timed call
+        interactive = asyncio.ensure_future(
+            client.request("/v1", deadline=Deadline(0.05))
+        )
+        await asyncio.sleep(0.01)
+        sweep = asyncio.ensure_future(client.request("/v1"))
+        with pytest.raises(DeadlineExceeded):
+            await interactive
+        assert await sweep == {"status": 0}
+        assert len(calls) == 2
+
+        # A tighter caller joins a looser call, within its own budget
+        calls.clear()
+        loose = asyncio.ensure_future(
+            client.request("/v1", deadline=Deadline(1))
+        )
+        await asyncio.sleep(0.01)
+        with pytest.raises(DeadlineExceeded, match="exceeded in /v1"):
+            await client.request("/v1", deadline=Deadline(0.05))
+        assert await loose == {"status": 0}
+        assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_deadline_batching(aresponses, json_handler, qq_forecast_resp):
+    calls = []
+    handler = json_handler(qq_forecast_resp, calls, delay=0.3)
+    aresponses.add("wis.qq.com", "/weather/common", "GET", handler)
+
+    async with QQWeather(batch_window=0.01) as qq_weather:
+        # The batch runs without a deadline, the tight caller gives up alone
+        sweep = asyncio.ensure_future(
+            qq_weather.fetch_weather("北京市", "北京市", "air")
+        )
+        start = time.monotonic()
+        with pytest.raises(
+            DeadlineExceeded, match="exceeded in /weather/common"
+        ):
+            await qq_weather.fetch_weather(
+                "北京市", "北京市", "observe", deadline=Deadline(0.05)
+            )
+        assert time.monotonic() - start < 0.2
+        assert list(await sweep) == ["air"]
+        assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_deadline_across_phases(
+    aresponses, json_handler, qq_ip_location_resp, qq_forecast_resp
+):
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/location/v1/ip",
+        "GET",
+        json_handler(qq_ip_location_resp, delay=0.05),
+        repeat=3,
+    )
+    aresponses.add(
+        "wis.qq.com",
+        "/weather/common",
+        "GET",
+        json_handler(qq_forecast_resp, delay=1),
+        repeat=2,
+    )
+
+    async with WeatherService("API_KEY") as service:
+        # Every query looks its location up again
+        service.qq_map.geocode_cache = None
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded) as exc_info:
+            await service.query_current_weather("61.135.17.68", timeout=0.3)
+        # The weather fetch only had what the lookup left of the budget
+        assert time.monotonic() - started < 0.5
+        error = exc_info.value
+        assert error.phase == "fetch_weather"
+        assert error.hop == "/weather/common"
+        assert 0.05 <= error.spent["location_lookup"] < 0.3
+
+        with pytest.raises(DeadlineExceeded) as exc_info:
+            await service.full_report("61.135.17.68", timeout=0.02)
+        assert exc_info.value.phase == "location_lookup"
+        assert list(exc_info.value.spent) == ["location_lookup"]
+
+    with pytest.raises(DeadlineExceeded, match="exceeded in fetch_weather"):
+        await query_current_weather("API_KEY", "61.135.17.68", timeout=0.3)
@@ -0,0 +1,162 @@
+import json
+
+import pytest
+
+from async_weather_sdk.district import DistrictSnapshot, main
+from async_weather_sdk.qq import QQMap
+from async_weather_sdk.service import WeatherService
+
+
+def test_district_snapshot(qq_district_list_resp):
+    snapshot = DistrictSnapshot.from_api_result(
+        qq_district_list_resp["result"], "20200527"
+    )
+    assert len(snapshot) == 9
+
+    assert snapshot.lookup("110105") == {
+        "nation": "中国",
+        "province": "北京市",
+        "city": "北京市",
+        "district": "朝阳区",
+        "adcode": 110105,
+    }
+    assert snapshot.lookup(130100) == {
+        "nation": "中国",
+        "province": "河北省",
+        "city": "石家庄市",
+        "district": "",
+        "adcode": 130100,
+    }
+    assert snapshot.lookup("130102")["district"] == "长安区"
+    assert snapshot.lookup("130102")["city"] == "石家庄市"
+    # Municipalities are their own city, provinces use their capital
+    assert snapshot.lookup("110000")["city"] == "北京市"
+    assert snapshot.lookup("130000")["city"] == "石家庄市"
+    assert snapshot.lookup("220000")["city"] == "吉林市"
+    assert snapshot.lookup("999999") is None
+    assert snapshot.lookup("北京") is None
+    assert snapshot.by_adcode[220202]["parent"] == 220200
+
+
+def test_district_snapshot_save_and_geocoder(tmp_path, qq_district_list_resp):
+    path = str(tmp_path / "districts.json")
+    DistrictSnapshot.from_api_result(
+        qq_district_list_resp["result"], "20200527"
+    ).save(path)
+
+    snapshot = DistrictSnapshot.load(path)
+    assert snapshot.data_version == "20200527"
+    assert snapshot.lookup("220202")["district"] == "昌邑区"
+
+    geocoder = snapshot.to_geocoder()
+    assert sorted(d[2]["adcode"] for d in geocoder.districts) == [
+        110101,
+        110105,
+        130102,
+        220202,
+    ]
+    assert geocoder.lookup(38.03, 114.54)["district"] == "长安区"
+
+
+@pytest.mark.asyncio
+async def test_qq_map_adcode_lookup(aresponses, qq_district_list_resp):
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/district/v1/list",
+        "GET",
+        response=qq_district_list_resp,
+        repeat=2,
+    )
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/district/v1/search",
+        "GET",
+        response={"status": 0, "message": "query ok", "result": []},
+    )
+
+    async with QQMap("API_KEY") as qq_map:
+        snapshot = await qq_map.refresh_districts()
+        assert len(snapshot) == 9
+
+        res = await qq_map.location_lookup(" 110105 ")
+        assert res["district"] == "朝阳区"
+
+        res = await qq_map.location_lookup("654321")
+        assert res == {}
+
+        await qq_map.refresh_districts()
+        assert qq_map.districts is snapshot
+    aresponses.assert_all_requests_matched()
+
+
+def test_district_snapshot_without_city(qq_district_list_resp):
+    result = qq_district_list_resp["result"]
+    del result[0][1]["location"]
+    snapshot = DistrictSnapshot.from_api_result(result)
+    # Nothing names the city of the province, the geocoder has to
+    assert snapshot.by_adcode[130000]["city"] == ""
+    assert snapshot.lookup("130000") is None
+    assert snapshot.lookup("130100")["city"] == "石家庄市"
+
+
+@pytest.mark.asyncio
+async def test_adcode_weather_query(
+    aresponses, qq_district_list_resp, qq_forecast_resp
+):
+    cities = []
+
+    async def weather_handler(request):
+        cities.append((request.query["province"], request.query["city"]))
+        return aresponses.Response(
+            body=json.dumps(qq_forecast_resp),
+            headers={"Content-Type": "application/json"},
+        )
+
+    aresponses.add(
+        "wis.qq.com", "/weather/common", "GET", weather_handler, repeat=2
+    )
+
+    snapshot = DistrictSnapshot.from_api_result(
+        qq_district_list_resp["result"]
+    )
+    async with WeatherService(
+        "API_KEY", map_options=dict(districts=snapshot)
+    ) as service:
+        for adcode, city in (
+            ("110000", "北京市"),
+            ("110105", "北京市"),
+            ("130000", "石家庄市"),
+        ):
+            res = await service.query_current_weather(adcode)
+            assert res["location"]["city"] == city
+            assert res["observe"]["degree"] == "29"
+
+    # The district of Beijing shares the weather of the municipality
+    assert cities == [("北京市", "北京市"), ("河北省", "石家庄市")]
+
+
+@pytest.mark.asyncio
+async def test_district_snapshot_fetch_error(aresponses):
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/district/v1/list",
+        "GET",
+        response={"status": 311, "message": "key格式错误"},
+    )
+
+    async with QQMap("API_KEY") as qq_map:
+        with pytest.raises(ValueError, match="Failed to fetch district list"):
+            await DistrictSnapshot.fetch(qq_map)
+
+
+def test_district_build_tool(tmp_path, mocker, qq_district_list_resp, capsys):
+    async def fake_request(self, url, **kwargs):
+        assert url == "/ws/district/v1/list"
+        return qq_district_list_resp
+
+    mocker.patch("async_weather_sdk.qq.QQMap.request", fake_request)
+    path = str(tmp_path / "districts.json")
+    main(["API_KEY", path])
+
+    assert "Wrote 9 districts (version 20200527)" in capsys.readouterr().out
+    assert len(DistrictSnapshot.load(path)) == 9
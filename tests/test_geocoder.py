@@ -0,0 +1,103 @@
+import pytest
+
+from async_weather_sdk.geocoder import ReverseGeocoder, parse_coordinates
+from async_weather_sdk.qq import QQMap
+
+DISTRICTS = [
+    dict(
+        adcode=110101,
+        province="北京市",
+        city="北京市",
+        district="东城区",
+        lat=39.93482,
+        lng=116.41693,
+    ),
+    dict(
+        adcode=110105,
+        province="北京市",
+        city="北京市",
+        district="朝阳区",
+        lat=39.92148,
+        lng=116.44311,
+    ),
+    dict(
+        adcode=110108,
+        province="北京市",
+        city="北京市",
+        district="海淀区",
+        lat=39.95993,
+        lng=116.29812,
+    ),
+    dict(
+        adcode=310101,
+        province="上海市",
+        city="上海市",
+        district="黄浦区",
+        lat=31.23164,
+        lng=121.48417,
+    ),
+]
+
+
+def test_parse_coordinates():
+    assert parse_coordinates("39.9, 116.4") == (39.9, 116.4)
+    assert parse_coordinates("39.9") is None
+    assert parse_coordinates("north,east") is None
+    assert parse_coordinates("139.9,116.4") is None
+    assert parse_coordinates(None) is None
+
+
+def test_reverse_geocoder_lookup():
+    geocoder = ReverseGeocoder(DISTRICTS)
+    assert len(geocoder) == 4
+
+    assert geocoder.lookup(39.96, 116.31) == {
+        "nation": "中国",
+        "province": "北京市",
+        "city": "北京市",
+        "district": "海淀区",
+        "adcode": 110108,
+    }
+    assert geocoder.lookup(31.2, 121.5)["district"] == "黄浦区"
+
+    # Halfway between 东城区 and 朝阳区
+    assert geocoder.lookup(39.92815, 116.43002) is None
+    # Too far from any district
+    assert geocoder.lookup(45.0, 126.0) is None
+    assert (geocoder.hits, geocoder.misses, geocoder.ambiguous) == (2, 1, 1)
+
+    nearest = geocoder.nearest(39.93, 116.42, count=3)
+    assert [ad_info["adcode"] for _, ad_info in nearest] == [
+        110101,
+        110105,
+        110108,
+    ]
+
+
+def test_reverse_geocoder_save_and_load(tmp_path):
+    path = str(tmp_path / "districts.json")
+    ReverseGeocoder(DISTRICTS).save(path)
+
+    geocoder = ReverseGeocoder.load(path, max_distance=10)
+    assert len(geocoder) == 4
+    assert geocoder.lookup(39.96, 116.31)["adcode"] == 110108
+    assert geocoder.lookup(39.96, 116.7) is None
+
+
+@pytest.mark.asyncio
+async def test_qq_map_reverse_geocoder(aresponses):
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/geocoder/v1",
+        "GET",
+        response={"status": 0, "result": {"ad_info": {"district": "朝阳区"}}},
+    )
+
+    geocoder = ReverseGeocoder(DISTRICTS)
+    async with QQMap("API_KEY", reverse_geocoder=geocoder) as qq_map:
+        res = await qq_map.location_lookup("39.96,116.31")
+        assert res["district"] == "海淀区"
+
+        res = await qq_map.location_lookup_by_coordinates("39.92815,116.43002")
+        assert res == {"district": "朝阳区"}
+    aresponses.assert_all_requests_matched()
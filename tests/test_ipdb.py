@@ -0,0 +1,116 @@
+import csv
+
+import pytest
+
+from async_weather_sdk.ipdb import IPIndex, build_index, main
+from async_weather_sdk.qq import QQMap
+
+ROWS = [
+    dict(
+        start_ip="61.135.0.0",
+        end_ip="61.135.255.255",
+        adcode="110000",
+        province="北京市",
+        city="北京市",
+        district="",
+    ),
+    dict(
+        start_ip="1.0.1.0",
+        end_ip="1.0.3.255",
+        adcode="350000",
+        province="福建省",
+        city="",
+        district="",
+    ),
+    dict(
+        start_ip="61.136.0.0",
+        end_ip="61.136.0.255",
+        adcode="110000",
+        province="北京市",
+        city="北京市",
+        district="",
+    ),
+]
+
+
+@pytest.fixture()
+def ip_index_path(tmp_path):
+    path = str(tmp_path / "ip.idx")
+    assert build_index(ROWS, path) == 3
+    return path
+
+
+@pytest.mark.parametrize("use_mmap", [True, False])
+def test_ip_index_lookup(ip_index_path, use_mmap):
+    index = IPIndex.open(ip_index_path, use_mmap=use_mmap)
+    assert len(index) == 3
+    assert len(index.ad_infos) == 2
+
+    assert index.lookup("61.135.17.68") == {
+        "nation": "中国",
+        "province": "北京市",
+        "city": "北京市",
+        "district": "",
+        "adcode": 110000,
+    }
+    assert index.lookup("1.0.1.0")["province"] == "福建省"
+    assert index.lookup("1.0.3.255")["province"] == "福建省"
+    assert index.lookup("61.136.0.1")["city"] == "北京市"
+
+    assert index.lookup("1.0.0.255") is None
+    assert index.lookup("1.0.4.0") is None
+    assert index.lookup("0.0.0.0") is None
+    assert index.lookup("255.255.255.255") is None
+    assert index.lookup("not an ip") is None
+    assert (index.hits, index.misses) == (4, 5)
+
+    index.close()
+    index.close()
+
+
+def test_ip_index_invalid_input(tmp_path):
+    path = str(tmp_path / "ip.idx")
+    with pytest.raises(ValueError, match="Invalid range"):
+        build_index([dict(ROWS[0], end_ip="61.134.0.0")], path)
+    with pytest.raises(ValueError, match="Overlapping ranges"):
+        build_index([ROWS[0], dict(ROWS[0], start_ip="61.135.255.0")], path)
+
+    assert build_index([], path) == 0
+    assert IPIndex.open(path).lookup("1.1.1.1") is None
+
+    with open(path, "wb") as f:
+        f.write(b"\0" * 16)
+    with pytest.raises(ValueError, match="Not an IP index file"):
+        IPIndex.open(path)
+
+
+def test_ip_index_build_tool(tmp_path, capsys):
+    source = str(tmp_path / "ip.csv")
+    output = str(tmp_path / "ip.idx")
+    with open(source, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=list(ROWS[0]))
+        writer.writeheader()
+        writer.writerows(ROWS)
+
+    main([source, output])
+    assert "Wrote 3 ranges" in capsys.readouterr().out
+    assert IPIndex.open(output).lookup("61.135.17.68")["adcode"] == 110000
+
+
+@pytest.mark.asyncio
+async def test_qq_map_ip_resolver(aresponses, ip_index_path):
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/location/v1/ip",
+        "GET",
+        response={"status": 0, "result": {"ad_info": {"province": "上海市"}}},
+    )
+
+    index = IPIndex.open(ip_index_path)
+    async with QQMap("API_KEY", ip_resolver=index) as qq_map:
+        res = await qq_map.location_lookup("61.135.17.68")
+        assert res["province"] == "北京市"
+
+        res = await qq_map.location_lookup_by_ip("202.96.0.1")
+        assert res == {"province": "上海市"}
+    aresponses.assert_all_requests_matched()
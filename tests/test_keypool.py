@@ -0,0 +1,149 @@
+import json
+
+import pytest
+
+from async_weather_sdk.cache import TTLCache
+from async_weather_sdk.keypool import APIKeyPool, LEAST_LOADED
+from async_weather_sdk.qq import QQMap
+
+# 2020-06-01 12:00 UTC+8
+NOON = 1590984000
+
+AD_INFO = {"province": "北京市", "city": "北京市"}
+
+
+def test_key_pool_round_robin(fake_timer):
+    fake_timer.now = NOON
+    pool = APIKeyPool(["KEY_A", "KEY_B", "KEY_C"], clock=fake_timer)
+    assert [pool.acquire() for _ in range(4)] == [
+        "KEY_A",
+        "KEY_B",
+        "KEY_C",
+        "KEY_A",
+    ]
+    for key in ("KEY_A", "KEY_B", "KEY_C", "KEY_A"):
+        pool.release(key)
+
+    # QPS quota exceeded, KEY_B rests for a second
+    assert pool.acquire() == "KEY_B"
+    pool.release("KEY_B", 120)
+    assert [pool.acquire() for _ in range(3)] == ["KEY_C", "KEY_A", "KEY_C"]
+    fake_timer.now += 1
+    assert pool.acquire() == "KEY_A"
+    assert pool.acquire() == "KEY_B"
+
+    # Daily quota exceeded, KEY_C rests until midnight
+    pool.release("KEY_C", 121)
+    assert pool.keys[2].cooldown_until == NOON + 12 * 3600
+    fake_timer.now = NOON + 12 * 3600
+    assert "KEY_C" in [pool.acquire() for _ in range(3)]
+
+    stats = pool.stats()
+    assert stats[1]["key"] == "...EY_B"
+    assert stats[1]["quota_errors"] == 1
+    assert stats[1]["error_rate"] == pytest.approx(1 / 4)
+    assert stats[2]["quota_errors"] == 1
+
+
+def test_key_pool_quotas(fake_timer):
+    fake_timer.now = NOON
+    pool = APIKeyPool(
+        ["KEY_A", "KEY_B"], daily_quota=2, daily_cooldown=60, clock=fake_timer
+    )
+    assert [pool.acquire() for _ in range(4)] == [
+        "KEY_A",
+        "KEY_B",
+        "KEY_A",
+        "KEY_B",
+    ]
+    # Every key used its quota, the pool falls back to the first one
+    assert pool.acquire() == "KEY_A"
+    fake_timer.now += 24 * 3600
+    assert pool.acquire() == "KEY_B"
+    assert pool.keys[1].used_today == 1
+
+    pool.release("KEY_A", 121)
+    assert pool.keys[0].cooldown_until == fake_timer.now + 60
+
+    with pytest.raises(ValueError, match="At least one API key"):
+        APIKeyPool([])
+    with pytest.raises(ValueError, match="Duplicate API keys"):
+        APIKeyPool(["KEY_A", "KEY_B", "KEY_A"])
+    with pytest.raises(ValueError, match="Unknown key selection strategy"):
+        APIKeyPool(["KEY_A"], strategy="random")
+
+
+def test_key_pool_least_loaded():
+    pool = APIKeyPool(["KEY_A", "KEY_B"], strategy=LEAST_LOADED)
+    assert pool.acquire() == "KEY_A"
+    assert pool.acquire() == "KEY_B"
+    pool.release("KEY_B")
+    assert pool.acquire() == "KEY_B"
+    assert pool.acquire() == "KEY_A"
+    assert [s["in_flight"] for s in pool.stats()] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_qq_map_key_pool(aresponses):
+    keys = []
+
+    async def handler(request):
+        keys.append(request.query["key"])
+        if request.query["key"] == "KEY_A":
+            return aresponses.Response(
+                text='{"status": 120, "message": "QPS exceeded"}',
+                headers={"Content-Type": "application/json"},
+            )
+        return aresponses.Response(
+            text='{"status": 0, "result": {"ad_info": {"city": "x"}}}',
+            headers={"Content-Type": "application/json"},
+        )
+
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/location/v1/ip",
+        "GET",
+        handler,
+        repeat=3,
+    )
+
+    async with QQMap(["KEY_A", "KEY_B"]) as qq_map:
+        assert qq_map.api_key == "KEY_A"
+        for i in range(3):
+            await qq_map.location_lookup(f"61.135.{i}.1")
+
+    assert keys == ["KEY_A", "KEY_B", "KEY_B"]
+    stats = qq_map.key_pool.stats()
+    assert stats[0]["quota_errors"] == 1
+    assert stats[1]["requests"] == 2
+    assert stats[1]["errors"] == 0
+
+
+@pytest.mark.asyncio
+async def test_qq_map_key_pool_quota_not_cached(aresponses, fake_timer):
+    keys = []
+
+    async def handler(request):
+        keys.append(request.query["key"])
+        status = 120 if request.query["key"] == "KEY_A" else 0
+        return aresponses.Response(
+            body=json.dumps(dict(status=status, result={"ad_info": AD_INFO})),
+            headers={"Content-Type": "application/json"},
+        )
+
+    aresponses.add(
+        "apis.map.qq.com", "/ws/location/v1/ip", "GET", handler, repeat=2
+    )
+
+    cache = TTLCache(ttl=86400, timer=fake_timer)
+    async with QQMap(
+        ["KEY_A", "KEY_B"], geocode_cache=cache, negative_ttl=60
+    ) as qq_map:
+        assert await qq_map.location_lookup_by_ip("61.135.17.68") == {}
+        # The quota failure is not cached, the next key gets a chance
+        res = await qq_map.location_lookup_by_ip("61.135.17.68")
+        assert res == AD_INFO
+        assert await qq_map.location_lookup_by_ip("61.135.17.68") == res
+
+    assert keys == ["KEY_A", "KEY_B"]
+    assert cache.stats()["size"] == 1
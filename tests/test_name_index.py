@@ -0,0 +1,132 @@
+import pytest
+
+from async_weather_sdk.district import DistrictSnapshot
+from async_weather_sdk.names import normalize_name, strip_suffix
+from async_weather_sdk.qq import QQMap
+
+
+@pytest.fixture
+def name_index(qq_district_list_resp):
+    return DistrictSnapshot.from_api_result(
+        qq_district_list_resp["result"]
+    ).to_name_index()
+
+
+def test_normalize_name():
+    assert normalize_name(" Bei Jing ") == "beijing"
+    assert normalize_name("ＢＥＩ·jing") == "beijing"
+    assert strip_suffix("朝阳区") == "朝阳"
+    assert strip_suffix("新疆维吾尔自治区") == "新疆"
+    assert strip_suffix("东区") == "东区"
+
+
+def test_name_index_lookup(name_index):
+    def adcode(keyword):
+        ad_info = name_index.lookup(keyword)
+        return ad_info and ad_info["adcode"]
+
+    assert adcode("北京市") == 110000
+    assert adcode("北京") == 110000
+    assert adcode("beijing") == 110000
+    assert adcode("Bei Jing") == 110000
+    assert adcode("朝阳") == 110105
+    assert adcode("北京朝阳") == 110105
+    assert adcode("北京市朝阳区") == 110105
+    assert adcode("长安") == 130102
+    assert adcode("石家庄长安区") == 130102
+    assert adcode("shijiazhuang") == 130100
+
+    # Provinces rank before cities of the same name
+    assert adcode("吉林") == 220000
+    assert adcode("jilin") == 220000
+    assert adcode("吉林市") == 220200
+    assert adcode("吉林昌邑") == 220202
+
+    # Prefix matches only apply without exact matches
+    assert adcode("石家") == 130100
+    assert adcode("石") is None
+    assert adcode("上海") is None
+    assert adcode("") is None
+
+    assert name_index.hits == 15
+    assert name_index.misses == 3
+
+    # The (province, city) pair the weather API is queried with
+    def city(keyword):
+        ad_info = name_index.lookup(keyword)
+        return ad_info["province"], ad_info["city"]
+
+    assert city("北京市") == ("北京市", "北京市")
+    assert city("北京") == ("北京市", "北京市")
+    assert city("beijing") == ("北京市", "北京市")
+    assert city("北京朝阳") == ("北京市", "北京市")
+    assert city("河北") == ("河北省", "石家庄市")
+    assert city("吉林") == ("吉林省", "吉林市")
+    assert name_index.lookup("吉林市") == {
+        "nation": "中国",
+        "province": "吉林省",
+        "city": "吉林市",
+        "district": "",
+        "adcode": 220200,
+    }
+
+
+def test_name_index_search(name_index):
+    assert [d["adcode"] for d in name_index.search("吉林")] == [220000, 220200]
+    assert [d["adcode"] for d in name_index.search("ji")] == [220000, 220200]
+    assert name_index.search("吉林", limit=1)[0]["adcode"] == 220000
+
+
+@pytest.mark.asyncio
+async def test_qq_map_name_index(aresponses, name_index):
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/district/v1/search",
+        "GET",
+        aresponses.Response(
+            text='{"status": 0, "result": []}',
+            headers={"Content-Type": "application/json"},
+        ),
+    )
+
+    async with QQMap("fake_key", name_index=name_index) as qq_map:
+        res = await qq_map.location_lookup("北京朝阳")
+        assert res["adcode"] == 110105
+        assert res["district"] == "朝阳区"
+        res["city"] = "changed"
+        assert name_index.lookup("朝阳")["city"] == "北京市"
+
+        res = await qq_map.location_lookup("北京")
+        assert (res["province"], res["city"]) == ("北京市", "北京市")
+
+        # Unknown names fall back to the district search API
+        assert await qq_map.location_lookup("上海") == {}
+
+    aresponses.assert_all_requests_matched()
+
+
+@pytest.mark.asyncio
+async def test_qq_map_name_index_without_city(
+    aresponses, qq_district_list_resp
+):
+    result = qq_district_list_resp["result"]
+    del result[0][1]["location"]
+    name_index = DistrictSnapshot.from_api_result(result).to_name_index()
+    assert name_index.search("河北") == []
+
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/district/v1/search",
+        "GET",
+        aresponses.Response(
+            text='{"status": 0, "result": []}',
+            headers={"Content-Type": "application/json"},
+        ),
+    )
+
+    async with QQMap("fake_key", name_index=name_index) as qq_map:
+        # A province without a known city is geocoded online
+        assert await qq_map.location_lookup("河北") == {}
+        assert name_index.misses == 1
+
+    aresponses.assert_all_requests_matched()
@@ -0,0 +1,191 @@
+import asyncio
+import pytest
+
+from async_weather_sdk.cache import TTLCache
+from async_weather_sdk.district import DistrictSnapshot
+from async_weather_sdk.planner import (
+    ADCODE,
+    COORDINATES,
+    IP,
+    NAME,
+    LookupPlan,
+    classify_query,
+)
+from async_weather_sdk.qq import QQMap
+
+
+def test_classify_query():
+    assert classify_query("61.135.17.68") == (IP, [("ip", "61.135.17.68")])
+    assert classify_query("39.90469,116.40717") == (
+        COORDINATES,
+        [("coordinates", "39.90469,116.40717")],
+    )
+    assert classify_query(" 39.9, 116.4 ") == (
+        COORDINATES,
+        [("coordinates", "39.9,116.4")],
+    )
+    assert classify_query("110105") == (ADCODE, [("adcode", "110105")])
+    assert classify_query("北京市") == (NAME, [("keyword", "北京市")])
+
+    # Invalid addresses and coordinates are names
+    assert classify_query("999.1.1.1")[0] == NAME
+    assert classify_query("95.0,200.0")[0] == NAME
+
+    # An address inside other text is ambiguous
+    assert classify_query("北京 61.135.17.68") == (
+        IP,
+        [("ip", "61.135.17.68"), ("keyword", "北京 61.135.17.68")],
+    )
+
+
+def test_lookup_plan():
+    plan = LookupPlan("61.135.17.68", speculative=True)
+    assert not plan.speculative
+    # Without planning a failed IP lookup fell back to a district search
+    assert plan.legacy_calls == 2
+    plan.upstream_calls = 1
+    assert plan.avoided == 1
+    plan.winner = "ip"
+    assert plan.legacy_calls == 1
+    assert plan.avoided == 0
+    assert LookupPlan("北京 61.135.17.68", speculative=True).speculative
+
+    # Names were searched, then geocoded
+    plan = LookupPlan("北京市")
+    plan.winner = "keyword"
+    assert plan.legacy_calls == 2
+    assert plan.avoided == 2
+
+
+def _fake_strategies(qq_map, calls, **results):
+    for name, (delay, result) in results.items():
+
+        async def lookup(
+            argument,
+            priority=None,
+            deadline=None,
+            plan=None,
+            name=name,
+            delay=delay,
+            result=result,
+        ):
+            calls.append(name)
+            plan.upstream_calls += 1
+            await asyncio.sleep(delay)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        setattr(qq_map, f"location_lookup_by_{name}", lookup)
+
+
+@pytest.mark.asyncio
+async def test_qq_map_plan_runs_matching_strategy_only():
+    calls = []
+    qq_map = QQMap("API_KEY")
+    _fake_strategies(
+        qq_map,
+        calls,
+        ip=(0, {}),
+        coordinates=(0, {}),
+        adcode=(0, {}),
+        keyword=(0, {"adcode": 110000}),
+    )
+
+    plan = qq_map.plan_lookup("61.135.17.68")
+    assert await qq_map.run_plan(plan) == {}
+    assert calls == ["ip"]
+    assert plan.avoided == 1
+
+    calls.clear()
+    plan = qq_map.plan_lookup("北京 61.135.17.68")
+    assert await qq_map.run_plan(plan) == {"adcode": 110000}
+    assert calls == ["ip", "keyword"]
+    assert plan.winner == "keyword"
+    assert plan.avoided == 1
+
+    assert qq_map.planned_lookups == 2
+    assert qq_map.avoided_lookups == 2
+
+
+@pytest.mark.asyncio
+async def test_qq_map_speculative_lookup():
+    calls = []
+    qq_map = QQMap("API_KEY", speculative_lookups=True)
+    _fake_strategies(
+        qq_map, calls, ip=(1, {"adcode": 1}), keyword=(0, {"adcode": 2})
+    )
+
+    plan = qq_map.plan_lookup("北京 61.135.17.68")
+    assert await qq_map.run_plan(plan) == {"adcode": 2}
+    assert sorted(calls) == ["ip", "keyword"]
+    assert plan.winner == "keyword"
+    assert plan.cancelled == ["ip"]
+    assert qq_map.cancelled_lookups == 1
+    assert plan.upstream_calls == 2
+    assert plan.avoided == plan.legacy_calls - 2
+
+    # Empty results wait for the other strategies
+    _fake_strategies(qq_map, calls, ip=(0.01, {"adcode": 1}), keyword=(0, {}))
+    assert await qq_map.location_lookup("北京 61.135.17.68") == {"adcode": 1}
+
+    # The first error in plan order is raised when nothing succeeds
+    _fake_strategies(qq_map, calls, ip=(0, ValueError("ip")), keyword=(0, {}))
+    with pytest.raises(ValueError, match="ip"):
+        await qq_map.location_lookup("北京 61.135.17.68")
+
+    # Unambiguous queries are not speculative
+    plan = qq_map.plan_lookup("北京市")
+    assert not plan.speculative
+
+
+@pytest.mark.asyncio
+async def test_qq_map_plan_avoided_calls(aresponses, qq_district_list_resp):
+    ad_info = {"province": "上海市", "city": "上海市", "adcode": 310101}
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/location/v1/ip",
+        "GET",
+        response={"status": 0, "result": {"ad_info": ad_info}},
+    )
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/district/v1/search",
+        "GET",
+        response={
+            "status": 0,
+            "result": [[{"location": {"lat": 31.23, "lng": 121.47}}]],
+        },
+    )
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/geocoder/v1",
+        "GET",
+        response={"status": 0, "result": {"ad_info": ad_info}},
+    )
+
+    snapshot = DistrictSnapshot.from_api_result(
+        qq_district_list_resp["result"]
+    )
+    async with QQMap(
+        "API_KEY",
+        districts=snapshot,
+        name_index=snapshot.to_name_index(),
+        geocode_cache=TTLCache(),
+    ) as qq_map:
+        avoided = {}
+        for query in (
+            "110105",  # snapshot, instead of a search and a geocode
+            "北京朝阳",  # name index, instead of a search and a geocode
+            "61.135.17.68",  # IP lookup, as before
+            "61.135.17.1",  # geocode cache, instead of an IP lookup
+            "上海",  # search and geocode, as before
+        ):
+            plan = qq_map.plan_lookup(query)
+            assert await qq_map.run_plan(plan)
+            avoided[query] = plan.avoided
+
+    assert list(avoided.values()) == [2, 2, 0, 1, 0]
+    assert qq_map.planned_lookups == 5
+    assert qq_map.avoided_lookups == 5
+    aresponses.assert_all_requests_matched()
@@ -1,3 +1,4 @@
+import json
 import sys
 
 import asyncio
@@ -6,6 +7,8 @@ import pytest
 
 from async_weather_sdk.qq import query_current_weather, query_weather_forecast
 from async_weather_sdk.qq import QQMap, QQWeather
+from async_weather_sdk.cache import TTLCache
+from async_weather_sdk.sections import SectionCache
 
 pytestmark = pytest.mark.asyncio
 
@@ -268,6 +271,146 @@ async def test_qq_weather_sdk_fetch_weather_forecast(
         assert len(res["rise"]) == 1
 
 
+async def test_qq_weather_sdk_cache(aresponses, qq_forecast_resp):
+    aresponses.add(
+        "wis.qq.com", "/weather/common", "GET", response=qq_forecast_resp
+    )
+    aresponses.add(
+        "wis.qq.com",
+        "/weather/common",
+        "GET",
+        response={"status": 311, "message": "key格式错误"},
+    )
+
+    async with aiohttp.ClientSession() as session:
+        cache = TTLCache(maxsize=10, ttl=60)
+        qq_weather = QQWeather(session=session, cache=cache)
+
+        res = await qq_weather.fetch_current_weather("北京市", "北京市")
+        assert "sunrise" in res["rise"]
+
+        res = await qq_weather.fetch_weather(
+            " 北京市", "北京市 ", "air|rise|observe|tips|limit|alarm|index"
+        )
+        assert res["rise"]["0"]["sunrise"] == "04:47"
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+        res = await qq_weather.fetch_weather("北京市", "北京市", "observe")
+        assert res == {}
+        assert len(cache) == 1
+
+
+async def test_qq_weather_sdk_batching(aresponses, qq_forecast_resp):
+    weather_types = []
+
+    async def response_handler(request):
+        weather_types.append(request.query["weather_type"])
+        return aresponses.Response(
+            text=json.dumps(qq_forecast_resp),
+            headers={"CONTENT-TYPE": "application/json"},
+        )
+
+    aresponses.add(
+        "wis.qq.com", "/weather/common", "GET", response_handler, repeat=2
+    )
+
+    async with QQWeather(batch_window=0.01) as qq_weather:
+        current, forecast, other = await asyncio.gather(
+            qq_weather.fetch_current_weather("北京市", "北京市"),
+            qq_weather.fetch_weather_forecast("北京市", "北京市", 1),
+            qq_weather.fetch_weather("上海市", "上海市", "observe"),
+        )
+
+    assert sorted(weather_types) == [
+        "air|alarm|forecast_1h|index|limit|observe|rise|tips",
+        "observe",
+    ]
+    assert "observe" in current
+    assert "forecast_1h" not in current
+    assert len(forecast["forecast"]) == 25
+    assert list(other) == ["observe"]
+
+
+async def test_qq_weather_sdk_batching_error(aresponses):
+    aresponses.add(
+        "wis.qq.com",
+        "/weather/common",
+        "GET",
+        response=aresponses.Response(status=500),
+    )
+
+    async with QQWeather(batch_window=0.01) as qq_weather:
+        results = await asyncio.gather(
+            qq_weather.fetch_weather("北京市", "北京市", "observe"),
+            qq_weather.fetch_weather("北京市", "北京市", "air"),
+            return_exceptions=True,
+        )
+
+    assert all(isinstance(r, aiohttp.ClientResponseError) for r in results)
+
+
+async def test_qq_weather_sdk_section_cache(aresponses, qq_forecast_resp):
+    weather_types = []
+
+    async def response_handler(request):
+        weather_type = request.query["weather_type"]
+        weather_types.append(weather_type)
+        data = qq_forecast_resp["data"]
+        resp = dict(
+            qq_forecast_resp,
+            data={t: data[t] for t in weather_type.split("|")},
+        )
+        return aresponses.Response(
+            text=json.dumps(resp), headers={"CONTENT-TYPE": "application/json"}
+        )
+
+    aresponses.add(
+        "wis.qq.com", "/weather/common", "GET", response_handler, repeat=3
+    )
+
+    section_cache = SectionCache(ttls=dict(observe=0))
+    async with QQWeather(section_cache=section_cache) as qq_weather:
+        await qq_weather.fetch_current_weather("北京市", "北京市")
+        res = await qq_weather.fetch_current_weather("北京市", "北京市")
+        assert "sunrise" in res["rise"]
+        assert "observe" in res
+
+        await qq_weather.fetch_weather_forecast("北京市", "北京市")
+
+        assert qq_weather.next_update_time("北京市", "北京市", "air") is None
+        assert QQWeather().next_update_time("北京市", "北京市", "air") is None
+
+    assert weather_types == [
+        "air|alarm|index|limit|observe|rise|tips",
+        "observe",
+        "forecast_24h",
+    ]
+
+
+async def test_qq_weather_sdk_stale_if_error(
+    aresponses, qq_forecast_resp, fake_timer
+):
+    aresponses.add(
+        "wis.qq.com", "/weather/common", "GET", response=qq_forecast_resp
+    )
+    aresponses.add(
+        "wis.qq.com",
+        "/weather/common",
+        "GET",
+        response=aresponses.Response(status=502),
+    )
+
+    cache = TTLCache(ttl=60, timer=fake_timer, stale_if_error=600)
+    async with QQWeather(cache=cache) as qq_weather:
+        await qq_weather.fetch_current_weather("北京市", "北京市")
+
+        fake_timer.now = 120
+        res = await qq_weather.fetch_current_weather("北京市", "北京市")
+        assert "observe" in res
+        assert cache.stale_errors == 1
+
+
 async def test_qq_map_wrong_api_key(aresponses):
     aresponses.add(
         "apis.map.qq.com",
@@ -465,6 +608,53 @@ async def test_qq_map_location_lookup_by_keyword(aresponses):
         assert res == {}
 
 
+async def test_qq_map_geocode_cache(aresponses, fake_timer):
+    ad_info = {"province": "北京市", "city": "北京市", "adcode": 110000}
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/location/v1/ip",
+        "GET",
+        response={"status": 0, "result": {"ad_info": ad_info}},
+    )
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/geocoder/v1",
+        "GET",
+        response={"status": 0, "result": {"ad_info": ad_info}},
+    )
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/district/v1/search",
+        "GET",
+        response={"status": 0, "message": "query ok", "result": []},
+        repeat=2,
+    )
+
+    cache = TTLCache(ttl=86400, timer=fake_timer)
+    async with QQMap(
+        "API_KEY", geocode_cache=cache, negative_ttl=60
+    ) as qq_map:
+        assert await qq_map.location_lookup_by_ip("61.135.17.68") == ad_info
+        assert await qq_map.location_lookup_by_ip("61.135.17.1") == ad_info
+
+        res = await qq_map.location_lookup_by_coordinates("39.90469,116.40717")
+        assert res == ad_info
+        res = await qq_map.location_lookup_by_coordinates("39.9012, 116.4079")
+        assert res == ad_info
+        res["city"] = "changed"
+
+        assert await qq_map.location_lookup_by_keyword("Nowhere") == {}
+        assert await qq_map.location_lookup_by_keyword(" ＮＯ where") == {}
+        fake_timer.now = 60
+        assert await qq_map.location_lookup_by_keyword("nowhere") == {}
+
+        assert cache.stats()["hits"] == 3
+        assert cache.stats()["misses"] == 4
+
+    assert qq_map._coordinates_key("north") == ("coordinates", "north")
+    aresponses.assert_all_requests_matched()
+
+
 @pytest.fixture()
 def mock_location_lookup_by_ip(mocker):
     future = asyncio.Future()
@@ -0,0 +1,105 @@
+import asyncio
+import pytest
+
+from async_weather_sdk.qq import QQMap
+from async_weather_sdk.ratelimit import RateLimiter, TokenBucket
+
+
+def test_token_bucket_reserve(fake_timer):
+    bucket = TokenBucket(2, capacity=2, timer=fake_timer)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # Later callers reserve later tokens
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+
+    fake_timer.now += 10
+    assert bucket.reserve() == 0
+    assert bucket.tokens == 1
+
+    with pytest.raises(ValueError, match="Rate must be positive"):
+        TokenBucket(0)
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_fifo():
+    bucket = TokenBucket(100, capacity=1)
+    order = []
+
+    async def acquire(i):
+        await bucket.acquire()
+        order.append(i)
+
+    await asyncio.gather(*(acquire(i) for i in range(5)))
+    assert order == [0, 1, 2, 3, 4]
+
+    stats = bucket.stats()
+    assert stats["acquired"] == 5
+    assert stats["waited"] == 4
+    assert stats["max_queue_depth"] == 4
+    assert stats["queue_depth"] == 0
+    assert stats["max_wait"] == pytest.approx(0.04, abs=0.005)
+    assert stats["mean_wait"] > 0
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_cancel():
+    bucket = TokenBucket(10, capacity=1)
+    await bucket.acquire()
+
+    first = asyncio.ensure_future(bucket.acquire())
+    last = asyncio.ensure_future(bucket.acquire())
+    await asyncio.sleep(0)
+    assert bucket.queue_depth == 2
+
+    # Cancelled waiters at the end of the line hand their tokens back
+    last.cancel()
+    first.cancel()
+    await asyncio.gather(first, last, return_exceptions=True)
+    assert bucket.queue_depth == 0
+    assert bucket.tokens == pytest.approx(0, abs=0.1)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_budgets(aresponses):
+    limiter = RateLimiter({"apis.map.qq.com": (50, 1)})
+    assert limiter.bucket("wis.qq.com") is None
+    assert await limiter.acquire("wis.qq.com") == 0
+
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/location/v1/ip",
+        "GET",
+        response={"status": 0, "result": {"ad_info": {"city": "x"}}},
+        repeat=6,
+    )
+    async with QQMap("KEY_AAAA", rate_limiter=limiter) as qq_map, QQMap(
+        "KEY_BBBB", rate_limiter=limiter
+    ) as other_map:
+        await asyncio.gather(
+            *(qq_map.location_lookup(f"61.135.17.{i}") for i in range(1, 4)),
+            other_map.location_lookup("61.135.17.1"),
+        )
+
+    stats = limiter.stats()
+    assert sorted(stats) == [
+        "apis.map.qq.com/...AAAA",
+        "apis.map.qq.com/...BBBB",
+    ]
+    assert stats["apis.map.qq.com/...AAAA"]["acquired"] == 3
+    assert stats["apis.map.qq.com/...AAAA"]["waited"] == 2
+    assert stats["apis.map.qq.com/...BBBB"]["waited"] == 0
+
+    # Keys ending alike still get a budget each
+    limiter = RateLimiter({"apis.map.qq.com": (50, 1)})
+    async with QQMap("ONE_AAAA", rate_limiter=limiter) as qq_map, QQMap(
+        "TWO_AAAA", rate_limiter=limiter
+    ) as other_map:
+        await asyncio.gather(
+            qq_map.location_lookup("61.135.17.1"),
+            other_map.location_lookup("61.135.17.2"),
+        )
+    assert {key: b.waited for (_, key), b in limiter.buckets.items()} == {
+        "ONE_AAAA": 0,
+        "TWO_AAAA": 0,
+    }
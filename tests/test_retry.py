@@ -0,0 +1,158 @@
+import asyncio
+import itertools
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from async_weather_sdk.base import BaseClient
+from async_weather_sdk.retry import LatencyTracker, RetryPolicy, is_retriable
+
+
+def _response_error(status):
+    return aiohttp.ClientResponseError(None, (), status=status)
+
+
+def test_is_retriable():
+    assert is_retriable(aiohttp.ServerDisconnectedError())
+    assert is_retriable(asyncio.TimeoutError())
+    assert is_retriable(_response_error(503))
+    assert not is_retriable(_response_error(404))
+    assert not is_retriable(ValueError())
+
+
+def test_retry_policy_backoff():
+    policy = RetryPolicy(backoff=0.1, max_backoff=0.3, random=lambda: 0.5)
+    assert policy.backoff_delay(1) == pytest.approx(0.05)
+    assert policy.backoff_delay(2) == pytest.approx(0.1)
+    assert policy.backoff_delay(5) == pytest.approx(0.15)
+
+    policy = RetryPolicy(backoff=0.1, jitter=0, random=lambda: 0.5)
+    assert policy.backoff_delay(2) == pytest.approx(0.2)
+
+    tracker = LatencyTracker(window=10)
+    assert tracker.percentile(0.5) is None
+    for latency in range(20):
+        tracker.add(latency)
+    assert len(tracker) == 10
+    assert tracker.percentile(0.5) == 15
+    assert tracker.percentile(1) == 19
+
+    with pytest.raises(ValueError, match="Attempts must be at least 1"):
+        RetryPolicy(attempts=0)
+
+
+@pytest.mark.asyncio
+async def test_retry_policy_call():
+    errors = [_response_error(502), aiohttp.ServerDisconnectedError()]
+
+    async def flaky():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    policy = RetryPolicy(attempts=3, backoff=0.001)
+    assert await policy.call(flaky) == "ok"
+    assert policy.retries == 2
+
+    # Errors that cannot succeed later are raised at once
+    errors[:] = [_response_error(404)]
+    with pytest.raises(aiohttp.ClientResponseError):
+        await policy.call(flaky)
+    assert policy.retries == 2
+
+    # Attempts are capped
+    errors[:] = [asyncio.TimeoutError()] * 3
+    with pytest.raises(asyncio.TimeoutError):
+        await policy.call(flaky)
+    assert policy.retries == 4
+
+    # So are retries across requests
+    policy = RetryPolicy(
+        attempts=5, backoff=0.001, budget_ratio=0.5, budget_reserve=2
+    )
+    errors[:] = [asyncio.TimeoutError()] * 4
+    with pytest.raises(asyncio.TimeoutError):
+        await policy.call(flaky)
+    assert policy.retries == 2
+    assert policy.budget_exhausted == 1
+    assert policy.stats()["tokens"] == 0
+
+
+async def _start_server(handler):
+    app = web.Application()
+    app.router.add_get("/", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}/"
+
+
+def _p99(latencies):
+    ordered = sorted(latencies)
+    return ordered[int(0.99 * len(ordered)) - 1]
+
+
+@pytest.mark.asyncio
+async def test_retry_against_server():
+    counter = itertools.count()
+
+    async def handler(request):
+        # Every other request fails with a 503
+        if next(counter) % 2 == 0:
+            raise web.HTTPServiceUnavailable()
+        return web.json_response({"status": 0})
+
+    runner, url = await _start_server(handler)
+    try:
+        policy = RetryPolicy(backoff=0.001)
+        async with BaseClient(url, retry_policy=policy) as client:
+            for _ in range(5):
+                assert await client.request("/") == {"status": 0}
+        assert policy.retries == 5
+
+        async with BaseClient(url) as client:
+            with pytest.raises(aiohttp.ClientResponseError):
+                await client.request("/")
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_hedging_improves_p99():
+    counter = itertools.count()
+
+    async def handler(request):
+        # One request in ten stalls for 200ms
+        stall = next(counter) % 10 == 9
+        await asyncio.sleep(0.2 if stall else 0.002)
+        return web.json_response({"status": 0})
+
+    async def measure(client):
+        latencies = []
+        for _ in range(100):
+            started = time.monotonic()
+            await client.request("/")
+            latencies.append(time.monotonic() - started)
+        return _p99(latencies)
+
+    runner, url = await _start_server(handler)
+    try:
+        async with BaseClient(url) as client:
+            baseline = await measure(client)
+
+        policy = RetryPolicy(
+            hedge_percentile=0.8, hedge_after=0.05, budget_reserve=20
+        )
+        async with BaseClient(url, retry_policy=policy) as client:
+            hedged = await measure(client)
+    finally:
+        await runner.cleanup()
+
+    assert baseline >= 0.2
+    assert hedged < baseline / 2
+    assert policy.hedges >= 10
+    assert policy.hedge_wins >= 9
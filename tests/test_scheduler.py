@@ -0,0 +1,171 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import web
+
+from async_weather_sdk.base import BaseClient
+from async_weather_sdk.qq import QQWeather
+from async_weather_sdk.scheduler import (
+    BACKGROUND,
+    INTERACTIVE,
+    NORMAL,
+    PriorityScheduler,
+    most_urgent,
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+async def _acquire(scheduler, ticket, order, name):
+    await scheduler.acquire(ticket)
+    order.append(name)
+
+
+async def test_scheduler_weighted_fair_queuing():
+    scheduler = PriorityScheduler(
+        concurrency=2, reserved=0, weights={INTERACTIVE: 2, BACKGROUND: 1}
+    )
+    order = []
+    tickets = {}
+    for name in ("b1", "b2", "b3", "b4", "b5", "b6", "i1", "i2", "i3", "i4"):
+        priority = INTERACTIVE if name[0] == "i" else BACKGROUND
+        tickets[name] = scheduler.ticket(priority)
+        asyncio.ensure_future(_acquire(scheduler, tickets[name], order, name))
+    await asyncio.sleep(0)
+    assert order == ["b1", "b2"]
+    assert scheduler.stats()[BACKGROUND]["queued"] == 4
+    assert scheduler.stats()[INTERACTIVE]["queued"] == 4
+
+    # Interactive calls get twice the slots, background ones still progress
+    for i in range(8):
+        scheduler.release(tickets[order[i]])
+        await asyncio.sleep(0)
+    assert order[2:] == ["i1", "i2", "i3", "b3", "i4", "b4", "b5", "b6"]
+
+    stats = scheduler.stats()
+    assert stats[INTERACTIVE]["dispatched"] == 4
+    assert stats[BACKGROUND]["running"] == 2
+    assert scheduler.running == 2
+
+    with pytest.raises(ValueError, match="Unknown priority 'urgent'"):
+        scheduler.ticket("urgent")
+    with pytest.raises(ValueError, match="Reserved slots must be less"):
+        PriorityScheduler(concurrency=2, reserved=2)
+
+
+async def test_scheduler_reserved_promote_and_cancel():
+    scheduler = PriorityScheduler(concurrency=3, reserved=1)
+    order = []
+    running = [scheduler.ticket(BACKGROUND) for _ in range(2)]
+    for ticket in running:
+        await scheduler.acquire(ticket)
+
+    # The last slot is kept for interactive calls
+    queued = scheduler.ticket(BACKGROUND)
+    task = asyncio.ensure_future(_acquire(scheduler, queued, order, "b"))
+    await asyncio.sleep(0)
+    assert order == []
+    interactive = scheduler.ticket(INTERACTIVE)
+    await scheduler.acquire(interactive)
+    scheduler.release(interactive)
+    assert order == []
+
+    # A more urgent caller joining the call moves it to the reserved slot
+    scheduler.promote(queued, NORMAL)
+    await asyncio.sleep(0)
+    assert order == []
+    scheduler.promote(queued, INTERACTIVE)
+    scheduler.promote(queued, BACKGROUND)
+    await task
+    assert order == ["b"]
+    assert queued.priority == INTERACTIVE
+    assert scheduler.stats()[INTERACTIVE]["promoted"] == 1
+    scheduler.release(queued)
+
+    # A cancelled call leaves the queue
+    scheduler.release(running.pop())
+    await scheduler.acquire(scheduler.ticket(NORMAL))
+    task = asyncio.ensure_future(
+        scheduler.acquire(scheduler.ticket(BACKGROUND))
+    )
+    await asyncio.sleep(0)
+    task.cancel()
+    scheduler.release(running.pop())
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    stats = scheduler.stats()
+    assert stats[BACKGROUND]["queued"] == 0
+    assert stats[BACKGROUND]["running"] == 0
+    assert scheduler.running == 1
+
+    assert most_urgent([BACKGROUND, NORMAL]) == NORMAL
+
+
+async def test_background_sweep_does_not_delay_live_queries():
+    async def handler(request):
+        await asyncio.sleep(0.02)
+        return web.json_response({"status": 0})
+
+    app = web.Application()
+    app.router.add_get("/", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        scheduler = PriorityScheduler(concurrency=4, reserved=1)
+        async with BaseClient(
+            f"http://127.0.0.1:{port}/", scheduler=scheduler
+        ) as client:
+            sweep = asyncio.ensure_future(
+                asyncio.gather(
+                    *(
+                        client.request(
+                            "/", priority=BACKGROUND, params=dict(i=i)
+                        )
+                        for i in range(60)
+                    )
+                )
+            )
+            await asyncio.sleep(0.01)
+            started = time.monotonic()
+            await client.request("/", priority=INTERACTIVE)
+            latency = time.monotonic() - started
+            await sweep
+    finally:
+        await runner.cleanup()
+
+    # The sweep needs 20 rounds of 3 calls, the live query one round
+    assert latency < 0.1
+    stats = scheduler.stats()
+    assert stats[BACKGROUND]["dispatched"] == 60
+    assert stats[BACKGROUND]["max_wait"] > 0.2
+    assert stats[INTERACTIVE]["max_wait"] < 0.01
+
+
+async def test_qq_weather_priority(aresponses, qq_forecast_resp):
+    aresponses.add(
+        "wis.qq.com",
+        "/weather/common",
+        "GET",
+        response=qq_forecast_resp,
+        repeat=2,
+    )
+
+    scheduler = PriorityScheduler(concurrency=1, reserved=0)
+    async with QQWeather(scheduler=scheduler, priority=BACKGROUND) as client:
+        await client.fetch_current_weather("北京市", "北京市")
+        # A live query joining a pending background call promotes it
+        await asyncio.gather(
+            client.fetch_weather_forecast("上海市", "上海市", 3),
+            client.fetch_weather_forecast(
+                "上海市", "上海市", 3, priority=INTERACTIVE
+            ),
+        )
+
+    stats = scheduler.stats()
+    assert stats[BACKGROUND]["dispatched"] == 1
+    assert stats[INTERACTIVE]["dispatched"] == 1
+    assert stats[INTERACTIVE]["promoted"] == 1
@@ -0,0 +1,173 @@
+from datetime import datetime
+
+import aiohttp
+import asyncio
+import pytest
+
+from async_weather_sdk.deadline import Deadline
+from async_weather_sdk.scheduler import BACKGROUND, INTERACTIVE
+from async_weather_sdk.sections import (
+    CST,
+    DEFAULT_SECTION_TTLS,
+    FreshnessModel,
+    SectionCache,
+    parse_update_time,
+)
+
+
+def test_section_cache_per_section_ttl(fake_timer):
+    cache = SectionCache(
+        ttls=dict(observe=60), timer=fake_timer, clock=lambda: 1590969600
+    )
+    cache.set_sections("北京市", "北京市", dict(observe={"degree": "29"}))
+    cache.set_sections("北京市", "北京市", dict(forecast_1h={}, other=1))
+
+    data, missing = cache.get_sections(
+        "北京市", "北京市", ["observe", "forecast_1h", "air"]
+    )
+    assert data == dict(observe={"degree": "29"}, forecast_1h={})
+    assert missing == ["air"]
+
+    fake_timer.now = 60
+    data, missing = cache.get_sections(
+        "北京市", "北京市", ["observe", "forecast_1h", "other"]
+    )
+    assert data == dict(forecast_1h={}, other=1)
+    assert missing == ["observe"]
+    assert cache.stats()["hits"] == 4
+
+
+def test_section_cache_daily_sections_expire_at_midnight():
+    # 2020-06-01 23:00:00 UTC+8
+    cache = SectionCache(clock=lambda: 1591023600)
+    assert cache.ttl("rise") == 60 * 60
+    assert cache.ttl("forecast_24h") == 3 * 60 * 60
+    assert cache.ttl("unknown") == cache.default_ttl
+
+
+def test_parse_update_time():
+    assert parse_update_time("202006011323") == datetime(
+        2020, 6, 1, 13, 23, tzinfo=CST
+    )
+    assert parse_update_time("20200601130000").hour == 13
+    assert parse_update_time("2020-06-01 06:40").minute == 40
+    assert parse_update_time("") is None
+    assert parse_update_time(None) is None
+    assert parse_update_time("2020060113xx") is None
+
+
+def test_freshness_model(qq_forecast_resp):
+    data = qq_forecast_resp["data"]
+    # 2020-06-01 13:25:00 UTC+8
+    model = FreshnessModel(margins=dict(observe=30), clock=lambda: 1590989100)
+
+    assert model.next_update("observe", data["observe"]) == datetime(
+        2020, 6, 1, 13, 33, tzinfo=CST
+    )
+    assert model.ttl("observe", data["observe"]) == 8 * 60 + 30
+    assert model.next_update("forecast_1h", data["forecast_1h"]) == datetime(
+        2020, 6, 1, 14, tzinfo=CST
+    )
+    # Old payloads are predicted at the next slot, not in the past
+    assert model.next_update("air", data["air"]) == datetime(
+        2020, 6, 1, 14, tzinfo=CST
+    )
+    assert model.ttl("air", data["air"]) == 35 * 60 + 60
+    # Alarm issue times are not publish times, they keep the fixed TTL
+    assert model.next_update("alarm", data["alarm"]) is None
+    assert model.ttl("alarm", data["alarm"]) is None
+    assert model.next_update("index", data["index"]) is None
+    assert model.ttl("index", data["index"]) is None
+
+
+def test_freshness_model_rolls_forward(qq_forecast_resp):
+    observe = qq_forecast_resp["data"]["observe"]
+    now = [datetime(2020, 6, 1, 14, tzinfo=CST).timestamp()]
+    model = FreshnessModel(margins=dict(observe=30), clock=lambda: now[0])
+
+    assert model.next_update("observe", observe) == datetime(
+        2020, 6, 1, 14, 3, tzinfo=CST
+    )
+    assert model.ttl("observe", observe) == 3 * 60 + 30
+
+    # The upstream is late within the margin, retry soon
+    now[0] = datetime(2020, 6, 1, 13, 33, 10, tzinfo=CST).timestamp()
+    assert model.next_update("observe", observe) == datetime(
+        2020, 6, 1, 13, 33, tzinfo=CST
+    )
+    assert model.ttl("observe", observe) == model.min_ttl
+
+    # Past the margin the next slot is waited for
+    now[0] += 30
+    assert model.ttl("observe", observe) == 9 * 60 + 50
+
+
+def test_section_cache_with_freshness_model(qq_forecast_resp):
+    data = qq_forecast_resp["data"]
+    clock = lambda: 1590989100  # noqa: E731
+    cache = SectionCache(
+        clock=clock, freshness=FreshnessModel(default_margin=0, clock=clock)
+    )
+    cache.set_sections("北京市", "北京市", data)
+
+    assert cache.cache.stats()["size"] == len(data)
+    assert cache.ttl("observe", data["observe"]) == 8 * 60
+    assert (
+        cache.ttl("forecast_24h", data["forecast_24h"])
+        == DEFAULT_SECTION_TTLS["forecast_24h"]
+    )
+    assert cache.next_update("北京市", "北京市", "observe") == datetime(
+        2020, 6, 1, 13, 33, tzinfo=CST
+    )
+    assert cache.next_update("北京市", "北京市", "tips") is None
+    assert cache.next_update("北京市", "上海市", "observe") is None
+
+
+@pytest.mark.asyncio
+async def test_section_cache_get_or_load(fake_timer):
+    loads, priorities = [], []
+
+    async def loader(sections, priority=None, deadline=None):
+        loads.append(sections)
+        priorities.append((priority, deadline))
+        await asyncio.sleep(0)
+        return {s: len(loads) for s in sections if s != "limit"}
+
+    async def failing_loader(sections, **kwargs):
+        raise aiohttp.ClientConnectionError()
+
+    cache = SectionCache(
+        ttls=dict(observe=10, forecast_24h=100),
+        timer=fake_timer,
+        stale_while_revalidate=10,
+        stale_if_error=30,
+    )
+    sections = ["observe", "forecast_24h"]
+    res = await cache.get_or_load("p", "c", sections, loader)
+    assert res == dict(observe=1, forecast_24h=1)
+
+    # observe is stale: served as is and refreshed once in the background
+    fake_timer.now = 15
+    deadline = Deadline(1)
+    for _ in range(2):
+        res = await cache.get_or_load(
+            "p", "c", sections, loader, priority=INTERACTIVE, deadline=deadline
+        )
+        assert res == dict(observe=1, forecast_24h=1)
+    await asyncio.sleep(0.01)
+    assert loads == [sections, ["observe"]]
+    assert priorities == [(None, None), (BACKGROUND, None)]
+    res = await cache.get_or_load("p", "c", sections, loader)
+    assert res == dict(observe=2, forecast_24h=1)
+    assert cache.stats()["stale_hits"] == 2
+    assert cache.stats()["refreshes"] == 1
+
+    # observe is too old to revalidate, but can be served on error
+    fake_timer.now = 40
+    res = await cache.get_or_load("p", "c", ["observe"], failing_loader)
+    assert res == dict(observe=2)
+    assert cache.stats()["stale_errors"] == 1
+    with pytest.raises(aiohttp.ClientConnectionError):
+        await cache.get_or_load("p", "c", sections + ["air"], failing_loader)
+
+    assert await cache.get_or_load("p", "c", ["limit"], loader) == {}
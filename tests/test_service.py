@@ -0,0 +1,261 @@
+import asyncio
+
+import pytest
+
+from async_weather_sdk.breaker import CircuitBreaker
+from async_weather_sdk.concurrency import AdaptiveLimiter
+from async_weather_sdk.retry import RetryPolicy
+from async_weather_sdk.scheduler import BACKGROUND, INTERACTIVE
+from async_weather_sdk.service import WeatherService
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_weather_service_validation():
+    with pytest.raises(ValueError, match="Please provide tencent map api key"):
+        WeatherService("")
+
+    async with WeatherService("API_KEY") as service:
+        with pytest.raises(ValueError, match="Empty query"):
+            await service.query_current_weather("")
+        with pytest.raises(ValueError, match="Invalid forecast days"):
+            await service.query_weather_forecast("北京市", 8)
+
+
+async def test_weather_service_client_options():
+    retry_policy = RetryPolicy()
+    breaker = CircuitBreaker()
+    limiter = AdaptiveLimiter()
+    async with WeatherService(
+        "API_KEY",
+        retry_policy=retry_policy,
+        circuit_breaker=breaker,
+        concurrency_limiter=limiter,
+        coalesce_requests=False,
+        priority=BACKGROUND,
+        map_options=dict(priority=INTERACTIVE),
+    ) as service:
+        for client in (service.qq_map, service.qq_weather):
+            assert client.retry_policy is retry_policy
+            assert client.circuit_breaker is breaker
+            assert client.concurrency_limiter is limiter
+            assert not client.coalesce_requests
+        # Client specific options win over the shared ones
+        assert service.qq_map.priority == INTERACTIVE
+        assert service.qq_weather.priority == BACKGROUND
+
+
+async def test_weather_service_warmup(aresponses):
+    for host in ("apis.map.qq.com", "wis.qq.com"):
+        aresponses.add(
+            host,
+            "/",
+            "HEAD",
+            response=aresponses.Response(status=200),
+            repeat=2,
+        )
+
+    async with WeatherService(
+        "API_KEY", limit_per_host=4, warmup_connections=2
+    ) as service:
+        session = service.get_session()
+        assert session.connector.limit_per_host == 4
+        assert service.qq_map.get_session() is session
+        assert service.qq_weather.get_session() is session
+
+    assert session.closed
+    aresponses.assert_all_requests_matched()
+
+
+async def test_weather_service_full_report(
+    aresponses, json_handler, qq_ip_location_resp, qq_forecast_resp
+):
+    calls = []
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/location/v1/ip",
+        "GET",
+        json_handler(qq_ip_location_resp, calls),
+    )
+    aresponses.add(
+        "wis.qq.com",
+        "/weather/common",
+        "GET",
+        json_handler(qq_forecast_resp, calls),
+    )
+
+    async with WeatherService("API_KEY") as service:
+        session = service.get_session()
+        assert service.qq_map.get_session() is session
+        assert service.qq_weather.get_session() is session
+
+        res = await service.full_report("61.135.17.68", 3)
+        assert [request.path for request in calls] == [
+            "/ws/location/v1/ip",
+            "/weather/common",
+        ]
+        assert (
+            calls[1].query["weather_type"]
+            == "air|alarm|forecast_24h|index|limit|observe|rise|tips"
+        )
+        assert res["location"]["adcode"] == 110000
+        assert res["current"]["rise"] == {
+            "sunrise": "04:47",
+            "sunset": "19:36",
+            "time": "20200601",
+        }
+        assert res["current"]["observe"]["degree"] == "29"
+        assert len(res["forecast"]["forecast"]) == 4
+        assert len(res["forecast"]["rise"]) == 3
+
+        # Geocoding and weather sections are served from the shared caches
+        current = await service.query_current_weather("61.135.17.68")
+        forecast = await service.query_weather_forecast("61.135.17.68", 3)
+        assert len(calls) == 2
+        assert current == dict(res["current"], location=res["location"])
+        assert forecast == dict(res["forecast"], location=res["location"])
+
+    assert session.closed
+
+
+async def test_weather_service_many():
+    active, peak, located, fetched = [0], [0], [], []
+
+    async def track(value):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.01)
+        active[0] -= 1
+        if value in ("bad", ("Bad", "Bad")):
+            raise ValueError(value)
+
+    async def fake_locate(query, priority=None):
+        located.append(query)
+        await track(query)
+        # Queries resolve to one of three cities, or a failing one
+        city = "Bad" if query == "fails" else f"city{int(query) % 3}"
+        return dict(province=city, city=city)
+
+    async def fake_fetch_weather(province, city, weather_type, priority=None):
+        fetched.append((city, weather_type))
+        await track((province, city))
+        return dict(rise={"0": {"time": city}}, observe=city)
+
+    async with WeatherService("API_KEY") as service:
+        service.locate = fake_locate
+        service.qq_weather.fetch_weather = fake_fetch_weather
+
+        queries = [str(i) for i in range(20)] + ["bad", "fails", "1"]
+        results = await service.query_current_weather_many(
+            queries, concurrency=4
+        )
+        assert peak[0] == 4
+        assert len(located) == 22
+        assert sorted(c for c, _ in fetched) == [
+            "Bad",
+            "city0",
+            "city1",
+            "city2",
+        ]
+        for query, res in zip(queries[:20], results):
+            city = f"city{int(query) % 3}"
+            assert res == dict(
+                observe=city,
+                rise={"time": city},
+                location=dict(province=city, city=city),
+            )
+        assert isinstance(results[20], ValueError)
+        assert isinstance(results[21], ValueError)
+        assert results[22] == results[1]
+        assert results[22] is not results[1]
+
+        stats = service.last_batch_stats
+        assert stats.queries == 23
+        assert stats.located == 22
+        assert stats.groups == 4
+        assert stats.dedup_ratio == pytest.approx(1 - 4 / 22)
+        assert stats.geocode_seconds > 0
+        assert stats.fetch_seconds > 0
+        assert stats.as_dict()["groups"] == 4
+
+        fetched.clear()
+        results = await service.query_weather_forecast_many(
+            ["1", "4", "2"], forecast_days=3
+        )
+        assert fetched == [
+            ("city1", "forecast_24h|rise"),
+            ("city2", "forecast_24h|rise"),
+        ]
+        assert results[0]["forecast"] == []
+        assert results[0]["location"]["city"] == "city1"
+
+        assert await service.query_current_weather_many([]) == []
+        assert service.last_batch_stats.dedup_ratio == 0
+
+        with pytest.raises(ValueError, match="Concurrency must be positive"):
+            await service.query_current_weather_many(["1"], concurrency=0)
+        with pytest.raises(ValueError, match="Invalid forecast days"):
+            await service.query_weather_forecast_many(["1"], 8)
+
+
+async def test_weather_service_stream():
+    started, cancelled = [], []
+
+    async def fake_query(query, *args, priority=None):
+        started.append(query)
+        try:
+            await asyncio.sleep(float(query))
+        except asyncio.CancelledError:
+            cancelled.append(query)
+            raise
+        if query == "0.02":
+            raise ValueError(query)
+        return dict(query=query, args=args)
+
+    async with WeatherService("API_KEY") as service:
+        service.query_current_weather = fake_query
+        service.query_weather_forecast = fake_query
+
+        # Results are yielded in completion order with per-item errors
+        results = [
+            item
+            async for item in service.stream_current_weather(
+                ["0.03", "0.01", "0.02"], concurrency=3
+            )
+        ]
+        assert [query for query, _ in results] == ["0.01", "0.02", "0.03"]
+        assert isinstance(results[1][1], ValueError)
+        assert results[2][1] == dict(query="0.03", args=())
+
+        # A slow consumer holds back new queries
+        started.clear()
+        stream = service.stream_weather_forecast(
+            ["0"] * 20, forecast_days=3, concurrency=2, buffer=1
+        )
+        assert await stream.__anext__() == ("0", dict(query="0", args=(3,)))
+        await asyncio.sleep(0.01)
+        assert len(started) == 4
+
+        # Leaving early cancels the queries in flight
+        await stream.aclose()
+        started.clear()
+        stream = service.stream_current_weather(["0", "1", "1"], concurrency=3)
+        async for query, _ in stream:
+            assert query == "0"
+            break
+        await stream.aclose()
+        assert cancelled == ["1", "1"]
+
+        # Async iterables are consumed too
+        async def queries():
+            for query in ("0.01", "0"):
+                yield query
+
+        results = [
+            query
+            async for query, _ in service.stream_current_weather(queries())
+        ]
+        assert results == ["0", "0.01"]
+
+        with pytest.raises(ValueError, match="Concurrency must be positive"):
+            service.stream_current_weather(["1"], concurrency=0)
@@ -0,0 +1,115 @@
+import asyncio
+import time
+
+import pytest
+
+from async_weather_sdk.cache import TTLCache
+from async_weather_sdk.retry import is_retriable
+from async_weather_sdk.scheduler import BACKGROUND, INTERACTIVE, NORMAL
+from async_weather_sdk.sections import SectionCache
+from async_weather_sdk.service import WeatherService
+from async_weather_sdk.shedding import LoadShedder, LoadShedError
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_shedder_queue_depth():
+    shedder = LoadShedder(max_pending=2)
+    shedder.admit(NORMAL)
+    shedder.admit(BACKGROUND)
+    assert shedder.overloaded
+
+    with pytest.raises(LoadShedError, match="Shed background request") as e:
+        shedder.admit(BACKGROUND)
+    assert e.value.pending == 2
+    assert not is_retriable(e.value)
+
+    # Only the shed priorities are refused
+    shedder.admit(INTERACTIVE)
+    shedder.admit(NORMAL)
+    for _ in range(3):
+        shedder.done()
+    shedder.admit(BACKGROUND)
+
+    stats = shedder.stats()
+    assert stats["pending"] == 2
+    assert stats["max_pending"] == 4
+    assert stats["admitted"] == 5
+    assert stats["shed"] == {BACKGROUND: 1}
+
+
+async def test_shedder_event_loop_lag():
+    shedder = LoadShedder(max_lag=0.02, smoothing=1)
+    shedder.admit(BACKGROUND)
+    shedder.done()
+    # A blocking callback delays everything scheduled behind it
+    time.sleep(0.05)
+    await asyncio.sleep(0)
+    assert shedder.lag >= 0.05
+    with pytest.raises(LoadShedError):
+        shedder.admit(BACKGROUND)
+
+    # The lag decays once the loop keeps up again
+    shedder.smoothing = 0.5
+    for _ in range(10):
+        shedder._probe()
+        await asyncio.sleep(0)
+    assert not shedder.overloaded
+    shedder.admit(BACKGROUND)
+    assert shedder.stats()["shed"] == {BACKGROUND: 1}
+
+
+async def test_service_sheds_to_stale_cache(
+    aresponses, json_handler, qq_ip_location_resp, qq_forecast_resp, fake_timer
+):
+    calls = []
+    aresponses.add(
+        "apis.map.qq.com",
+        "/ws/location/v1/ip",
+        "GET",
+        json_handler(qq_ip_location_resp, calls),
+        repeat=2,
+    )
+    aresponses.add(
+        "wis.qq.com",
+        "/weather/common",
+        "GET",
+        json_handler(qq_forecast_resp, calls),
+        repeat=2,
+    )
+
+    shedder = LoadShedder()
+    geocode_cache = TTLCache(ttl=60, timer=fake_timer, stale_if_overload=3600)
+    section_cache = SectionCache(
+        timer=fake_timer, stale_if_overload=7 * 24 * 60 * 60
+    )
+    async with WeatherService(
+        "API_KEY",
+        geocode_cache=geocode_cache,
+        section_cache=section_cache,
+        load_shedder=shedder,
+    ) as service:
+        expected = await service.query_current_weather("61.135.17.68")
+        assert len(calls) == 2
+
+        fake_timer.now += 600
+        shedder.max_pending = 0
+        # Background queries are answered from expired entries
+        result = await service.query_current_weather(
+            "61.135.17.68", priority=BACKGROUND
+        )
+        assert result["observe"] == expected["observe"]
+        assert len(calls) == 2
+        assert geocode_cache.stale_overloads == 1
+        assert section_cache.stats()["stale_overloads"] == 1
+
+        # Or refused when nothing is cached
+        with pytest.raises(LoadShedError):
+            await service.query_current_weather("1.2.3.4", priority=BACKGROUND)
+
+        # Live queries still reach the upstream
+        await service.query_current_weather("61.135.17.68")
+        assert len(calls) == 4
+
+    assert shedder.stats()["shed"] == {BACKGROUND: 3}
+    assert shedder.pending == 0